@@ -1,8 +1,16 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from profiling import startup_timer
+startup_timer.mark("activity.py loading")
+
+import os
+import socket
+import subprocess
+import sys
 from gettext import gettext as _
 
+import gobject
 import gtk
 
 from sugar.activity import activity
@@ -12,23 +20,62 @@ from sugar.activity.widgets import StopButton
 from sugar.graphics.colorbutton import ColorToolButton
 from sugar.graphics.toolbarbox import ToolbarButton
 from sugar.graphics.toolbutton import ToolButton
+from sugar.graphics.toolcombobox import ToolComboBox
 
 import sugargame.canvas
 
 import reversi
 
+startup_timer.mark("activity.py imported")
+
+COLLAB_SERVICE = 'net.coderanger.olpc.reversi'
+
+# The machine's search speed is measured this many ms after the first
+# frame, and only saved if the measurement had this share of the CPU.
+calibration_delay = 5000
+calibration_min_share = 0.8
+
+level_labels = {
+    'beginner': _('Beginner'),
+    'easy': _('Easy'),
+    'medium': _('Medium'),
+    'hard': _('Hard'),
+    'expert': _('Expert'),
+}
 
 class ReversiActivity(activity.Activity):
     def __init__(self, handle):
         activity.Activity.__init__(self, handle)
+        startup_timer.mark("Activity.__init__")
         self.sound_enable = True
+        self.nodes_per_second = None
         self.game = reversi.ReversiController(self)
+        # Hints come from a position database built with positiondb.py,
+        # if the bundle ships one.
+        positions_path = os.path.join(activity.get_bundle_path(), 'data', 'positions.db')
+        if os.path.exists(positions_path):
+            self.game.open_position_db(positions_path)
         self.build_toolbar()
-        self._pygamecanvas = sugargame.canvas.PygameCanvas(self)
+        startup_timer.mark("toolbar built")
+        # Only the display is started up front; the game starts the mixer
+        # itself once the board is showing.
+        self._pygamecanvas = sugargame.canvas.PygameCanvas(self, modules=[])
+        self._pygamecanvas.translator.set_event_filter(reversi.handled_event_types)
         self.set_canvas(self._pygamecanvas)
         self._pygamecanvas.grab_focus()
         self._pygamecanvas.run_pygame(self.game.run)
 
+        # Sharing
+        self._tubes_chan = None
+        self._collab_started = False
+        self.connect('shared', self._shared_cb)
+        if self.shared_activity:
+            # We are joining a game someone else shared.
+            if self.get_shared():
+                self._joined_cb(self)
+            else:
+                self.connect('joined', self._joined_cb)
+
     def build_toolbar(self):
         toolbar_box = ToolbarBox()
         self.set_toolbar_box(toolbar_box)
@@ -58,6 +105,15 @@ class ReversiActivity(activity.Activity):
         toolbar_box.toolbar.insert(separator, -1)
         separator.show()
 
+        # computer opponent
+        self._level_combo = ToolComboBox(label_text=_('Computer:'))
+        self._level_combo.combo.connect('changed', self._level_changed_cb)
+        toolbar_box.toolbar.insert(self._level_combo, -1)
+
+        separator = gtk.SeparatorToolItem()
+        toolbar_box.toolbar.insert(separator, -1)
+        separator.show()
+
         #current
         item = gtk.ToolItem()
         label = gtk.Label()
@@ -94,6 +150,118 @@ class ReversiActivity(activity.Activity):
 
         self.show_all()
 
+    def fill_level_combo(self):
+        """Offers the difficulty levels that answer within
+        engine.target_latency here; all of them until the machine's speed
+        is known."""
+        import engine
+
+        combo = self._level_combo.combo
+        combo.remove_all()
+        combo.append_item(None, _('Nobody'))
+        levels = range(len(engine.difficulty_levels))
+        if self.nodes_per_second is not None:
+            levels = engine.get_playable_levels(self.nodes_per_second)
+        for level in levels:
+            combo.append_item(level, level_labels[engine.difficulty_levels[level][0]])
+        self.select_level(self.game.computer_level)
+
+    def select_level(self, level):
+        """Shows level in the combo, or the strongest level offered below
+        it if this machine is too slow for it."""
+        combo = self._level_combo.combo
+        if not len(combo.get_model()):
+            # fill_level_combo() will pick up the game's level.
+            return
+        active = 0
+        for index, row in enumerate(combo.get_model()):
+            if row[0] is not None and level is not None and row[0] <= level:
+                active = index
+        combo.set_active(active)
+
+    def _level_changed_cb(self, combo):
+        level = combo.get_value()
+        self.game.post_command('computer_level', self.game.set_computer_level, level)
+
+    def get_calibration_path(self):
+        return os.path.join(self.get_activity_root(), 'data', 'calibration')
+
+    def first_frame_shown(self):
+        """Called by the game once the board is on screen; the rest of
+        starting up waits for this."""
+        self.start_session_log()
+        self.fill_level_combo()
+        self.load_calibration()
+
+    def start_session_log(self):
+        """Keeps a log of the latest session so a slow one can be replayed
+        with "python reversi.py --replay" or "python bench.py replay"."""
+        instance_path = os.path.join(self.get_activity_root(), 'instance')
+        # The log starts from the game on screen now, so keep it next to
+        # the log.
+        data = self.game.save_state()
+        state_path = os.path.join(instance_path, 'last-session.state')
+        try:
+            if data is None:
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+            else:
+                state_file = open(state_path, 'wb')
+                state_file.write(data)
+                state_file.close()
+        except (IOError, OSError), e:
+            print "ReversiActivity.start_session_log() - cannot save the game: %s" % e
+        self.game.record_events(os.path.join(instance_path, 'last-session.sgev'))
+
+    def load_calibration(self):
+        """Reads how fast this machine searches, measuring it the first
+        time once the activity has settled."""
+        try:
+            self.nodes_per_second = float(open(self.get_calibration_path()).read())
+        except (IOError, ValueError):
+            # Sounds are still being decoded just after the first frame.
+            gobject.timeout_add(calibration_delay, self._calibrate)
+            return
+        self.fill_level_combo()
+
+    def _calibrate(self):
+        # A process of its own, timed in CPU time, so neither the game
+        # loop nor the GIL is measured along with the search.
+        command = [sys.executable, '-c',
+                   'import engine; print "%r %r" % engine.measure_nodes_per_second()']
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                       cwd=activity.get_bundle_path())
+        except OSError, e:
+            print "ReversiActivity._calibrate() - cannot measure: %s" % e
+            return False
+        gobject.io_add_watch(process.stdout, gobject.IO_IN | gobject.IO_HUP,
+                             self._calibrated_cb, process)
+        return False
+
+    def _calibrated_cb(self, source, condition, process):
+        output = process.stdout.read()
+        process.stdout.close()
+        process.wait()
+        try:
+            nodes_per_second, share = [float(field) for field in output.split()]
+        except ValueError:
+            print "ReversiActivity._calibrated_cb() - no measurement: %r" % output
+            return False
+        self.nodes_per_second = nodes_per_second
+        if share < calibration_min_share:
+            # Good enough for now, but measured again next time.
+            print "ReversiActivity._calibrated_cb() - machine busy, not saving calibration"
+        else:
+            try:
+                calibration_file = open(self.get_calibration_path(), 'w')
+                calibration_file.write('%f\n' % nodes_per_second)
+                calibration_file.close()
+            except IOError, e:
+                print "ReversiActivity._calibrated_cb() - cannot save calibration: %s" % e
+        self.fill_level_combo()
+        return False
+
     def build_colors_toolbar(self, toolbox):
 
         colors_bar = gtk.Toolbar()
@@ -115,6 +283,7 @@ class ReversiActivity(activity.Activity):
         c.blue = 65535
         _fill_color.set_color(c)
         _fill_color.connect('notify::color', self.color_player1_change)
+        self._player1_color_button = _fill_color
         item.add(_fill_color)
         colors_bar.insert(item, -1)
 
@@ -140,6 +309,7 @@ class ReversiActivity(activity.Activity):
         c.blue = 0
         _fill_color.set_color(c)
         _fill_color.connect('notify::color', self.color_player2_change)
+        self._player2_color_button = _fill_color
         item.add(_fill_color)
         colors_bar.insert(item, -1)
 
@@ -160,6 +330,7 @@ class ReversiActivity(activity.Activity):
         item = gtk.ToolItem()
         _fill_color = ColorToolButton()
         _fill_color.connect('notify::color', self.color_line_change)
+        self._line_color_button = _fill_color
         item.add(_fill_color)
         colors_bar.insert(item, -1)
 
@@ -180,6 +351,7 @@ class ReversiActivity(activity.Activity):
         item = gtk.ToolItem()
         _fill_color = ColorToolButton()
         _fill_color.connect('notify::color', self.color_back_change)
+        self._back_color_button = _fill_color
         item.add(_fill_color)
         colors_bar.insert(item, -1)
 
@@ -200,6 +372,7 @@ class ReversiActivity(activity.Activity):
         item = gtk.ToolItem()
         _fill_color = ColorToolButton()
         _fill_color.connect('notify::color', self.color_board_change)
+        self._board_color_button = _fill_color
         item.add(_fill_color)
         colors_bar.insert(item, -1)
 
@@ -212,32 +385,32 @@ class ReversiActivity(activity.Activity):
         colors_button.show()
 
     def _new_game(self, widget):
-        self.game.handle_restart_button_click()
+        self.game.post_command('new_game', self.game.handle_restart_button_click)
 
     def color_player1_change(self, widget, pspec):
         color = widget.get_color()
         new_color = self.color_to_rgb(color)
-        self.game.set_player1_color(new_color)
+        self.game.post_command('player1_color', self.game.set_player1_color, new_color)
 
     def color_player2_change(self, widget, pspec):
         color = widget.get_color()
         new_color = self.color_to_rgb(color)
-        self.game.set_player2_color(new_color)
+        self.game.post_command('player2_color', self.game.set_player2_color, new_color)
 
     def color_line_change(self, widget, pspec):
         color = widget.get_color()
         new_color = self.color_to_rgb(color)
-        self.game.set_line_color(new_color)
+        self.game.post_command('line_color', self.game.set_line_color, new_color)
 
     def color_back_change(self, widget, pspec):
         color = widget.get_color()
         new_color = self.color_to_rgb(color)
-        self.game.set_back_color(new_color)
+        self.game.post_command('back_color', self.game.set_back_color, new_color)
 
     def color_board_change(self, widget, pspec):
         color = widget.get_color()
         new_color = self.color_to_rgb(color)
-        self.game.set_board_color(new_color)
+        self.game.post_command('board_color', self.game.set_board_color, new_color)
 
     def color_to_rgb(self, color):
         r = color.red *255 / 65535
@@ -245,12 +418,45 @@ class ReversiActivity(activity.Activity):
         b = color.blue *255 / 65535
         return (r, g, b)
 
+    def rgb_to_color(self, rgb):
+        c = gtk.gdk.Color()
+        c.red = rgb[0] * 65535 / 255
+        c.green = rgb[1] * 65535 / 255
+        c.blue = rgb[2] * 65535 / 255
+        return c
+
+    def update_color_buttons(self):
+        theme = self.game.get_theme()
+        self._player1_color_button.set_color(self.rgb_to_color(theme.player1_color))
+        self._player2_color_button.set_color(self.rgb_to_color(theme.player2_color))
+        self._line_color_button.set_color(self.rgb_to_color(theme.line_color))
+        self._back_color_button.set_color(self.rgb_to_color(theme.background_color))
+        self._board_color_button.set_color(self.rgb_to_color(theme.board_color))
+
+    def read_file(self, file_path):
+        data = open(file_path, 'rb').read()
+        try:
+            self.game.restore_state(data)
+        except ValueError, e:
+            print "ReversiActivity.read_file() - ignoring saved game: %s" % e
+            return
+        self.update_color_buttons()
+        self.select_level(self.game.computer_level)
+
+    def write_file(self, file_path):
+        data = self.game.save_state()
+        if data is None:
+            return
+        saved_file = open(file_path, 'wb')
+        saved_file.write(data)
+        saved_file.close()
+
     def set_current_player(self, player):
         self.current_label.set_text(' %s' % player)
 
     def sound_control(self, button):
         self.sound_enable = not self.sound_enable
-        self.game.change_sound(self.sound_enable)
+        self.game.post_command('sound', self.game.change_sound, self.sound_enable)
         if not self.sound_enable:
             button.set_icon('speaker-muted-000')
             button.set_tooltip(_('No sound'))
@@ -258,3 +464,58 @@ class ReversiActivity(activity.Activity):
             button.set_icon('speaker-muted-100')
             button.set_tooltip(_('Sound'))
 
+    def _setup_tubes(self):
+        import telepathy
+        self._tubes_chan = self.shared_activity.telepathy_tubes_chan
+        self._tubes_chan[telepathy.CHANNEL_TYPE_TUBES].connect_to_signal(
+            'NewTube', self._new_tube_cb)
+
+    def _shared_cb(self, activity):
+        # The sharer listens on a local socket and offers it as a stream
+        # tube; the player who joins connects to it through the tube.
+        import collab
+        import telepathy
+        self._setup_tubes()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self._tubes_chan[telepathy.CHANNEL_TYPE_TUBES].OfferStreamTube(
+            COLLAB_SERVICE, {}, telepathy.SOCKET_ADDRESS_TYPE_IPV4,
+            listener.getsockname(), telepathy.SOCKET_ACCESS_CONTROL_LOCALHOST, 0)
+        self._start_collab(collab.SocketTransport(listener=listener),
+                           collab.SHARER_PLAYER)
+
+    def _joined_cb(self, activity):
+        import telepathy
+        self._setup_tubes()
+        self._tubes_chan[telepathy.CHANNEL_TYPE_TUBES].ListTubes(
+            reply_handler=self._list_tubes_reply_cb,
+            error_handler=self._list_tubes_error_cb)
+
+    def _list_tubes_reply_cb(self, tubes):
+        for tube_info in tubes:
+            self._new_tube_cb(*tube_info)
+
+    def _list_tubes_error_cb(self, e):
+        print "ReversiActivity.ListTubes() failed: %s" % e
+
+    def _new_tube_cb(self, tube_id, initiator, tube_type, service, params, state):
+        import collab
+        import telepathy
+        if self._collab_started:
+            return
+        if tube_type != telepathy.TUBE_TYPE_STREAM or service != COLLAB_SERVICE:
+            return
+        address = self._tubes_chan[telepathy.CHANNEL_TYPE_TUBES].AcceptStreamTube(
+            tube_id, telepathy.SOCKET_ADDRESS_TYPE_IPV4,
+            telepathy.SOCKET_ACCESS_CONTROL_LOCALHOST, 0, utf8_strings=True)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((str(address[0]), int(address[1])))
+        self._start_collab(collab.SocketTransport(sock), collab.JOINER_PLAYER)
+
+    def _start_collab(self, transport, local_player):
+        import collab
+
+        self._collab_started = True
+        session = collab.CollabSession(transport, self.game, local_player)
+        self.game.post_command('collab', self.game.set_collab_session, session)
@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# archive.py - Text archives of recorded games.
+#
+# One game per line, its moves written as in rules.format_square(), with or
+# without spaces between them: "f5 d6 c3" or "f5d6c3".  Passes are not
+# written; they follow from the position.  Lines starting with # are
+# comments.
+#
+# Removes games that are copies of each other under a symmetry of the
+# starting position:
+#
+#   python archive.py dedupe games.txt unique.txt
+#
+
+import sys
+
+from optparse import OptionParser
+
+import rules
+import symmetry
+
+
+def parse_game(line, validate=True):
+    """Returns the squares of the game on line; raises ValueError if it does
+    not parse or, if validate is set, if a move is illegal."""
+    text = "".join(line.split())
+    if len(text) % 2:
+        raise ValueError("odd number of characters in %r" % line)
+    # Only coordinates: a square number such as "19" would read as a move
+    # here, and passes are not written.
+    moves = [rules.parse_coordinate(text[i:i + 2]) for i in range(0, len(text), 2)]
+    if validate:
+        replay_game(moves)
+    return moves
+
+
+def replay_game(moves):
+    """Returns the rules.Game after moves; raises ValueError if one is illegal."""
+    game = rules.Game()
+    for square in moves:
+        if square is None:
+            raise ValueError("passes are not written in archives")
+        game.play(square)
+    return game
+
+
+def format_game(moves):
+    return "".join([rules.format_square(square) for square in moves])
+
+
+def read_games(path, validate=True, on_error=None):
+    """Yields the move list of every game in the archive at path.
+
+    Readers that replay the games anyway can skip validate.  A bad line
+    raises ValueError, or with on_error, is passed to on_error(message)
+    and skipped.
+    """
+    for line_number, line in enumerate(open(path)):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            moves = parse_game(line, validate)
+        except ValueError, e:
+            message = "%s:%d: %s" % (path, line_number + 1, e)
+            if on_error is None:
+                raise ValueError(message)
+            on_error(message)
+            continue
+        yield moves
+
+
+def write_games(path, games):
+    out = open(path, "w")
+    for moves in games:
+        out.write(format_game(moves) + "\n")
+    out.close()
+
+
+def dedupe_games(games):
+    """Yields the games that are not symmetric copies of an earlier one."""
+    seen = set()
+    for moves in games:
+        key = symmetry.canonicalize_game(moves)
+        if key not in seen:
+            seen.add(key)
+            yield moves
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog dedupe INPUT OUTPUT")
+    options, args = parser.parse_args(argv)
+    if len(args) != 3 or args[0] != "dedupe":
+        parser.print_usage()
+        return 2
+
+    counts = [0]
+
+    def counted(games):
+        for moves in games:
+            counts[0] += 1
+            yield moves
+
+    unique = list(dedupe_games(counted(read_games(args[1]))))
+    write_games(args[2], unique)
+    print "archive.py - kept %d of %d games" % (len(unique), counts[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,794 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# bench.py - Benchmarks for Reversi.
+#
+# Runs without gtk or Sugar.  Rendering goes to an offscreen surface through
+# SDL's dummy video driver, so results are comparable between a desktop and
+# an XO.
+#
+#   python bench.py render --games 20 --seed 1
+#   python bench.py replay --events-file session.sgev
+#   python bench.py server --clients 100 --games 5 --workers 4
+#   python bench.py protocol --positions 10000
+#   python bench.py symmetry
+#   python bench.py mcts --playouts 2000 --batch-sizes 1,16,64,256
+#   python bench.py history --games 20
+#   python bench.py calibrate
+#   python bench.py flips --positions 10000
+#
+
+import gc
+import os
+import random
+import resource
+import select
+import socket
+import subprocess
+import sys
+import tempfile
+import timeit
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from optparse import OptionParser
+
+
+timer = timeit.default_timer
+
+render_components = [
+    ("update", "cells"),
+    ("update", "panels"),
+    ("update", "total"),
+    ("draw", "board"),
+    ("draw", "cells"),
+    ("draw", "panels"),
+    ("draw", "restart"),
+    ("draw", "total"),
+]
+
+
+def init_headless_display(size):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    import pygame
+    pygame.display.init()
+    return pygame.display.set_mode(size)
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = int(round(fraction * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+
+def get_peak_rss():
+    """The most memory the process has held, in KB on Linux."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_allocated_blocks():
+    """Returns sys.getallocatedblocks(), or None on Pythons without it,
+    such as the activity's 2.7."""
+    if hasattr(sys, "getallocatedblocks"):
+        return sys.getallocatedblocks()
+    return None
+
+
+class FrameRecorder:
+    """Accumulates per-component times for one frame, then keeps the totals.
+
+    Components are measured by wrapping methods on the live view objects, so
+    the benchmark always exercises the real drawing code.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.allocations = {}
+        self.current = {}
+
+    def wrap(self, obj, method_name, key):
+        method = getattr(obj, method_name)
+        current = self.current
+
+        def timed(*args, **kwargs):
+            start = timer()
+            result = method(*args, **kwargs)
+            current[key] = current.get(key, 0.0) + (timer() - start)
+            return result
+
+        setattr(obj, method_name, timed)
+
+    def measure(self, phase, fn, *args):
+        """Runs one frame phase, recording times and allocations."""
+        self.current.clear()
+
+        # Keep the collector from running mid-frame so that gen0 counts are
+        # the net number of container objects the phase allocated.  Walking
+        # gc.get_objects() for the ones still alive is slow, so it is done
+        # outside the timed part.
+        gc.disable()
+        live_before = len(gc.get_objects())
+        blocks_before = get_allocated_blocks()
+        gc_before = gc.get_count()[0]
+        rss_before = get_peak_rss()
+        start = timer()
+        fn(*args)
+        elapsed = timer() - start
+        rss_growth = get_peak_rss() - rss_before
+        objects = gc.get_count()[0] - gc_before
+        blocks = None
+        if blocks_before is not None:
+            blocks = get_allocated_blocks() - blocks_before
+        live = len(gc.get_objects()) - live_before
+        gc.enable()
+
+        self.current[(phase, "total")] = elapsed
+        for key, value in self.current.items():
+            self.samples.setdefault(key, []).append(value)
+        self.allocations.setdefault(phase, []).append((objects, live, blocks, rss_growth))
+
+    def report(self, out):
+        out.write("%-16s %8s %8s %8s %8s %8s\n" %
+                  ("component", "frames", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+        for key in render_components:
+            samples = sorted(self.samples.get(key, []))
+            if not samples:
+                continue
+            out.write("%-16s %8d %8.3f %8.3f %8.3f %8.3f\n" % (
+                "%s.%s" % key, len(samples),
+                percentile(samples, 0.5) * 1000,
+                percentile(samples, 0.9) * 1000,
+                percentile(samples, 0.99) * 1000,
+                samples[-1] * 1000))
+
+        # Per frame: containers allocated, net of those freed; containers
+        # still alive after the phase; and, where the interpreter counts
+        # them, allocated blocks of every kind.  Peak memory is not an
+        # allocation count: it only grows when a frame needs more memory
+        # than any frame before it, so its growth is summed over the run.
+        out.write("\n%-16s %12s %12s %12s %14s\n" %
+                  ("phase", "objects/frm", "live/frm", "blocks/frm", "peak mem KB"))
+        for phase in ["update", "draw"]:
+            allocations = self.allocations.get(phase, [])
+            if not allocations:
+                continue
+            frames = float(len(allocations))
+            objects = sum([a[0] for a in allocations]) / frames
+            live = sum([a[1] for a in allocations]) / frames
+            blocks = "n/a"
+            if allocations[0][2] is not None:
+                blocks = "%.1f" % (sum([a[2] for a in allocations]) / frames)
+            rss_growth = sum([a[3] for a in allocations])
+            out.write("%-16s %12.1f %12.1f %12s %14d\n" %
+                      (phase, objects, live, blocks, rss_growth))
+
+    def to_dict(self):
+        result = {}
+        for key in render_components:
+            samples = sorted(self.samples.get(key, []))
+            if samples:
+                result["%s.%s" % key] = {
+                    "frames": len(samples),
+                    "p50": percentile(samples, 0.5),
+                    "p90": percentile(samples, 0.9),
+                    "p99": percentile(samples, 0.99),
+                    "max": samples[-1],
+                }
+        return result
+
+
+def instrument_view(recorder, view):
+    recorder.wrap(view.board_view, "update_from_model", ("update", "cells"))
+    recorder.wrap(view.board_view, "draw_background", ("draw", "board"))
+    recorder.wrap(view.board_view, "draw_cells", ("draw", "cells"))
+    for player_view in view.player_views:
+        if player_view is not None:
+            recorder.wrap(player_view, "update_from_model", ("update", "panels"))
+            recorder.wrap(player_view, "draw", ("draw", "panels"))
+    recorder.wrap(view.restart_button, "draw", ("draw", "restart"))
+
+
+def read_scripted_games(path):
+    """Reads one game per line, as a list of "row,column" moves."""
+    games = []
+    for line in open(path):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        moves = []
+        for move in line.split():
+            row, column = move.split(",")
+            moves.append((int(row), int(column)))
+        games.append(moves)
+    return games
+
+
+def get_available_moves(model):
+    moves = []
+    for column_index in range(model.grid_size[0]):
+        for row_index in range(model.grid_size[1]):
+            if model.is_cell_available_for_move((column_index, row_index)):
+                moves.append((column_index, row_index))
+    return moves
+
+
+def bench_render(options):
+    screen = init_headless_display((options.width, options.height))
+
+    import reversi
+
+    controller = reversi.ReversiController()
+    controller.change_sound(False)
+    controller.init_game(screen.get_size())
+
+    recorder = FrameRecorder()
+    view = controller.view
+    instrument_view(recorder, view)
+
+    # The controller calls update_from_model itself after every move; route
+    # those calls through the recorder so they are timed as frames.
+    update_from_model = view.update_from_model
+    view.update_from_model = lambda model: recorder.measure("update", update_from_model, model)
+
+    if options.games_file:
+        games = read_scripted_games(options.games_file)
+    else:
+        games = [None] * options.games
+    rng = random.Random(options.seed)
+
+    for moves in games:
+        controller.handle_restart_button_click()
+        recorder.measure("draw", view.draw, screen)
+        ply = 0
+        while controller.get_state() == "WaitingForMove":
+            if moves is not None:
+                if ply >= len(moves):
+                    break
+                move = moves[ply]
+            else:
+                move = rng.choice(get_available_moves(controller.model))
+            controller.handle_cell_click(move)
+            ply += 1
+            for frame in range(options.frames_per_move):
+                recorder.measure("draw", view.draw, screen)
+
+    sys.stdout.write("Rendered %d games at %dx%d\n\n" %
+                     (len(games), options.width, options.height))
+    recorder.report(sys.stdout)
+
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump(recorder.to_dict(), out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def bench_replay(options):
+    """Replays a recorded session through the whole game loop, unthrottled."""
+    if not options.events_file:
+        sys.stderr.write("replay needs --events-file\n")
+        return 2
+    init_headless_display((options.width, options.height))
+
+    import reversi
+
+    controller = reversi.ReversiController()
+    controller.replay_events(options.events_file)
+    start = timer()
+    controller.run()
+    elapsed = timer() - start
+
+    sys.stdout.write("Replayed %d frames in %.3f s\n\n" % (controller.frame_index, elapsed))
+    controller.profiler.print_report(sys.stdout)
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump(controller.profiler.get_report(), out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def write_latency_report(out, latencies):
+    out.write("%-16s %8s %8s %8s %8s %8s\n" %
+              ("reply", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for name in ["new", "move", "ai"]:
+        samples = sorted(latencies.get(name, []))
+        if not samples:
+            continue
+        out.write("%-16s %8d %8.3f %8.3f %8.3f %8.3f\n" % (
+            name, len(samples),
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.9) * 1000,
+            percentile(samples, 0.99) * 1000,
+            samples[-1] * 1000))
+
+
+class LoadClient:
+    """One connection to server.py, playing random moves for its side.
+
+    The client follows the game on its own rules.Game.  Latencies are the
+    time from sending a command to its reply, and for computer moves the time
+    from the client's move to the computer's.
+    """
+
+    def __init__(self, path, rules, rng, ai_player, num_games, latencies):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rules = rules
+        self.rng = rng
+        self.ai_player = ai_player
+        self.num_games = num_games
+        self.games_played = 0
+        self.latencies = latencies
+        self.read_buffer = ""
+        self.game_id = None
+        self.game = None
+        self.sent_at = None
+        self.moves = 0
+        self.start_game()
+
+    def is_finished(self):
+        return self.games_played == self.num_games
+
+    def send(self, line):
+        self.sock.sendall(line + "\n")
+        self.sent_at = timer()
+
+    def start_game(self):
+        self.send("NEW %d" % self.ai_player)
+
+    def record(self, name):
+        self.latencies.setdefault(name, []).append(timer() - self.sent_at)
+
+    def handle_read(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise RuntimeError("server closed the connection")
+        lines = (self.read_buffer + data).split("\n")
+        self.read_buffer = lines.pop()
+        for line in lines:
+            self.handle_line(line.split())
+
+    def handle_line(self, parts):
+        if parts[0] == "GAME":
+            self.record("new")
+            self.game_id = int(parts[1])
+            self.game = self.rules.Game()
+            self.move_if_local()
+        elif parts[0] == "MOVED":
+            square, player = int(parts[2]), int(parts[3])
+            if self.game.player == self.ai_player:
+                self.record("ai")
+            else:
+                self.record("move")
+            self.game.place(square)
+            self.game.set_player(player)
+            self.moves += 1
+            self.move_if_local()
+        elif parts[0] == "OVER":
+            self.sock.sendall("END %d\n" % self.game_id)
+        elif parts[0] == "ENDED":
+            self.games_played += 1
+            if self.games_played < self.num_games:
+                self.start_game()
+        else:
+            raise RuntimeError("server replied %r" % " ".join(parts))
+
+    def move_if_local(self):
+        if self.game.player == self.ai_player or self.game.is_over():
+            # The computer's move, or OVER, is on its way; keep timing from
+            # the last command.
+            return
+        moves = list(self.rules.iter_squares(self.game.get_legal_moves()))
+        self.send("MOVE %d %d" % (self.game_id, self.rng.choice(moves)))
+
+
+def bench_server(options):
+    """Plays games against server.py from many connections at once."""
+    import rules
+
+    path = os.path.join(tempfile.mkdtemp(), "server.sock")
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    server = subprocess.Popen([sys.executable, server_path, "--socket", path,
+                               "--workers", str(options.workers),
+                               "--ai-depth", str(options.ai_depth)],
+                              stdout=subprocess.PIPE)
+    try:
+        # The server prints a line once it is listening.
+        server.stdout.readline()
+
+        rng = random.Random(options.seed)
+        latencies = {}
+        clients = {}
+        poller = select.poll()
+        for i in range(options.clients):
+            client = LoadClient(path, rules, rng, options.ai_player, options.games, latencies)
+            clients[client.sock.fileno()] = client
+            poller.register(client.sock, select.POLLIN)
+
+        start = timer()
+        pending = len(clients)
+        while pending:
+            for fd, event in poller.poll():
+                client = clients[fd]
+                client.handle_read()
+                if client.is_finished():
+                    poller.unregister(fd)
+                    pending -= 1
+        elapsed = timer() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    moves = sum([connection.moves for connection in clients.values()])
+    sys.stdout.write("Played %d games, %d moves on %d connections in %.3f s: %.0f moves/s\n\n" %
+                     (options.clients * options.games, moves, options.clients,
+                      elapsed, moves / elapsed))
+    write_latency_report(sys.stdout, latencies)
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        result = {"moves": moves, "seconds": elapsed, "moves_per_second": moves / elapsed}
+        for name, samples in latencies.items():
+            samples = sorted(samples)
+            result[name] = {"count": len(samples),
+                            "p50": percentile(samples, 0.5),
+                            "p99": percentile(samples, 0.99),
+                            "max": samples[-1]}
+        out = open(options.json, "w")
+        json.dump(result, out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def get_random_positions(rules, rng, count):
+    """Returns count (white, black, player) positions from random games."""
+    positions = []
+    game = rules.Game()
+    while len(positions) < count:
+        moves = game.get_legal_moves()
+        if not moves:
+            game.reset()
+            continue
+        game.play(rng.choice(list(rules.iter_squares(moves))))
+        positions.append((game.white, game.black, game.player))
+    return positions
+
+
+def format_board(white, black):
+    squares = []
+    for square in range(64):
+        bit = 1 << square
+        if white & bit:
+            squares.append("O")
+        elif black & bit:
+            squares.append("X")
+        else:
+            squares.append(".")
+    return "".join(squares)
+
+
+def bench_protocol(options):
+    """Pipes a batch of position queries through protocol.py."""
+    import rules
+
+    rng = random.Random(options.seed)
+    commands = []
+    for white, black, player in get_random_positions(rules, rng, options.positions):
+        commands.append("setboard %s %s" % (format_board(white, black), "WB"[player - 1]))
+        commands.append("legal")
+        commands.append("score")
+    commands.append("quit")
+
+    protocol_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "protocol.py")
+    start = timer()
+    engine = subprocess.Popen([sys.executable, protocol_path],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = engine.communicate("\n".join(commands) + "\n")[0]
+    elapsed = timer() - start
+
+    replies = output.count("\n\n")
+    errors = len([line for line in output.split("\n") if line.startswith("?")])
+    sys.stdout.write("Answered %d commands about %d positions in %.3f s: "
+                     "%.0f commands/s, %.0f positions/s, %d errors\n" %
+                     (replies, options.positions, elapsed, replies / elapsed,
+                      options.positions / elapsed, errors))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump({"commands": replies, "positions": options.positions,
+                   "seconds": elapsed, "errors": errors}, out, indent=2, sort_keys=True)
+        out.close()
+    return errors and 1 or 0
+
+
+def bench_symmetry(options):
+    """Times the board transforms of symmetry.py on positions from random games."""
+    import rules
+    import symmetry
+
+    rng = random.Random(options.seed)
+    positions = get_random_positions(rules, rng, options.positions)
+    masks = [white for white, black, player in positions]
+
+    def time_calls(fn, args_list):
+        start = timer()
+        for args in args_list:
+            fn(*args)
+        return (timer() - start) / len(args_list)
+
+    single = [(mask,) for mask in masks]
+    pairs = [(white, black) for white, black, player in positions]
+    results = [
+        ("transpose", time_calls(symmetry.transpose, single)),
+        ("flip_columns", time_calls(symmetry.flip_columns, single)),
+        ("flip_rows", time_calls(symmetry.flip_rows, single)),
+        ("all 8, each", time_calls(symmetry.get_packed_variants, single) / 8),
+        ("canonicalize", time_calls(symmetry.canonicalize, pairs)),
+    ]
+    sys.stdout.write("%-16s %12s\n" % ("operation", "us/call"))
+    for name, seconds in results:
+        sys.stdout.write("%-16s %12.3f\n" % (name, seconds * 1e6))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump(dict(results), out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def bench_mcts(options):
+    """Searches random positions with mcts.py at each batch size."""
+    import mcts
+    import rules
+
+    if mcts.numpy is None:
+        sys.stderr.write("mcts benchmark needs NumPy\n")
+        return 1
+    rng = random.Random(options.seed)
+    # Only positions with a choice of moves are searched.
+    positions = []
+    for white, black, player in get_random_positions(rules, rng, 4 * options.searches):
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        if rules.count_bits(rules.get_legal_moves(own, opponent)) > 1:
+            positions.append((white, black, player))
+    positions = positions[:options.searches]
+    results = {}
+    sys.stdout.write("%-8s %12s %10s\n" % ("batch", "playouts/s", "nodes"))
+    for batch_size in [int(size) for size in options.batch_sizes.split(",")]:
+        player = mcts.MCTSEngine(options.playouts, batch_size, seed=options.seed)
+        playouts = 0
+        elapsed = 0.0
+        nodes = 0
+        for white, black, player_to_move in positions:
+            player.choose_move(white, black, player_to_move)
+            playouts += player.num_playouts
+            elapsed += player.elapsed
+            nodes += player.num_nodes
+        rate = elapsed and playouts / elapsed or 0.0
+        results[batch_size] = rate
+        sys.stdout.write("%-8d %12.0f %10d\n" % (batch_size, rate, nodes))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump(results, out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def bench_history(options):
+    """Records random games in a history.History and scrubs through them."""
+    import history
+    import rules
+
+    rng = random.Random(options.seed)
+    seconds = 0.0
+    seeks = 0
+    size = 0
+    for game_index in range(options.games):
+        game = rules.Game()
+        positions = history.History()
+        positions.reset(game.white, game.black, game.player)
+        while not game.is_over():
+            moves = game.get_legal_moves()
+            if not moves:
+                game.set_player(rules.get_opponent(game.player))
+                positions.set_player(game.player)
+                continue
+            square = rng.choice(list(rules.iter_squares(moves)))
+            game.play(square)
+            positions.record(game.white, game.black, game.player, square)
+        size = positions.get_size_in_bytes()
+
+        # Back and forth over every ply, as dragging a slider would.
+        plies = range(positions.get_length()) + range(positions.get_length() - 1, -1, -1)
+        objects = len(gc.get_objects())
+        start = timer()
+        for ply in plies:
+            white, black, player, move = positions.seek(ply)
+            game.restore(white, black, player, ())
+        seconds += timer() - start
+        seeks += len(plies)
+        if len(gc.get_objects()) > objects + 1:
+            sys.stderr.write("scrubbing left %d objects behind\n" %
+                             (len(gc.get_objects()) - objects))
+            return 1
+
+    sys.stdout.write("History of a game: %d bytes; %.2f us per jump over %d jumps\n" %
+                     (size, seconds / seeks * 1e6, seeks))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump({"bytes": size, "seek_us": seconds / seeks * 1e6}, out, indent=2,
+                  sort_keys=True)
+        out.close()
+    return 0
+
+
+def bench_calibrate(options):
+    """Measures this machine's search speed, as the activity does once, and
+    times every difficulty level against what that speed predicts."""
+    import engine
+
+    nodes_per_second, share = engine.measure_nodes_per_second()
+    sys.stdout.write("%.0f nodes/s of CPU time, %.0f%% of the CPU\n\n" %
+                     (nodes_per_second, 100 * share))
+    sys.stdout.write("%-10s %6s %8s %10s %8s %10s %10s  %s\n" %
+                     ("level", "depth", "budget", "nodes", "stopped", "predicted", "worst",
+                      "offered"))
+    positions = engine.get_calibration_positions()
+    playable = engine.get_playable_levels(nodes_per_second)
+    results = {}
+    for level, (name, depth, node_limit) in enumerate(engine.difficulty_levels):
+        searcher = engine.create_level_engine(level)
+        worst = 0.0
+        most_nodes = 0
+        # Moves whose search the budget cut short, rather than the depth.
+        stopped = 0
+        for white, black, player in positions:
+            start = timer()
+            searcher.choose_move(white, black, player)
+            worst = max(worst, timer() - start)
+            most_nodes = max(most_nodes, searcher.nodes)
+            if searcher.nodes > node_limit:
+                stopped += 1
+        predicted = engine.get_level_latency(level, nodes_per_second)
+        stopped_share = float(stopped) / len(positions)
+        results[name] = {"predicted": predicted, "worst": worst, "nodes": most_nodes,
+                         "stopped": stopped_share}
+        sys.stdout.write("%-10s %6d %8d %10d %7.0f%% %9.2fs %9.2fs  %s\n" % (
+            name, depth, node_limit, most_nodes, 100 * stopped_share, predicted, worst,
+            level in playable and "yes" or "no"))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump({"nodes_per_second": nodes_per_second, "cpu_share": share,
+                   "levels": results}, out, indent=2, sort_keys=True)
+        out.close()
+    return 0
+
+
+def bench_flips(options):
+    """Times rules.get_flips(), the line tables, against rules.walk_flips(),
+    the ray walk, on every legal move of positions from random games."""
+    import rules
+
+    rng = random.Random(options.seed)
+    calls = []
+    for white, black, player in get_random_positions(rules, rng, options.positions):
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        for square in rules.iter_squares(rules.get_legal_moves(own, opponent)):
+            calls.append((own, opponent, square))
+
+    mismatches = 0
+    for own, opponent, square in calls:
+        if rules.get_flips(own, opponent, square) != rules.walk_flips(own, opponent, square):
+            mismatches += 1
+
+    def time_calls(fn):
+        start = timer()
+        for own, opponent, square in calls:
+            fn(own, opponent, square)
+        return (timer() - start) / len(calls)
+
+    tables = time_calls(rules.get_flips)
+    walk = time_calls(rules.walk_flips)
+    sys.stdout.write("%d moves, %d mismatches\n" % (len(calls), mismatches))
+    sys.stdout.write("%-16s %12s\n" % ("flips", "us/call"))
+    sys.stdout.write("%-16s %12.3f\n" % ("line tables", tables * 1e6))
+    sys.stdout.write("%-16s %12.3f\n" % ("ray walk", walk * 1e6))
+    sys.stdout.write("%-16s %11.2fx\n" % ("speedup", walk / tables))
+    if options.json:
+        if json is None:
+            sys.stderr.write("json module is not available\n")
+            return 1
+        out = open(options.json, "w")
+        json.dump({"moves": len(calls), "mismatches": mismatches, "tables_us": tables * 1e6,
+                   "walk_us": walk * 1e6}, out, indent=2, sort_keys=True)
+        out.close()
+    return mismatches and 1 or 0
+
+
+benchmarks = {
+    "render": bench_render,
+    "replay": bench_replay,
+    "server": bench_server,
+    "protocol": bench_protocol,
+    "symmetry": bench_symmetry,
+    "mcts": bench_mcts,
+    "history": bench_history,
+    "calibrate": bench_calibrate,
+    "flips": bench_flips,
+}
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog BENCHMARK [options]\n\nBenchmarks: " +
+                          ", ".join(sorted(benchmarks.keys())))
+    parser.add_option("--games", type="int", default=20,
+                      help="number of random games to play")
+    parser.add_option("--games-file", default=None,
+                      help="replay the games in this file instead")
+    parser.add_option("--events-file", default=None,
+                      help="event log recorded with reversi.py --record")
+    parser.add_option("--seed", type="int", default=1)
+    parser.add_option("--frames-per-move", type="int", default=1,
+                      help="number of frames drawn after each move")
+    parser.add_option("--width", type="int", default=1200)
+    parser.add_option("--height", type="int", default=825)
+    parser.add_option("--clients", type="int", default=50,
+                      help="server: number of connections, each playing --games games")
+    parser.add_option("--ai-player", type="int", default=2,
+                      help="server: the player the computer plays, or 0 for none")
+    parser.add_option("--workers", type="int", default=2,
+                      help="server: processes choosing computer moves")
+    parser.add_option("--ai-depth", type="int", default=2,
+                      help="server: search depth of the computer")
+    parser.add_option("--positions", type="int", default=10000,
+                      help="protocol, symmetry, flips: number of positions to use")
+    parser.add_option("--playouts", type="int", default=2000,
+                      help="mcts: playouts per search")
+    parser.add_option("--batch-sizes", default="1,16,64,256",
+                      help="mcts: comma separated playouts per batch to compare")
+    parser.add_option("--searches", type="int", default=5,
+                      help="mcts: positions searched at each batch size")
+    parser.add_option("--json", default=None,
+                      help="also write the results to this file")
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 1 or args[0] not in benchmarks:
+        parser.print_usage()
+        return 2
+    return benchmarks[args[0]](options)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
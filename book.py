@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# book.py - An opening book built from game archives.
+#
+# The book counts the moves played from each position in the first plies of
+# the archived games.  Positions are stored in canonical form (see
+# symmetry.py), so all symmetric copies of an opening share their counts.
+#
+#   python book.py games.txt book.bin --plies 16
+#
+# File format (little-endian): "RB", uint8 version, then one entry per
+# position and move: uint64 own mask, uint64 opponent mask (own is the
+# player to move), uint8 move, uint32 count.
+#
+
+import random
+import struct
+import sys
+
+from optparse import OptionParser
+
+import archive
+import rules
+import symmetry
+
+MAGIC = "RB"
+VERSION = 1
+
+default_plies = 16
+
+_header = struct.Struct("<2sB")
+_entry = struct.Struct("<QQBI")
+
+
+class OpeningBook:
+    def __init__(self, min_count=1, rng=None):
+        """Only moves played at least min_count times are chosen."""
+        self.positions = {}
+        self.min_count = min_count
+        self.rng = rng or random.Random()
+
+    def add_count(self, own, opponent, move, count):
+        """Adds count to move, a square of the canonical position (own, opponent)."""
+        moves = self.positions.setdefault((own, opponent), {})
+        moves[move] = moves.get(move, 0) + count
+
+    def add_game(self, moves, plies=default_plies):
+        game = rules.Game()
+        for square in moves[:plies]:
+            own, opponent = game.get_player_masks(game.player)
+            own, opponent, transform = symmetry.canonicalize(own, opponent)
+            self.add_count(own, opponent, symmetry.map_square(transform, square), 1)
+            game.play(square)
+
+    def get_moves(self, white, black, player):
+        """Returns [(square, count)] of the moves played here, most played first."""
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        own, opponent, transform = symmetry.canonicalize(own, opponent)
+        moves = self.positions.get((own, opponent))
+        if not moves:
+            return []
+        result = [(symmetry.unmap_square(transform, move), count)
+                  for move, count in moves.items()]
+        result.sort(key=lambda item: -item[1])
+        return result
+
+    def choose_move(self, white, black, player):
+        """Returns a book move, picked in proportion to how often it was
+        played, or None if the position is not in the book."""
+        moves = [(square, count) for square, count in self.get_moves(white, black, player)
+                 if count >= self.min_count]
+        if not moves:
+            return None
+        pick = self.rng.randint(1, sum([count for square, count in moves]))
+        for square, count in moves:
+            pick -= count
+            if pick <= 0:
+                return square
+
+    def get_size(self):
+        return len(self.positions)
+
+    def write(self, path):
+        out = open(path, "wb")
+        out.write(_header.pack(MAGIC, VERSION))
+        for (own, opponent), moves in self.positions.iteritems():
+            for move, count in moves.iteritems():
+                out.write(_entry.pack(own, opponent, move, count))
+        out.close()
+
+
+def read_book(path, min_count=1):
+    data = open(path, "rb").read()
+    magic, version = _header.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a version %d opening book" % (path, VERSION))
+    book = OpeningBook(min_count)
+    for offset in range(_header.size, len(data) - _entry.size + 1, _entry.size):
+        book.add_count(*_entry.unpack_from(data, offset))
+    return book
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog ARCHIVE BOOK [options]")
+    parser.add_option("--plies", type="int", default=default_plies,
+                      help="number of moves of each game to add")
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.print_usage()
+        return 2
+
+    book = OpeningBook()
+    num_games = 0
+    for moves in archive.dedupe_games(archive.read_games(args[0])):
+        book.add_game(moves, options.plies)
+        num_games += 1
+    book.write(args[1])
+    print "book.py - %d positions from %d games" % (book.get_size(), num_games)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
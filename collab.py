@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# collab.py - Two-player games over a shared activity.
+#
+# Only moves travel over the network, as short text lines with a sequence
+# number (the move's index in the game), so a move costs about ten bytes.
+# Every few moves the player who moved also sends a hash of the position;
+# if the other side disagrees, the sharer of the activity, whose game is
+# authoritative, sends its full state once to bring both boards back in line.
+#
+# Messages:
+#
+#   M <seq> <square>    the move with index seq was played on square
+#   H <seq> <hash>      the position after seq moves hashes to hash
+#   N                   a new game was started
+#   R                   please send your full state
+#   S <hex>             full state, as packed by savegame
+#
+# The transport only has to deliver lines in order.  SocketTransport works
+# over a Telepathy stream tube or a socketpair(); LoopbackTransport connects
+# two sessions inside one process.  When the connection breaks or the peer
+# hangs up, the session closes and the game carries on locally.
+#
+
+import errno
+import socket
+import struct
+import zlib
+
+from binascii import hexlify, unhexlify
+
+# The sharer plays first; the player who joins plays second.
+SHARER_PLAYER = 1
+JOINER_PLAYER = 2
+
+default_hash_interval = 4
+
+
+def get_position_hash(white, black, player):
+    return zlib.crc32(struct.pack("<QQB", white, black, player)) & 0xffffffff
+
+
+#===============================================================================
+# Transports
+#===============================================================================
+
+class LoopbackTransport:
+    """Delivers lines to a peer LoopbackTransport in the same process."""
+
+    def __init__(self):
+        self.peer = None
+        self.incoming = []
+        self.bytes_sent = 0
+
+    def send(self, line):
+        self.bytes_sent += len(line) + 1
+        if self.peer is not None:
+            self.peer.incoming.append(line)
+
+    def poll(self):
+        """Returns the lines received since the last poll."""
+        lines = self.incoming
+        self.incoming = []
+        return lines
+
+    def close(self):
+        if self.peer is not None:
+            self.peer.peer = None
+            self.peer = None
+
+    def is_closed(self):
+        return self.peer is None
+
+
+def create_loopback_pair():
+    first = LoopbackTransport()
+    second = LoopbackTransport()
+    first.peer = second
+    second.peer = first
+    return first, second
+
+
+class SocketTransport:
+    """Sends newline terminated lines over a stream socket.
+
+    Give it a connected socket, or a listening one from which it accepts the
+    first connection.  Nothing blocks: poll() is called once per frame.
+    """
+
+    def __init__(self, sock=None, listener=None):
+        self.sock = None
+        self.listener = listener
+        if listener is not None:
+            listener.setblocking(False)
+        if sock is not None:
+            self.set_socket(sock)
+        self.read_buffer = ""
+        self.write_buffer = ""
+        self.bytes_sent = 0
+
+    def set_socket(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+
+    def is_connected(self):
+        return self.sock is not None
+
+    def send(self, line):
+        self.write_buffer += line + "\n"
+        self.bytes_sent += len(line) + 1
+        self.flush()
+
+    def flush(self):
+        while self.sock is not None and self.write_buffer:
+            try:
+                sent = self.sock.send(self.write_buffer)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.write_buffer = self.write_buffer[sent:]
+
+    def poll(self):
+        """Returns the complete lines received since the last poll."""
+        if self.sock is None and self.listener is not None:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return []
+                raise
+            self.set_socket(sock)
+            self.listener.close()
+            self.listener = None
+        if self.sock is None:
+            return []
+
+        self.flush()
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                # The other side went away.
+                self.close()
+                break
+            self.read_buffer += data
+
+        lines = self.read_buffer.split("\n")
+        self.read_buffer = lines.pop()
+        return lines
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+    def is_closed(self):
+        """True once closed, or once the peer has hung up."""
+        return self.sock is None and self.listener is None
+
+
+#===============================================================================
+# Session
+#===============================================================================
+
+class CollabSession:
+    """Keeps a local game in sync with a remote one.
+
+    game is the ReversiController; the session uses its play_remote_move,
+    restart_from_remote, get_position, save_state and restore_state methods,
+    and calls its set_collab_session(None) once the connection is lost.
+    """
+
+    def __init__(self, transport, game, local_player, hash_interval=default_hash_interval):
+        self.transport = transport
+        self.game = game
+        self.local_player = local_player
+        self.hash_interval = hash_interval
+        self.pending_hashes = {}
+        self.desyncs = 0
+        self.disconnected = False
+
+        if not self.is_authoritative():
+            # Catch up with whatever the sharer has already played.
+            self.send("R")
+
+    def is_authoritative(self):
+        return self.local_player == SHARER_PLAYER
+
+    def is_local_turn(self, active_player):
+        return active_player == self.local_player
+
+    def get_local_hash(self):
+        white, black, player, num_moves = self.game.get_position()
+        return get_position_hash(white, black, player)
+
+    def move_played(self, square, seq):
+        """Tells the peer that the local player played move seq on square."""
+        self.send("M %d %d" % (seq, square))
+        if (seq + 1) % self.hash_interval == 0:
+            self.send("H %d %08x" % (seq + 1, self.get_local_hash()))
+
+    def game_restarted(self):
+        self.send("N")
+
+    def send(self, line):
+        try:
+            self.transport.send(line)
+        except socket.error, e:
+            self.disconnect(e)
+
+    def poll(self):
+        try:
+            lines = self.transport.poll()
+        except socket.error, e:
+            self.disconnect(e)
+            return
+        for line in lines:
+            if self.disconnected:
+                return
+            self.handle_line(line)
+        if self.transport.is_closed() and not self.disconnected:
+            self.disconnect("the other player left")
+
+    def handle_line(self, line):
+        parts = line.split()
+        if not parts:
+            return
+        kind = parts[0]
+        try:
+            if kind == "M" and len(parts) == 3:
+                self.handle_move(int(parts[1]), int(parts[2]))
+            elif kind == "H" and len(parts) == 3:
+                self.pending_hashes[int(parts[1])] = int(parts[2], 16)
+            elif kind == "N":
+                self.game.restart_from_remote()
+                self.pending_hashes = {}
+            elif kind == "R":
+                if self.is_authoritative():
+                    self.send_state()
+            elif kind == "S" and len(parts) == 2:
+                self.game.restore_state(unhexlify(parts[1]), False, False)
+                self.pending_hashes = {}
+        except (ValueError, TypeError), e:
+            print "CollabSession.handle_line(%r) - ignoring: %s" % (line, e)
+        self.check_hashes()
+
+    def handle_move(self, seq, square):
+        num_moves = self.game.get_position()[3]
+        if seq < num_moves:
+            # Already have it.
+            return
+        if seq > num_moves or not self.game.play_remote_move(square):
+            self.resync()
+
+    def check_hashes(self):
+        white, black, player, num_moves = self.game.get_position()
+        expected = self.pending_hashes.pop(num_moves, None)
+        for seq in self.pending_hashes.keys():
+            if seq < num_moves:
+                del self.pending_hashes[seq]
+        if expected is not None and expected != get_position_hash(white, black, player):
+            self.resync()
+
+    def resync(self):
+        self.desyncs += 1
+        if self.is_authoritative():
+            self.send_state()
+        else:
+            self.send("R")
+
+    def send_state(self):
+        self.send("S %s" % hexlify(self.game.save_state()))
+
+    def disconnect(self, reason):
+        """Closes the session and hands the game back to local play."""
+        self.disconnected = True
+        print "CollabSession.disconnect() - %s" % reason
+        self.transport.close()
+        self.game.set_collab_session(None)
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,635 @@
+# -*- coding: utf-8 -*-
+#
+# engine.py - A computer opponent for Reversi.
+#
+# A depth limited alpha-beta search over the bitboards of rules.py.  Like
+# rules.py it imports nothing from the GUI, so it can run in worker processes.
+#
+# Positions are scored by evaluate(), a few hand set weights, or by a
+# PatternEvaluator whose weights train.py fitted to games.
+#
+
+import array
+import os
+import random
+import struct
+import sys
+import timeit
+
+import rules
+import symmetry
+
+# Corners can never be flipped; the squares next to them give them away.
+CORNERS = (1 << 0) | (1 << 7) | (1 << 56) | (1 << 63)
+X_SQUARES = (1 << 9) | (1 << 14) | (1 << 49) | (1 << 54)
+C_SQUARES = ((1 << 1) | (1 << 8) | (1 << 6) | (1 << 15) |
+             (1 << 48) | (1 << 57) | (1 << 55) | (1 << 62))
+
+# The X and C squares next to each corner.
+corner_neighbours = {
+    0: (1 << 1) | (1 << 8) | (1 << 9),
+    7: (1 << 6) | (1 << 15) | (1 << 14),
+    56: (1 << 57) | (1 << 48) | (1 << 49),
+    63: (1 << 62) | (1 << 55) | (1 << 54),
+}
+
+# Evaluation weights, as a tuple in this order so evaluate() can unpack them
+# cheaply.  make_weights() builds one from a dictionary of changes.
+weight_names = ("corner", "x_square", "c_square", "mobility", "disc")
+default_weights = (25, -8, -3, 4, 1)
+
+# Scores of finished games are the disc difference times this, so that any
+# win is worth more than any evaluation.
+WIN_SCORE = 1000
+
+default_depth = 4
+
+timer = timeit.default_timer
+
+# Transposition table entries say whether their score is exact or a bound.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Only nodes at least this far from the leaves go into the table; closer to
+# the leaves a lookup costs more than the search it saves.
+table_min_depth = 2
+max_table_size = 200000
+
+# Difficulty levels: name, depth and node budget.  A node budget, unlike a
+# time limit, gives the same moves on a fast machine and a slow one.  Each
+# budget is below the nodes a full search to the level's depth usually
+# takes, so it is the budget that sets how deep a level gets; the depth
+# only caps it in the simplest positions.
+difficulty_levels = [
+    ("beginner", 2, 20),
+    ("easy", 3, 100),
+    ("medium", 4, 400),
+    ("hard", 6, 3000),
+    ("expert", 8, 20000),
+]
+
+# A node budget is checked at every node; the clock and cancel() only every
+# check_interval nodes, as reading the clock costs more than a node.
+check_interval = 256
+
+# Levels whose worst move takes longer than this on a machine are not offered
+# there; see get_level_latency().
+target_latency = 2.0
+
+# Searches done by measure_nodes_per_second(): positions from one seeded
+# random game, from the opening to the endgame, at this depth.
+calibration_seed = 1
+calibration_depth = 4
+
+
+def make_weights(changes):
+    """Returns default_weights with the values in changes, a dictionary of
+    weight name to value; raises ValueError for an unknown name."""
+    weights = list(default_weights)
+    for name, value in changes.items():
+        if name not in weight_names:
+            raise ValueError("no weight %s" % name)
+        weights[weight_names.index(name)] = value
+    return tuple(weights)
+
+
+def evaluate(own, opponent, weights=default_weights):
+    """Scores the position for the owner of own, who is to move."""
+    corner_weight, x_square_weight, c_square_weight, mobility_weight, disc_weight = weights
+    count = rules.count_bits
+    score = corner_weight * (count(own & CORNERS) - count(opponent & CORNERS))
+    # A square next to a corner only hurts while the corner is empty.
+    empty_corners = CORNERS & ~(own | opponent)
+    near_empty = 0
+    for corner in rules.iter_squares(empty_corners):
+        near_empty |= corner_neighbours[corner]
+    score += x_square_weight * (count(own & X_SQUARES & near_empty) -
+                                count(opponent & X_SQUARES & near_empty))
+    score += c_square_weight * (count(own & C_SQUARES & near_empty) -
+                                count(opponent & C_SQUARES & near_empty))
+    score += mobility_weight * (count(rules.get_legal_moves(own, opponent)) -
+                                count(rules.get_legal_moves(opponent, own)))
+    score += disc_weight * (count(own) - count(opponent))
+    return score
+
+
+# Pattern weights, as written by train.py (little-endian): "RW", uint8
+# version, uint8 number of phases, then for each phase, from the most empty
+# squares to the fewest, float32 tables for the pattern_families followed
+# by float32 mobility, parity and bias weights.
+PATTERN_MAGIC = "RW"
+PATTERN_VERSION = 1
+
+# The patterns are the 16 lines of the board: the columns, i.e. the bytes of
+# a mask, as lines 0 to 7, and the rows, the bytes of the transposed mask, as
+# lines 8 to 15.  A line's index is the sum of 3 ** i times 0, 1 or 2 for an
+# empty, own or opponent square at position i.  Lines that are copies of
+# each other under a symmetry share one table: the edges, the lines next to
+# them, and so on towards the middle.
+pattern_families = ((0, 7, 8, 15), (1, 6, 9, 14), (2, 5, 10, 13), (3, 4, 11, 12))
+pattern_size = 3 ** 8
+pattern_phase_size = len(pattern_families) * pattern_size + 3
+
+_pattern_header = struct.Struct("<2sBB")
+_pack = struct.Struct("<Q").pack
+
+# Each byte read as a line of own discs: the sum of 3 ** i over its bits.
+_ternary = [sum([3 ** i for i in range(8) if byte >> i & 1]) for byte in range(256)]
+
+
+def get_phase(empties, num_phases):
+    """Returns the game phase, 0 at the start, of a position with empties
+    empty squares."""
+    return (60 - empties) * num_phases // 61
+
+
+class PatternEvaluator:
+    """Scores positions, in discs, with the weights fitted by train.py."""
+
+    def __init__(self, phases):
+        """phases holds, for each phase, a sequence of pattern_phase_size
+        weights laid out as in the file."""
+        self.num_phases = len(phases)
+        self.phases = []
+        for weights in phases:
+            tables = [weights[i * pattern_size:(i + 1) * pattern_size]
+                      for i in range(len(pattern_families))]
+            self.phases.append(tuple(tables) + tuple(weights[-3:]))
+        self.phase_by_empties = [self.phases[get_phase(min(empties, 60), self.num_phases)]
+                                 for empties in range(65)]
+
+    def get_line_indices(self, own, opponent):
+        """Returns the index of each of the 16 lines."""
+        own_bytes = bytearray(_pack(own) + _pack(symmetry.transpose(own)))
+        opponent_bytes = bytearray(_pack(opponent) + _pack(symmetry.transpose(opponent)))
+        ternary = _ternary
+        return [ternary[o] + 2 * ternary[p] for o, p in zip(own_bytes, opponent_bytes)]
+
+    def evaluate(self, own, opponent):
+        """Scores the position for the owner of own, who is to move."""
+        empties = 64 - rules.count_bits(own | opponent)
+        edge, line1, line2, line3, mobility, parity, bias = self.phase_by_empties[empties]
+        lines = self.get_line_indices(own, opponent)
+        score = (bias + edge[lines[0]] + edge[lines[7]] + edge[lines[8]] + edge[lines[15]] +
+                 line1[lines[1]] + line1[lines[6]] + line1[lines[9]] + line1[lines[14]] +
+                 line2[lines[2]] + line2[lines[5]] + line2[lines[10]] + line2[lines[13]] +
+                 line3[lines[3]] + line3[lines[4]] + line3[lines[11]] + line3[lines[12]])
+        score += mobility * (rules.count_bits(rules.get_legal_moves(own, opponent)) -
+                             rules.count_bits(rules.get_legal_moves(opponent, own)))
+        if empties & 1:
+            score += parity
+        else:
+            score -= parity
+        return score
+
+
+def read_pattern_weights(path):
+    """Returns the PatternEvaluator for the weights file at path."""
+    data = open(path, "rb").read()
+    magic, version, num_phases = _pattern_header.unpack_from(data, 0)
+    if magic != PATTERN_MAGIC or version != PATTERN_VERSION:
+        raise ValueError("%s is not a version %d weights file" % (path, PATTERN_VERSION))
+    weights = array.array("f")
+    weights.fromstring(data[_pattern_header.size:])
+    if len(weights) != num_phases * pattern_phase_size:
+        raise ValueError("%s should hold %d weights, not %d" %
+                         (path, num_phases * pattern_phase_size, len(weights)))
+    if sys.byteorder == "big":
+        weights.byteswap()
+    return PatternEvaluator([weights[i * pattern_phase_size:(i + 1) * pattern_phase_size]
+                             for i in range(num_phases)])
+
+
+def get_final_score(own, opponent):
+    return WIN_SCORE * (rules.count_bits(own) - rules.count_bits(opponent))
+
+
+def order_moves(moves, first=None):
+    """Returns the squares of moves, corners first and X squares last.
+
+    first, if one of the moves, goes before all others.
+    """
+    if first is not None and moves & (1 << first):
+        moves &= ~(1 << first)
+        squares = [first]
+    else:
+        squares = []
+    squares.extend(rules.iter_squares(moves & CORNERS))
+    squares.extend(rules.iter_squares(moves & ~(CORNERS | X_SQUARES)))
+    squares.extend(rules.iter_squares(moves & X_SQUARES))
+    return squares
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class IterationStats:
+    """What one iteration of the deepening search did.
+
+    lines holds [(square, score, principal variation)] for the best root
+    moves, best first; the variation is a list of squares, None for a
+    pass, starting with square.
+    """
+
+    def __init__(self, depth, nodes, seconds, table_probes, table_hits, cutoffs,
+                 first_move_cutoffs, previous_nodes, lines):
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.table_probes = table_probes
+        self.table_hits = table_hits
+        self.cutoffs = cutoffs
+        self.first_move_cutoffs = first_move_cutoffs
+        self.previous_nodes = previous_nodes
+        self.lines = lines
+
+    def get_nodes_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.nodes / self.seconds
+
+    def get_table_hit_rate(self):
+        if not self.table_probes:
+            return 0.0
+        return float(self.table_hits) / self.table_probes
+
+    def get_branching_factor(self):
+        """The effective branching factor: how many times more nodes this
+        iteration searched than the one before, or None for the first."""
+        if not self.previous_nodes:
+            return None
+        return float(self.nodes) / self.previous_nodes
+
+    def get_first_move_cutoff_rate(self):
+        """The share of beta cutoffs made by the first move searched; the
+        closer to 1, the better the move ordering."""
+        if not self.cutoffs:
+            return 0.0
+        return float(self.first_move_cutoffs) / self.cutoffs
+
+    def get_best_line(self):
+        return self.lines[0]
+
+
+def create_level_engine(level):
+    """Returns an Engine playing at difficulty_levels[level]."""
+    name, depth, node_limit = difficulty_levels[level]
+    return Engine(depth, node_limit=node_limit)
+
+
+def get_calibration_positions():
+    rng = random.Random(calibration_seed)
+    game = rules.Game()
+    positions = []
+    while not game.is_over():
+        moves = game.get_legal_moves()
+        if not moves:
+            game.set_player(rules.get_opponent(game.player))
+            continue
+        game.play(rng.choice(list(rules.iter_squares(moves))))
+        positions.append((game.white, game.black, game.player))
+    return positions[::4]
+
+
+def get_cpu_time():
+    """Returns the CPU time this process has used, in seconds."""
+    user, system = os.times()[:2]
+    return user + system
+
+
+def measure_nodes_per_second(seconds=1.0):
+    """Returns (nodes_per_second, share): how many nodes this machine
+    searches in a second of CPU time, from searches of the calibration
+    positions taking about seconds of it, and the share of the wall-clock
+    time those searches had the CPU for.
+
+    Counting CPU time keeps other busy programs from slowing the figure
+    down much, but a small share still means it was measured under load.
+    """
+    positions = get_calibration_positions()
+    nodes = 0
+    elapsed = 0.0
+    wall_start = timer()
+    while elapsed < seconds:
+        for white, black, player in positions:
+            searcher = Engine(calibration_depth)
+            start = get_cpu_time()
+            searcher.choose_move(white, black, player)
+            elapsed += get_cpu_time() - start
+            nodes += searcher.nodes
+            if elapsed >= seconds:
+                break
+    return nodes / elapsed, min(1.0, elapsed / (timer() - wall_start))
+
+
+def get_level_latency(level, nodes_per_second):
+    """Returns the longest a move of difficulty_levels[level] should take
+    on a machine searching nodes_per_second."""
+    name, depth, node_limit = difficulty_levels[level]
+    return node_limit / nodes_per_second
+
+
+def get_playable_levels(nodes_per_second, latency=target_latency):
+    """Returns the indices of the levels that answer within latency."""
+    return [level for level in range(len(difficulty_levels))
+            if get_level_latency(level, nodes_per_second) <= latency]
+
+
+def format_variation(variation):
+    return " ".join([rules.format_square(square) for square in variation])
+
+
+def get_stats_rows(iterations):
+    """Returns a table of iterations as rows of strings, headings first."""
+    rows = [("depth", "nodes", "knps", "table", "branch", "first", "best", "pv")]
+    for stats in iterations:
+        branching = stats.get_branching_factor()
+        if branching is None:
+            branching = "-"
+        else:
+            branching = "%.1f" % branching
+        square, score, variation = stats.get_best_line()
+        rows.append(("%d" % stats.depth, "%d" % stats.nodes,
+                     "%.1f" % (stats.get_nodes_per_second() / 1000),
+                     "%.0f%%" % (100 * stats.get_table_hit_rate()), branching,
+                     "%.0f%%" % (100 * stats.get_first_move_cutoff_rate()),
+                     "%d" % score, format_variation(variation)))
+    return rows
+
+
+class Engine:
+    """Searches up to depth plies ahead and picks the best scoring move.
+
+    The search deepens one ply at a time, so with a time_limit, in seconds,
+    it plays the move of the deepest search that finished in time.
+    Positions are remembered in a transposition table keyed by their
+    canonical form (see symmetry.py), so symmetric copies share one entry.
+    The table is kept between moves.  book, an OpeningBook, is consulted
+    before searching.  evaluator, a PatternEvaluator, scores the leaves
+    instead of evaluate() and weights.
+
+    With a node_limit, a search that has visited that many nodes stops like
+    one that ran out of time, but at the same point on every machine.
+    cancel(), from another thread, stops the search within check_interval
+    nodes as if it had run out of time; the engine stays cancelled.
+
+    iterations holds the IterationStats of each finished iteration of the
+    last choose_move() or analyze(), or the one search of score_moves().
+    """
+
+    def __init__(self, depth=default_depth, book=None, weights=default_weights, time_limit=None,
+                 evaluator=None, node_limit=None):
+        self.depth = depth
+        self.book = book
+        self.weights = weights
+        self.evaluator = evaluator
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.deadline = None
+        self.cancelled = False
+        self.nodes = 0
+        self.table = {}
+        self.table_probes = 0
+        self.table_hits = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.iterations = []
+
+    def clear_table(self):
+        self.table = {}
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_out_of_time(self):
+        return self.cancelled or (self.deadline is not None and timer() > self.deadline)
+
+    def search(self, own, opponent, depth, alpha, beta, passed=False):
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            raise SearchTimeout()
+        if not self.nodes % check_interval and self.is_out_of_time():
+            raise SearchTimeout()
+        moves = rules.get_legal_moves(own, opponent)
+        if not moves:
+            if passed:
+                return get_final_score(own, opponent)
+            return -self.search(opponent, own, depth, -beta, -alpha, True)
+        if depth == 0:
+            if self.evaluator is not None:
+                return self.evaluator.evaluate(own, opponent)
+            return evaluate(own, opponent, self.weights)
+
+        key = None
+        table_move = None
+        if depth >= table_min_depth:
+            canonical_own, canonical_opponent, transform = symmetry.canonicalize(own, opponent)
+            key = (canonical_own, canonical_opponent)
+            self.table_probes += 1
+            entry = self.table.get(key)
+            if entry is not None:
+                self.table_hits += 1
+                entry_depth, bound, score, move = entry
+                if entry_depth >= depth:
+                    if bound == EXACT:
+                        return score
+                    elif bound == LOWER and score >= beta:
+                        return score
+                    elif bound == UPPER and score <= alpha:
+                        return score
+                table_move = symmetry.unmap_square(transform, move)
+
+        original_alpha = alpha
+        best = -rules.FULL
+        best_square = None
+        first = True
+        for square in order_moves(moves, table_move):
+            flips = rules.get_flips(own, opponent, square)
+            score = -self.search(opponent & ~flips, own | flips | (1 << square),
+                                 depth - 1, -beta, -alpha)
+            if score > best:
+                best = score
+                best_square = square
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if first:
+                            self.first_move_cutoffs += 1
+                        break
+            first = False
+
+        if key is not None:
+            if best <= original_alpha:
+                bound = UPPER
+            elif best >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            if len(self.table) >= max_table_size:
+                self.table = {}
+            self.table[key] = (depth, bound, best, symmetry.map_square(transform, best_square))
+        return best
+
+    def choose_move(self, white, black, player):
+        """Returns the square player should play, or None if they must pass."""
+        self.iterations = []
+        if self.book is not None:
+            square = self.book.choose_move(white, black, player)
+            if square is not None:
+                return square
+        lines = self.analyze(white, black, player, 1)
+        if not lines:
+            return None
+        return lines[0][0]
+
+    def analyze(self, white, black, player, num_lines=1):
+        """Returns [(square, score, principal variation)] for the num_lines
+        best moves of player, best first, or [] if they must pass.
+
+        The scores are exact, from the deepest iteration that finished;
+        iterations holds the statistics of every one.
+        """
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        self.iterations = []
+        moves = rules.get_legal_moves(own, opponent)
+        if not moves:
+            return []
+        self.nodes = 0
+
+        order = order_moves(moves)
+        if self.time_limit is not None:
+            self.deadline = timer() + self.time_limit
+        try:
+            for depth in range(1, self.depth + 1):
+                lines = self.run_iteration(own, opponent, depth, order, num_lines)
+                best = [square for square, score, variation in lines]
+                order = best + [square for square in order if square not in best]
+        except SearchTimeout:
+            pass
+        self.deadline = None
+        if not self.iterations:
+            # Not even depth 1 finished; the move ordering's favourite will do.
+            return [(order[0], 0, [order[0]])]
+        return self.iterations[-1].lines
+
+    def run_iteration(self, own, opponent, depth, order, num_lines):
+        """Searches the root moves in order at depth, adds its IterationStats
+        to iterations and returns its lines."""
+        start = timer()
+        nodes = self.nodes
+        table_probes = self.table_probes
+        table_hits = self.table_hits
+        cutoffs = self.cutoffs
+        first_move_cutoffs = self.first_move_cutoffs
+
+        lines = []
+        for score, square in self.search_lines(own, opponent, depth, order, num_lines):
+            lines.append((square, score, self.get_variation(own, opponent, square, depth)))
+
+        previous_nodes = None
+        if self.iterations:
+            previous_nodes = self.iterations[-1].nodes
+        self.iterations.append(IterationStats(
+            depth, self.nodes - nodes, timer() - start, self.table_probes - table_probes,
+            self.table_hits - table_hits, self.cutoffs - cutoffs,
+            self.first_move_cutoffs - first_move_cutoffs, previous_nodes, lines))
+        return lines
+
+    def search_lines(self, own, opponent, depth, order, num_lines):
+        """Returns [(score, square)] for the num_lines best of the moves in
+        order at depth, best first, searching them in that order.
+
+        Once num_lines moves are in, the rest are searched with a window
+        that only proves them worse than the last, so only the scores
+        returned are exact.
+        """
+        lines = []
+        for square in order:
+            if len(lines) < num_lines:
+                alpha = -rules.FULL
+            else:
+                alpha = lines[-1][0]
+            flips = rules.get_flips(own, opponent, square)
+            score = -self.search(opponent & ~flips, own | flips | (1 << square),
+                                 depth - 1, -rules.FULL, -alpha)
+            if len(lines) < num_lines or score > alpha:
+                lines.append((score, square))
+                lines.sort(key=lambda line: -line[0])
+                del lines[num_lines:]
+        return lines
+
+    def get_variation(self, own, opponent, square, length):
+        """Returns the principal variation after square, as far as the
+        transposition table remembers it, up to length moves."""
+        variation = [square]
+        flips = rules.get_flips(own, opponent, square)
+        own, opponent = opponent & ~flips, own | flips | (1 << square)
+        num_moves = 1
+        while num_moves < length:
+            moves = rules.get_legal_moves(own, opponent)
+            if not moves:
+                if not rules.get_legal_moves(opponent, own):
+                    break
+                variation.append(None)
+                own, opponent = opponent, own
+                continue
+            canonical_own, canonical_opponent, transform = symmetry.canonicalize(own, opponent)
+            entry = self.table.get((canonical_own, canonical_opponent))
+            if entry is None:
+                break
+            square = symmetry.unmap_square(transform, entry[3])
+            if square is None or not moves & (1 << square):
+                break
+            variation.append(square)
+            flips = rules.get_flips(own, opponent, square)
+            own, opponent = opponent & ~flips, own | flips | (1 << square)
+            num_moves += 1
+        while variation[-1] is None:
+            variation.pop()
+        return variation
+
+    def score_moves(self, white, black, player):
+        """Returns [(square, score)] for every legal move of player, best first.
+
+        Each move is searched with a full window, so the scores are exact
+        rather than bounds; this is slower than choose_move().
+        """
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        self.iterations = []
+        self.nodes = 0
+        start = timer()
+        table_probes = self.table_probes
+        table_hits = self.table_hits
+        cutoffs = self.cutoffs
+        first_move_cutoffs = self.first_move_cutoffs
+
+        scores = []
+        for square in order_moves(rules.get_legal_moves(own, opponent)):
+            flips = rules.get_flips(own, opponent, square)
+            score = -self.search(opponent & ~flips, own | flips | (1 << square),
+                                 self.depth - 1, -rules.FULL, rules.FULL)
+            scores.append((square, score))
+        scores.sort(key=lambda item: -item[1])
+
+        if scores:
+            lines = [(move, move_score, self.get_variation(own, opponent, move, self.depth))
+                     for move, move_score in scores]
+            self.iterations.append(IterationStats(
+                self.depth, self.nodes, timer() - start, self.table_probes - table_probes,
+                self.table_hits - table_hits, self.cutoffs - cutoffs,
+                self.first_move_cutoffs - first_move_cutoffs, None, lines))
+        return scores
+
+
+def choose_move(white, black, player, depth=default_depth):
+    """Engine(depth).choose_move(); a plain function so a process pool can run it."""
+    return Engine(depth).choose_move(white, black, player)
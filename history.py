@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# history.py - Every position of a game, for undo and review.
+#
+# One snapshot per ply: the black and white masks in an array('I'), and the
+# player to move and the move that led there in an array('B').  Python 2's
+# array has no 64 bit type on every platform, so each mask is stored as its
+# low and high 32 bits.  Both arrays are allocated once for the longest
+# possible game, 18 bytes a ply, about a kilobyte in all.  Jumping to a ply
+# reads four words and two bytes and builds nothing, so scrubbing back and
+# forth through a game costs no more than showing the position.
+#
+# The cursor is the ply shown.  Recording a move while it is behind the
+# last ply throws the later plies away, as undoing and playing on should.
+#
+
+import array
+
+# 60 squares to fill; passes are not plies.
+max_plies = 60
+
+# The move of the first snapshot, which no move led to.
+NO_MOVE = 255
+
+_LOW = 0xffffffff
+
+
+class History:
+    def __init__(self, capacity=max_plies + 1):
+        self.masks = array.array("I", [0]) * (4 * capacity)
+        self.info = array.array("B", [0]) * (2 * capacity)
+        self.length = 0
+        self.cursor = 0
+
+    def reset(self, white, black, player):
+        """Forgets everything and starts from the given position."""
+        self.length = 0
+        self.cursor = -1
+        self.record(white, black, player, NO_MOVE)
+
+    def record(self, white, black, player, move):
+        """Adds the position after move just after the cursor and moves
+        the cursor there; raises IndexError once the arrays are full."""
+        ply = self.cursor + 1
+        if 2 * ply >= len(self.info):
+            raise IndexError("no room for ply %d" % ply)
+        masks = self.masks
+        masks[4 * ply] = black & _LOW
+        masks[4 * ply + 1] = black >> 32
+        masks[4 * ply + 2] = white & _LOW
+        masks[4 * ply + 3] = white >> 32
+        self.info[2 * ply] = player
+        self.info[2 * ply + 1] = move
+        self.cursor = ply
+        self.length = ply + 1
+
+    def set_player(self, player):
+        """Changes the player to move in the position at the cursor, as when
+        the opponent has to pass."""
+        self.info[2 * self.cursor] = player
+
+    def get(self, ply):
+        """Returns (white, black, player to move, move that led there)."""
+        if not 0 <= ply < self.length:
+            raise IndexError("no ply %d" % ply)
+        masks = self.masks
+        index = 4 * ply
+        return (masks[index + 2] | masks[index + 3] << 32, masks[index] | masks[index + 1] << 32,
+                self.info[2 * ply], self.info[2 * ply + 1])
+
+    def seek(self, ply):
+        """Moves the cursor to ply; returns get(ply)."""
+        position = self.get(ply)
+        self.cursor = ply
+        return position
+
+    def get_cursor(self):
+        return self.cursor
+
+    def get_length(self):
+        """The number of positions, the first one included."""
+        return self.length
+
+    def get_moves(self):
+        """Returns the squares played up to the cursor, in order."""
+        return self.info[3:2 * self.cursor + 2:2].tolist()
+
+    def get_size_in_bytes(self):
+        return (self.masks.buffer_info()[1] * self.masks.itemsize +
+                self.info.buffer_info()[1] * self.info.itemsize)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# mcts.py - A Monte Carlo tree search player for Reversi.
+#
+# UCT over the bitboards of rules.py, as an alternative to the alpha-beta
+# search of engine.py with the same choose_move() interface.  It needs
+# NumPy.
+#
+# Leaves are selected batch_size at a time; every selection adds a visit
+# along its path at once, a virtual loss that steers the next selections of
+# the batch elsewhere.  The batch's playouts then run in lockstep: their
+# boards are stacked into arrays of masks and every ply of all of them is a
+# handful of NumPy operations, so a larger batch costs little more per ply
+# than a single game.
+#
+# The tree lives in flat arrays indexed by node number; the children of a
+# node are numbered consecutively from first_child.
+#
+
+import timeit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rules
+
+default_playouts = 2000
+default_batch_size = 64
+default_exploration = 1.4
+initial_nodes = 4096
+
+timer = timeit.default_timer
+
+# first_child of a node whose children are not made yet.
+UNEXPANDED = -1
+# move of a node reached by passing.
+PASS = -1
+
+# The arrays of the tree: name, NumPy type and the value of unused nodes.
+_node_fields = (
+    ("parent", "i4", -1),
+    ("first_child", "i4", UNEXPANDED),
+    ("num_children", "i4", 0),
+    ("move", "i1", PASS),
+    ("own", "u8", 0),
+    ("opponent", "u8", 0),
+    ("visits", "f8", 0),
+    ("wins", "f8", 0),
+)
+
+if numpy is not None:
+    _zero = numpy.uint64(0)
+    _one = numpy.uint64(1)
+    _squares = numpy.arange(64, dtype=numpy.uint64)
+    # rules.directions as (amount, towards higher squares, edge mask).
+    _directions = [(numpy.uint64(abs(amount)), amount > 0, numpy.uint64(edge_mask))
+                   for amount, edge_mask in rules.directions]
+    _m1 = numpy.uint64(0x5555555555555555)
+    _m2 = numpy.uint64(0x3333333333333333)
+    _m4 = numpy.uint64(0x0f0f0f0f0f0f0f0f)
+    _h01 = numpy.uint64(0x0101010101010101)
+
+
+def count_bits(masks):
+    """Returns the number of bits set in each of an array of masks."""
+    masks = masks - ((masks >> _one) & _m1)
+    masks = (masks & _m2) + ((masks >> numpy.uint64(2)) & _m2)
+    masks = (masks + (masks >> numpy.uint64(4))) & _m4
+    return ((masks * _h01) >> numpy.uint64(56)).astype(numpy.int64)
+
+
+def _get_runs(start, inner, amount, higher):
+    """Returns the runs of inner squares next to start, going one way."""
+    if higher:
+        run = (start << amount) & inner
+        run |= (run << amount) & inner
+        run |= (run << amount) & inner
+        run |= (run << amount) & inner
+        run |= (run << amount) & inner
+        run |= (run << amount) & inner
+        return run, (run << amount)
+    run = (start >> amount) & inner
+    run |= (run >> amount) & inner
+    run |= (run >> amount) & inner
+    run |= (run >> amount) & inner
+    run |= (run >> amount) & inner
+    run |= (run >> amount) & inner
+    return run, (run >> amount)
+
+
+def get_legal_moves(own, opponent):
+    """rules.get_legal_moves() of arrays of masks."""
+    empty = ~(own | opponent)
+    moves = numpy.zeros_like(own)
+    for amount, higher, edge_mask in _directions:
+        run, beyond = _get_runs(own, opponent & edge_mask, amount, higher)
+        moves |= beyond & edge_mask & empty
+    return moves
+
+
+def get_flips(own, opponent, moves):
+    """rules.get_flips() of arrays of masks; moves holds one bit, or none,
+    per position."""
+    flips = numpy.zeros_like(own)
+    for amount, higher, edge_mask in _directions:
+        run, beyond = _get_runs(moves, opponent & edge_mask, amount, higher)
+        run[(beyond & edge_mask & own) == _zero] = _zero
+        flips |= run
+    return flips
+
+
+def choose_random_moves(moves, random_state):
+    """Returns one of the bits of each of moves picked at random, or 0."""
+    legal = ((moves[:, None] >> _squares) & _one).astype(bool)
+    keys = random_state.random_sample(legal.shape)
+    keys[~legal] = -1
+    chosen = _one << keys.argmax(axis=1).astype(numpy.uint64)
+    chosen[moves == _zero] = _zero
+    return chosen
+
+
+def play_out(own, opponent, random_state):
+    """Plays random games from arrays of positions, own to move, until all
+    have ended; returns each game's result for own: 1, 0.5 or 0."""
+    own = own.copy()
+    opponent = opponent.copy()
+    swapped = numpy.zeros(len(own), bool)
+    passed = numpy.zeros(len(own), bool)
+    done = numpy.zeros(len(own), bool)
+    while True:
+        moves = get_legal_moves(own, opponent)
+        stuck = moves == _zero
+        done |= stuck & passed
+        if done.all():
+            break
+        chosen = choose_random_moves(moves, random_state)
+        flips = get_flips(own, opponent, chosen)
+        playing = ~done
+        # A pass, with no move and no flips, only swaps the sides.
+        own, opponent = (numpy.where(playing, opponent & ~flips, own),
+                         numpy.where(playing, own | flips | chosen, opponent))
+        swapped ^= playing
+        passed = stuck
+    differential = count_bits(own) - count_bits(opponent)
+    differential[swapped] *= -1
+    return (numpy.sign(differential) + 1) / 2.0
+
+
+class MCTSEngine:
+    """Picks the move whose subtree gathered the most of playouts visits.
+
+    With a time_limit, in seconds, it stops early at the first batch to end
+    past it.
+    """
+
+    def __init__(self, playouts=default_playouts, batch_size=default_batch_size,
+                 exploration=default_exploration, time_limit=None, seed=None):
+        if numpy is None:
+            raise ImportError("the Monte Carlo player needs NumPy")
+        self.playouts = playouts
+        self.batch_size = batch_size
+        self.exploration = exploration
+        self.time_limit = time_limit
+        self.random_state = numpy.random.RandomState(seed)
+        self.num_playouts = 0
+        self.elapsed = 0.0
+        self.num_nodes = 0
+        self.allocate(initial_nodes)
+
+    def allocate(self, capacity):
+        """Makes room for capacity nodes, keeping the ones there are."""
+        for name, dtype, fill in _node_fields:
+            values = numpy.empty(capacity, dtype)
+            values.fill(fill)
+            old = getattr(self, name, None)
+            if old is not None:
+                values[:len(old)] = old
+            setattr(self, name, values)
+
+    def add_node(self, parent, move, own, opponent):
+        """Adds a node for the position own to move; returns its number."""
+        node = self.num_nodes
+        if node == len(self.parent):
+            self.allocate(2 * node)
+        self.num_nodes += 1
+        self.parent[node] = parent
+        self.first_child[node] = UNEXPANDED
+        self.num_children[node] = 0
+        self.move[node] = move
+        self.own[node] = own
+        self.opponent[node] = opponent
+        self.visits[node] = 0
+        self.wins[node] = 0
+        return node
+
+    def expand(self, node):
+        """Adds the children of node: one per move, or a single pass, or
+        none once the game is over."""
+        own = int(self.own[node])
+        opponent = int(self.opponent[node])
+        moves = rules.get_legal_moves(own, opponent)
+        first = self.num_nodes
+        if moves:
+            for square in rules.iter_squares(moves):
+                flips = rules.get_flips(own, opponent, square)
+                self.add_node(node, square, opponent & ~flips, own | flips | (1 << square))
+        elif rules.get_legal_moves(opponent, own):
+            self.add_node(node, PASS, opponent, own)
+        self.first_child[node] = first
+        self.num_children[node] = self.num_nodes - first
+
+    def select(self):
+        """Returns the path from the root to a leaf to play out from."""
+        node = 0
+        path = [0]
+        log = numpy.log
+        while True:
+            first = self.first_child[node]
+            if first == UNEXPANDED:
+                if self.visits[node] == 0 and node != 0:
+                    break
+                self.expand(node)
+                first = self.first_child[node]
+            count = self.num_children[node]
+            if count == 0:
+                break
+            visits = self.visits[first:first + count]
+            unvisited = numpy.flatnonzero(visits == 0)
+            if len(unvisited):
+                node = first + unvisited[0]
+                path.append(node)
+                break
+            scores = (self.wins[first:first + count] / visits +
+                      self.exploration * numpy.sqrt(log(self.visits[node]) / visits))
+            node = first + scores.argmax()
+            path.append(node)
+        # The virtual loss: the visit counts now, its result when it is in.
+        self.visits[path] += 1
+        return path
+
+    def run_batch(self):
+        paths = [self.select() for i in range(self.batch_size)]
+        leaves = [path[-1] for path in paths]
+        results = play_out(self.own[leaves], self.opponent[leaves], self.random_state)
+        for path, result in zip(paths, results):
+            # Each node's wins are those of the player who moved into it.
+            value = 1 - result
+            for node in reversed(path):
+                self.wins[node] += value
+                value = 1 - value
+        self.num_playouts += len(paths)
+
+    def choose_move(self, white, black, player):
+        """Returns the square player should play, or None if they must pass."""
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        moves = rules.get_legal_moves(own, opponent)
+        if not moves:
+            return None
+        if not moves & (moves - 1):
+            return rules.iter_squares(moves).next()
+
+        start = timer()
+        deadline = None
+        if self.time_limit is not None:
+            deadline = start + self.time_limit
+        self.num_nodes = 0
+        self.num_playouts = 0
+        self.add_node(-1, PASS, own, opponent)
+        self.expand(0)
+        while self.num_playouts < self.playouts:
+            self.run_batch()
+            if deadline is not None and timer() > deadline:
+                break
+        self.elapsed = timer() - start
+
+        first = self.first_child[0]
+        best = first + self.visits[first:first + self.num_children[0]].argmax()
+        return int(self.move[best])
+
+    def get_playouts_per_second(self):
+        """The rate of the last choose_move() that searched."""
+        if not self.elapsed:
+            return 0.0
+        return self.num_playouts / self.elapsed
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# positiondb.py - What was played from a position, and how it went.
+#
+# Games from archives (see archive.py) are imported into an SQLite table
+# with one row per canonical position and move.  Each row counts the games
+# the move was played in, the mover's wins, draws and losses, and the sum of
+# the mover's final disc differential.  Positions are stored in canonical
+# form (see symmetry.py), so symmetric copies share a row; the key is the
+# canonical position itself, two signed 64 bit integers, which is as small
+# as a hash of it and never collides.
+#
+#   python positiondb.py import positions.db games.txt [more.txt ...]
+#   python positiondb.py query positions.db f5d6
+#
+
+import itertools
+import multiprocessing
+import sqlite3
+import sys
+import timeit
+
+from optparse import OptionParser
+
+import archive
+import rules
+import symmetry
+
+default_batch_size = 10000
+
+timer = timeit.default_timer
+
+_schema = """
+CREATE TABLE IF NOT EXISTS moves (
+    own INTEGER NOT NULL,
+    opponent INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    disc_sum INTEGER NOT NULL,
+    PRIMARY KEY (own, opponent, move)
+)
+"""
+
+_SIGN_BIT = 1 << 63
+
+
+def to_signed(mask):
+    """SQLite integers are signed; masks with the top bit set wrap around."""
+    if mask & _SIGN_BIT:
+        return mask - (1 << 64)
+    return mask
+
+
+def get_key(own, opponent):
+    """Returns (own, opponent, transform) for a position, ready for the table."""
+    own, opponent, transform = symmetry.canonicalize(own, opponent)
+    return to_signed(own), to_signed(opponent), transform
+
+
+class MoveStats:
+    def __init__(self, square, games, wins, draws, losses, disc_sum):
+        self.square = square
+        self.games = games
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.disc_sum = disc_sum
+
+    def get_average_disc_differential(self):
+        return float(self.disc_sum) / self.games
+
+    def get_score(self):
+        """The mover's share of the points, counting a draw as half a win."""
+        return (self.wins + 0.5 * self.draws) / self.games
+
+
+def get_game_rows(moves):
+    """Yields (own, opponent, move, result, disc differential) for each ply,
+    all from the point of view of the player who moved.  Raises ValueError,
+    saying which move, if one is illegal."""
+    game = rules.Game()
+    plies = []
+    for ply, square in enumerate(moves):
+        own, opponent = game.get_player_masks(game.player)
+        own, opponent, transform = get_key(own, opponent)
+        plies.append((own, opponent, symmetry.map_square(transform, square), game.player))
+        try:
+            game.play(square)
+        except ValueError, e:
+            raise ValueError("move %d, %s: %s" % (ply + 1, rules.format_square(square), e))
+
+    white, black = game.get_count(1), game.get_count(2)
+    for own, opponent, move, player in plies:
+        if player == 1:
+            differential = white - black
+        else:
+            differential = black - white
+        yield own, opponent, move, cmp(differential, 0), differential
+
+
+def get_batch_rows(games):
+    """Returns (rows, number of games, errors) for a list of games, with rows
+    summed as write_rows() takes them.  Games with an illegal move are left
+    out; errors lists (index in games, message) for each.  A plain function
+    so a process pool can run it."""
+    rows = {}
+    num_games = 0
+    errors = []
+    for index, moves in enumerate(games):
+        try:
+            game_rows = list(get_game_rows(moves))
+        except ValueError, e:
+            errors.append((index, str(e)))
+            continue
+        num_games += 1
+        for own, opponent, move, result, differential in game_rows:
+            row = rows.get((own, opponent, move))
+            if row is None:
+                row = rows[(own, opponent, move)] = [0, 0, 0, 0, 0]
+            row[0] += 1
+            row[2 - result] += 1
+            row[4] += differential
+    return rows, num_games, errors
+
+
+def iter_batches(games, batch_size):
+    games = iter(games)
+    while True:
+        batch = list(itertools.islice(games, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class PositionDB:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(_schema)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def import_games(self, games, batch_size=default_batch_size, progress=None, jobs=1,
+                     on_error=None):
+        """Adds games, move lists, to the table; returns how many were added.
+
+        Rows are summed in memory for batch_size games, then written in one
+        transaction.  With more than one job, the batches are summed on a
+        pool of processes while this one writes.  progress(num_games) is
+        called after each batch.  A game with an illegal move is skipped and
+        on_error(index, message) called, index counting games from 0.
+        """
+        pool = None
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap(get_batch_rows, iter_batches(games, batch_size))
+        else:
+            results = itertools.imap(get_batch_rows, iter_batches(games, batch_size))
+
+        self.connection.execute("PRAGMA synchronous = OFF")
+        num_games = 0
+        first_index = 0
+        try:
+            for rows, count, errors in results:
+                self.write_rows(rows)
+                num_games += count
+                if on_error is not None:
+                    for index, message in errors:
+                        on_error(first_index + index, message)
+                first_index += count + len(errors)
+                if progress is not None:
+                    progress(num_games)
+        finally:
+            self.connection.execute("PRAGMA synchronous = FULL")
+            if pool is not None:
+                pool.terminate()
+        return num_games
+
+    def write_rows(self, rows):
+        """Adds rows, {(own, opponent, move): [games, wins, draws, losses,
+        disc sum]}, to the table in one transaction."""
+        connection = self.connection
+        connection.executemany("INSERT OR IGNORE INTO moves VALUES (?, ?, ?, 0, 0, 0, 0, 0)",
+                               rows.iterkeys())
+        connection.executemany("UPDATE moves SET games = games + ?, wins = wins + ?, "
+                               "draws = draws + ?, losses = losses + ?, disc_sum = disc_sum + ? "
+                               "WHERE own = ? AND opponent = ? AND move = ?",
+                               [tuple(counts) + key for key, counts in rows.iteritems()])
+        connection.commit()
+
+    def get_moves(self, white, black, player):
+        """Returns the MoveStats of every move played here, most played first."""
+        if player == 1:
+            own, opponent = white, black
+        else:
+            own, opponent = black, white
+        own, opponent, transform = get_key(own, opponent)
+        cursor = self.connection.execute(
+            "SELECT move, games, wins, draws, losses, disc_sum FROM moves "
+            "WHERE own = ? AND opponent = ? ORDER BY games DESC", (own, opponent))
+        result = []
+        for row in cursor:
+            result.append(MoveStats(symmetry.unmap_square(transform, row[0]), *row[1:]))
+        return result
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog import DB ARCHIVE...\n       %prog query DB [MOVES]")
+    parser.add_option("--batch-size", type="int", default=default_batch_size,
+                      help="games per transaction when importing")
+    parser.add_option("--jobs", type="int", default=multiprocessing.cpu_count(),
+                      help="processes preparing the rows when importing")
+    options, args = parser.parse_args(argv)
+    if len(args) < 2 or args[0] not in ("import", "query"):
+        parser.print_usage()
+        return 2
+    db = PositionDB(args[1])
+
+    if args[0] == "import":
+        # (index of its first game, path) of each archive, to say where a
+        # skipped game came from.
+        archives = []
+        num_read = [0]
+        num_skipped = [0]
+
+        def skip_line(message):
+            num_skipped[0] += 1
+            sys.stderr.write("\rskipped %s\n" % message)
+
+        def games():
+            for path in args[2:]:
+                archives.append((num_read[0], path))
+                # get_game_rows() replays every game, which checks its moves.
+                for moves in archive.read_games(path, False, skip_line):
+                    num_read[0] += 1
+                    yield moves
+
+        def skip_game(index, message):
+            num_skipped[0] += 1
+            first, path = [entry for entry in archives if entry[0] <= index][-1]
+            sys.stderr.write("\rskipped %s: game %d: %s\n" % (path, index - first + 1, message))
+
+        def progress(num_games):
+            sys.stderr.write("\r%d games" % num_games)
+
+        start = timer()
+        num_games = db.import_games(games(), options.batch_size, progress, options.jobs,
+                                    skip_game)
+        elapsed = timer() - start
+        print "\rpositiondb.py - imported %d games in %.1f s, skipped %d" % (
+            num_games, elapsed, num_skipped[0])
+    else:
+        moves = []
+        if len(args) > 2:
+            moves = archive.parse_game(args[2])
+        game = archive.replay_game(moves)
+        start = timer()
+        stats = db.get_moves(game.white, game.black, game.player)
+        elapsed = timer() - start
+        print "%-6s %8s %6s %6s %6s %8s" % ("move", "games", "wins", "draws", "losses", "discs")
+        for move in stats:
+            print "%-6s %8d %6d %6d %6d %+8.1f" % (
+                rules.format_square(move.square), move.games, move.wins, move.draws,
+                move.losses, move.get_average_disc_differential())
+        print "(%.2f ms)" % (elapsed * 1000)
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# profiling.py - Lightweight timing of the game's hot paths.
+#
+# The Profiler keeps a rolling window of recent timings for each stage, can
+# draw them as an overlay on top of the game, and can dump them to a file so
+# that lag reports from a classroom come with numbers attached.
+#
+# The StartupTimer records when each startup stage finished, measured from
+# the moment the process was started.
+#
+
+import os
+import sys
+import time
+import timeit
+
+from collections import deque
+
+
+timer = timeit.default_timer
+
+# Upper bounds (in ms) of the histogram buckets; the last bucket is unbounded.
+bucket_limits = [1, 2, 4, 8, 16, 33, 66, 133]
+
+overlay_background_color = (0, 0, 0)
+overlay_text_color = (255, 255, 0)
+overlay_alpha = 200
+
+
+def get_process_start_time():
+    """Returns when this process was started, or None if it is unknown."""
+    try:
+        stat = open("/proc/self/stat").read()
+        # Fields after the command name, which may itself contain spaces.
+        fields = stat[stat.rindex(")") + 2:].split()
+        start_ticks = int(fields[19])
+        uptime = float(open("/proc/uptime").read().split()[0])
+        age = uptime - start_ticks / float(os.sysconf("SC_CLK_TCK"))
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return time.time() - age
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start_time = get_process_start_time()
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.marks = []
+
+    def mark(self, name):
+        """Records that the startup stage called name has just finished."""
+        self.marks.append((name, time.time()))
+
+    def get_report(self):
+        """Returns a list of (name, ms since start, ms in this stage)."""
+        report = []
+        previous = self.start_time
+        for name, when in self.marks:
+            report.append((name, (when - self.start_time) * 1000.0,
+                           (when - previous) * 1000.0))
+            previous = when
+        return report
+
+    def print_report(self, out=None):
+        if out is None:
+            out = sys.stdout
+        out.write("%-36s %10s %10s\n" % ("startup stage", "total ms", "stage ms"))
+        for name, total, stage in self.get_report():
+            out.write("%-36s %10.1f %10.1f\n" % (name, total, stage))
+
+
+startup_timer = StartupTimer()
+
+
+class Histogram:
+    """A rolling window of timings, in milliseconds."""
+
+    def __init__(self, window_size):
+        self.samples = deque(maxlen=window_size)
+        self.count = 0
+
+    def add(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+
+    def get_percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+    def get_buckets(self):
+        buckets = [0] * (len(bucket_limits) + 1)
+        for ms in self.samples:
+            index = 0
+            while index < len(bucket_limits) and ms > bucket_limits[index]:
+                index += 1
+            buckets[index] += 1
+        return buckets
+
+    def get_summary(self):
+        samples = list(self.samples)
+        if samples:
+            mean = sum(samples) / len(samples)
+            maximum = max(samples)
+        else:
+            mean = maximum = 0.0
+        return {
+            "count": self.count,
+            "window": len(samples),
+            "mean": mean,
+            "p50": self.get_percentile(0.5),
+            "p90": self.get_percentile(0.9),
+            "p99": self.get_percentile(0.99),
+            "max": maximum,
+            "buckets": self.get_buckets(),
+        }
+
+
+class Profiler:
+    """Times named stages and keeps a Histogram for each of them."""
+
+    def __init__(self, window_size=300):
+        self.window_size = window_size
+        self.histograms = {}
+        self.stage_names = []
+        self.overlay_visible = False
+        self.font = None
+
+    def get_histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = Histogram(self.window_size)
+            self.histograms[name] = histogram
+            self.stage_names.append(name)
+        return histogram
+
+    def instrument(self, obj, method_name, name=None):
+        """Replaces obj.method_name with a version that records its timing."""
+        if name is None:
+            name = "%s.%s" % (obj.__class__.__name__, method_name)
+        method = getattr(obj, method_name)
+        histogram = self.get_histogram(name)
+
+        def timed(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                histogram.add((timer() - start) * 1000.0)
+
+        setattr(obj, method_name, timed)
+
+    def call(self, name, fn, *args, **kwargs):
+        """Calls fn and records how long it took under name."""
+        start = timer()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.get_histogram(name).add((timer() - start) * 1000.0)
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+
+    def get_report(self):
+        report = {
+            "time": time.time(),
+            "window_size": self.window_size,
+            "bucket_limits_ms": bucket_limits,
+            "startup": startup_timer.get_report(),
+            "stages": {},
+        }
+        for name in self.stage_names:
+            report["stages"][name] = self.histograms[name].get_summary()
+        return report
+
+    def print_report(self, out=None):
+        if out is None:
+            out = sys.stdout
+        out.write("%-36s %8s %8s %8s %8s %8s\n" % ("stage (ms)", "n", "mean", "p50", "p90", "max"))
+        for name in self.stage_names:
+            summary = self.histograms[name].get_summary()
+            out.write("%-36s %8d %8.2f %8.2f %8.2f %8.2f\n" % (
+                name, summary["count"], summary["mean"], summary["p50"],
+                summary["p90"], summary["max"]))
+
+    def dump(self, directory):
+        """Writes the current report to directory and returns its path."""
+        import json
+
+        file_name = "profile-%s.json" % time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, file_name)
+        out = open(path, "w")
+        try:
+            json.dump(self.get_report(), out, indent=2, sort_keys=True)
+        finally:
+            out.close()
+        return path
+
+    def draw_overlay(self, surface):
+        if not self.overlay_visible:
+            return
+
+        import pygame
+        if self.font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.font = pygame.font.Font(None, 22)
+
+        rows = [("stage (ms)", "n", "p50", "p90", "max")]
+        for name in self.stage_names:
+            summary = self.histograms[name].get_summary()
+            rows.append((name, "%d" % summary["window"], "%.2f" % summary["p50"],
+                         "%.2f" % summary["p90"], "%.2f" % summary["max"]))
+
+        # Render cell by cell since the default font is not monospaced.
+        images = [[self.font.render(text, True, overlay_text_color) for text in row]
+                  for row in rows]
+        column_widths = [max([row[index].get_width() for row in images]) + 12
+                         for index in range(len(rows[0]))]
+        line_height = self.font.get_linesize()
+        width = sum(column_widths) + 16
+        height = line_height * len(images) + 16
+
+        background = pygame.Surface((width, height))
+        background.fill(overlay_background_color)
+        background.set_alpha(overlay_alpha)
+        surface.blit(background, (8, 8))
+        for row_index, row in enumerate(images):
+            left = 16
+            for column_index, image in enumerate(row):
+                surface.blit(image, (left, 16 + row_index * line_height))
+                left += column_widths[column_index]
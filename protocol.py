@@ -0,0 +1,238 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# protocol.py - Drives the rules and the computer player over stdin/stdout.
+#
+# A line based protocol in the manner of GTP, for tournament scripts and
+# other front ends; it needs neither pygame nor gtk.  Each command may start
+# with a numeric id, which the reply repeats.  Replies are "= [id] result"
+# or "? [id] error", followed by an empty line.
+#
+# Moves are written as in Othello books, see rules.format_square(); a plain
+# square number is accepted too.
+#
+#   newgame                 start a new game
+#   setboard <64> <side>    set the position; squares in order, each "." for
+#                           empty, "O" or "W" for White, "X" or "B" for Black;
+#                           side is W or B, the player to move
+#   play [<side>] <move>    play move, or "pass" when there is no legal move
+#   genmove [<side>]        let the computer choose a move and play it
+#   legal                   list the legal moves of the player to move
+#   score                   White's and Black's disc counts
+#   analyze [<depth>]       every legal move with its score, best first
+#   multipv <n> [<depth>]   the n best moves, one per line, each with its
+#                           score and principal variation
+#   stats                   the last search of genmove, analyze or multipv,
+#                           one line per depth:
+#                           nodes, thousands of nodes per second, share of
+#                           table hits, branching factor, share of cutoffs
+#                           made by the first move, score and variation
+#   depth <n>               set the depth the computer searches
+#   showboard               the board, one row per line
+#   list_commands, protocol_version, name, version, quit
+#
+# Commands can be sent in batches without waiting for replies; all the
+# complete lines read at once are answered with a single write.
+#
+
+import os
+import sys
+
+import engine
+import rules
+
+PROTOCOL_VERSION = "1"
+ENGINE_NAME = "Reversi"
+ENGINE_VERSION = "1"
+
+side_names = {"W": 1, "WHITE": 1, "O": 1, "B": 2, "BLACK": 2, "X": 2}
+piece_chars = {".": 0, "-": 0, "O": 1, "W": 1, "X": 2, "B": 2}
+
+
+def parse_side(text):
+    side = side_names.get(text.upper())
+    if side is None:
+        raise ValueError("invalid side %s" % text)
+    return side
+
+
+class Session:
+    """Answers protocol commands about one game."""
+
+    def __init__(self):
+        self.game = rules.Game()
+        self.engine = engine.Engine()
+        # The IterationStats of the last search, whichever engine ran it.
+        self.iterations = []
+        self.finished = False
+        self.commands = {}
+        for name in dir(self):
+            if name.startswith("cmd_"):
+                self.commands[name[4:]] = getattr(self, name)
+
+    def handle_line(self, line):
+        """Returns the reply to line, or None if it holds no command."""
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            return None
+        parts = line.split()
+        command_id = ""
+        if parts[0].isdigit():
+            command_id = parts.pop(0)
+            if not parts:
+                return "? %s missing command\n\n" % command_id
+        handler = self.commands.get(parts[0].lower())
+        if handler is None:
+            return "?%s unknown command\n\n" % (command_id and " " + command_id)
+        try:
+            result = handler(*parts[1:])
+        except (ValueError, TypeError), e:
+            return "?%s %s\n\n" % (command_id and " " + command_id, e)
+        return "=%s %s\n\n" % (command_id and " " + command_id, result)
+
+    def check_side(self, args):
+        if args and parse_side(args[0]) != self.game.player:
+            raise ValueError("it is not %s's turn" % args[0])
+
+    def cmd_protocol_version(self):
+        return PROTOCOL_VERSION
+
+    def cmd_name(self):
+        return ENGINE_NAME
+
+    def cmd_version(self):
+        return ENGINE_VERSION
+
+    def cmd_list_commands(self):
+        return "\n".join(sorted(self.commands.keys()))
+
+    def cmd_quit(self):
+        self.finished = True
+        return ""
+
+    def cmd_newgame(self):
+        self.game.reset()
+        return ""
+
+    def cmd_setboard(self, board, side):
+        if len(board) != 64:
+            raise ValueError("board must have 64 squares")
+        masks = [0, 0, 0]
+        for square, char in enumerate(board.upper()):
+            piece = piece_chars.get(char)
+            if piece is None:
+                raise ValueError("invalid square %r" % char)
+            masks[piece] |= 1 << square
+        self.game.restore(masks[1], masks[2], parse_side(side), [])
+        return ""
+
+    def cmd_play(self, *args):
+        if not args or len(args) > 2:
+            raise ValueError("play needs a move")
+        self.check_side(args[:-1])
+        square = rules.parse_square(args[-1])
+        if square is None:
+            if self.game.can_move(self.game.player):
+                raise ValueError("cannot pass with legal moves")
+            self.game.set_player(rules.get_opponent(self.game.player))
+        else:
+            self.game.play(square)
+        return ""
+
+    def cmd_genmove(self, *args):
+        self.check_side(args)
+        square = self.engine.choose_move(self.game.white, self.game.black, self.game.player)
+        self.iterations = self.engine.iterations
+        if square is None:
+            self.game.set_player(rules.get_opponent(self.game.player))
+        else:
+            self.game.play(square)
+        return rules.format_square(square)
+
+    def cmd_legal(self):
+        return " ".join([rules.format_square(square)
+                         for square in rules.iter_squares(self.game.get_legal_moves())])
+
+    def cmd_score(self):
+        return "%d %d" % (self.game.get_count(1), self.game.get_count(2))
+
+    def cmd_analyze(self, depth=None):
+        if depth is not None:
+            analyzer = engine.Engine(int(depth))
+        else:
+            analyzer = self.engine
+        scores = analyzer.score_moves(self.game.white, self.game.black, self.game.player)
+        self.iterations = analyzer.iterations
+        return " ".join(["%s %d" % (rules.format_square(square), score) for square, score in scores])
+
+    def cmd_multipv(self, num_lines, depth=None):
+        num_lines = int(num_lines)
+        if num_lines < 1:
+            raise ValueError("the number of lines must be at least 1")
+        if depth is not None:
+            analyzer = engine.Engine(int(depth))
+        else:
+            analyzer = self.engine
+        lines = analyzer.analyze(self.game.white, self.game.black, self.game.player, num_lines)
+        self.iterations = analyzer.iterations
+        return "".join(["\n%s %d %s" % (rules.format_square(square), score,
+                                         engine.format_variation(variation))
+                        for square, score, variation in lines])
+
+    def cmd_stats(self):
+        return "".join(["\n" + " ".join(row) for row in engine.get_stats_rows(self.iterations)])
+
+    def cmd_depth(self, depth):
+        depth = int(depth)
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.engine.depth = depth
+        return ""
+
+    def cmd_showboard(self):
+        rows = []
+        for column_index in range(8):
+            row = []
+            for row_index in range(8):
+                bit = 1 << (column_index * 8 + row_index)
+                if self.game.white & bit:
+                    row.append("O")
+                elif self.game.black & bit:
+                    row.append("X")
+                else:
+                    row.append(".")
+            rows.append("%d %s" % (column_index + 1, " ".join(row)))
+        rows.insert(0, "  a b c d e f g h")
+        return "\n" + "\n".join(rows)
+
+
+def serve(infile, outfile):
+    """Answers commands from infile until quit or the end of input."""
+    session = Session()
+    fd = infile.fileno()
+    pending = ""
+    while not session.finished:
+        data = os.read(fd, 65536)
+        if not data:
+            # A last command without a newline still counts.
+            lines, pending = [pending], ""
+        else:
+            lines = (pending + data).split("\n")
+            pending = lines.pop()
+
+        replies = []
+        for line in lines:
+            reply = session.handle_line(line)
+            if reply is not None:
+                replies.append(reply)
+            if session.finished:
+                break
+        outfile.write("".join(replies))
+        outfile.flush()
+        if not data:
+            break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(serve(sys.stdin, sys.stdout))
@@ -23,20 +23,22 @@ import math
 import os
 import pygame
 import random
-import gtk
+import sys
+import threading
+
+import history
+import rules
+import savegame
+
+from profiling import Profiler, startup_timer
+from profiling import overlay_alpha, overlay_background_color, overlay_text_color
+from sounds import SoundBank, STEAL, init_mixer
 
 from gettext import gettext as _
 
 
 # Immutable Globals / Settings
 screen_size = (1200, 825)
-background_color = (255, 255, 255)
-background_board_color = (255, 255, 255)
-cell_padding_color = (0, 0, 0)
-available_cell_color = (0, 0, 0)
-player_view_outline_color = (0, 0, 0)
-player_view_outline_width = 1
-player_indicator_color = (0, 0, 0)
 player_indicator_size = (8, 32)
 num_columns = 8
 num_rows = 8
@@ -47,11 +49,91 @@ WHITE = (255, 255, 255)
 
 player_numbers_to_piece_names = [None, "White", "Black"]
 
+# The analysis panel searches this deep, or as deep as it gets in the time
+# limit, and shows this many of the best moves.
+analysis_depth = 6
+analysis_time_limit = 2.0
+analysis_lines = 3
+
+# Sounds that the game actually plays; these are decoded in the background
+# once the board is on screen.  Anything else in data/ is only decoded on use.
+played_sound_names = ["putdownflip", "putdownflip2", "putdownflip3", "clapping"]
+
+# The only pygame events the game reacts to; everything else can be dropped
+# before it is even translated.
+handled_event_types = [pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN]
+
+# Reserved mixer channels.  A burst of moves can overlap at most two
+# placement sounds, cutting off the oldest, and never delays the clapping.
+sound_channel_groups = [("placement", 2, STEAL), ("victory", 1, STEAL)]
+
+# Palette indices.  Every view surface is 8-bit and drawn with these indices
+# rather than with RGB colors, so that changing a theme color only requires a
+# new palette, not redrawing the surfaces.
+PAL_BACKGROUND = 0
+PAL_BOARD = 1
+PAL_BOARD_FRAME = 2
+PAL_LINES = 3
+PAL_INK = 4
+PAL_PLAYER1 = 5         # White piece body, drawn on the board
+PAL_PLAYER1_MINI = 6    # White piece body, drawn on a player view
+PAL_PLAYER1_EDGE = 7
+PAL_PLAYER2 = 8
+
+
+def create_palette_surface(size):
+    """Creates an 8-bit surface to be drawn with PAL_* indices."""
+    return pygame.Surface(size, 0, 8)
+
 
-def load_sound(relative_path_name):
-    full_path_name = os.path.abspath(os.path.join('data', relative_path_name))
-    sound = pygame.mixer.Sound(full_path_name)
-    return sound
+
+#===============================================================================
+# Theme
+#===============================================================================
+
+class Theme:
+    """Holds the colors chosen from the toolbar and maps them to a palette."""
+
+    def __init__(self):
+        self.background_color = (255, 255, 255)
+        self.board_color = (255, 255, 255)
+        self.line_color = (0, 0, 0)
+        self.player1_color = WHITE
+        self.player2_color = BLACK
+
+    def get_colors(self):
+        """Returns the colors in the order set_colors and savegame use."""
+        return [self.background_color, self.board_color, self.line_color,
+                self.player1_color, self.player2_color]
+
+    def set_colors(self, colors):
+        (self.background_color, self.board_color, self.line_color,
+         self.player1_color, self.player2_color) = [tuple(color) for color in colors]
+
+    def get_palette(self):
+        """Returns the palette to apply to every view surface."""
+        if self.player1_color == WHITE:
+            # White pieces are drawn as an outlined ring, so the body takes
+            # the color of whatever is behind it.
+            player1_body = self.board_color
+            player1_mini_body = self.background_color
+            player1_edge = BLACK
+        else:
+            player1_body = self.player1_color
+            player1_mini_body = self.player1_color
+            player1_edge = self.player1_color
+
+        palette = [None] * (PAL_PLAYER2 + 1)
+        palette[PAL_BACKGROUND] = self.background_color
+        palette[PAL_BOARD] = self.board_color
+        palette[PAL_BOARD_FRAME] = (100, 100, 100)
+        palette[PAL_LINES] = self.line_color
+        palette[PAL_INK] = BLACK
+        palette[PAL_PLAYER1] = player1_body
+        palette[PAL_PLAYER1_MINI] = player1_mini_body
+        palette[PAL_PLAYER1_EDGE] = player1_edge
+        palette[PAL_PLAYER2] = self.player2_color
+        return palette
 
 
 
@@ -70,33 +152,29 @@ class CellView(pygame.sprite.Sprite):
         self.board_coord = board_coord
         
         # Create an image and clear it
-        self.image = pygame.Surface(self.rect.size)
+        self.image = create_palette_surface(self.rect.size)
         self.show_no_piece()
 
+    def set_palette(self, palette):
+        self.image.set_palette(palette)
+
     def show_piece(self, color):
         """Shows a piece in the cell.  Set color to "Black" or "White"."""
-        global background_board_color
-
-        self.image.fill(background_board_color)
+        self.image.fill(PAL_BOARD)
 
         piece_width = self.rect.width * 0.8
         border_size = self.rect.width * 0.05
         pos = (self.rect.centerx - self.rect.left, self.rect.centery - self.rect.top)
         #Colors of black and white circles
         if color == "Black":
-            pygame.draw.circle(self.image, BLACK, pos, int(piece_width / 2))
+            pygame.draw.circle(self.image, PAL_PLAYER2, pos, int(piece_width / 2))
         elif color == "White":
-            if WHITE == (255, 255, 255):
-                pygame.draw.circle(self.image, (0, 0, 0), pos, int(piece_width / 2), int(border_size))
-            else:
-                pygame.draw.circle(self.image, WHITE, pos, int(piece_width / 2))
+            pygame.draw.circle(self.image, PAL_PLAYER1, pos, int(piece_width / 2))
+            pygame.draw.circle(self.image, PAL_PLAYER1_EDGE, pos, int(piece_width / 2), int(border_size))
     
     def show_no_piece(self):
         """Clears the cell, showing no piece at all."""
-        global background_board_color
-
-        self.image = pygame.Surface(self.rect.size)
-        self.image.fill(background_board_color)
+        self.image.fill(PAL_BOARD)
     
     def show_as_available(self, piece_color_name = "Black"):
         #self.draw_corners()
@@ -114,34 +192,49 @@ class CellView(pygame.sprite.Sprite):
         pointlist = [(left, top),
                      (left, top + size),
                      (left + size, top)]
-        pygame.draw.polygon(self.image, available_cell_color, pointlist)
+        pygame.draw.polygon(self.image, PAL_INK, pointlist)
         
         pointlist = [(right, top),
                      (right - size, top),
                      (right, top + size)]
-        pygame.draw.polygon(self.image, available_cell_color, pointlist)
+        pygame.draw.polygon(self.image, PAL_INK, pointlist)
         
         pointlist = [(right, bottom),
                      (right, bottom - size),
                      (right - size, bottom)]
-        pygame.draw.polygon(self.image, available_cell_color, pointlist)
+        pygame.draw.polygon(self.image, PAL_INK, pointlist)
 
         pointlist = [(left, bottom),
                      (left + size, bottom),
                      (left, bottom - size)]
-        pygame.draw.polygon(self.image, available_cell_color, pointlist)
+        pygame.draw.polygon(self.image, PAL_INK, pointlist)
         
     def draw_dot(self, color):
         pos = (self.rect.centerx - self.rect.left, self.rect.centery - self.rect.top)
         if color == "Black":
             radius = int(self.rect.width * 0.05)
-            pygame.draw.circle(self.image, (0, 0, 0), pos, radius)
+            pygame.draw.circle(self.image, PAL_INK, pos, radius)
         elif color == "White":
             radius = int(self.rect.width * 0.07)
             width = 2
-            pygame.draw.circle(self.image, (0, 0, 0), pos, radius, width)
+            pygame.draw.circle(self.image, PAL_INK, pos, radius, width)
     
-    def update_from_cell_model(self, cell_model, is_available, active_piece_color_name):
+    def draw_hint(self, share, score):
+        """Draws a bar along the bottom of the cell: filled in proportion to
+        how often the move was played, with a tick at the mover's score."""
+        track = pygame.Rect(0, 0, int(self.rect.width * 0.8), max(int(self.rect.height * 0.08), 3))
+        track.midbottom = (self.rect.width / 2, self.rect.height - int(self.rect.height * 0.06))
+        pygame.draw.rect(self.image, PAL_INK, track, 1)
+
+        filled = pygame.Rect(track)
+        filled.width = max(int(track.width * share), 1)
+        self.image.fill(PAL_INK, filled)
+
+        tick_x = track.left + int((track.width - 1) * score)
+        pygame.draw.line(self.image, PAL_INK, (tick_x, track.top - track.height),
+                         (tick_x, track.bottom - 1), 2)
+
+    def update_from_cell_model(self, cell_model, is_available, active_piece_color_name, hint=None):
         if cell_model.has_piece():
             self.show_piece(cell_model.get_piece_name())
         else:
@@ -150,6 +243,9 @@ class CellView(pygame.sprite.Sprite):
         if is_available:
             self.show_as_available(active_piece_color_name)
 
+        if hint is not None:
+            self.draw_hint(*hint)
+
 
 class BoardView:
     def __init__(self, controller, top_left, size_in_pixels, grid_size):
@@ -166,11 +262,19 @@ class BoardView:
         cell_height = (size_in_pixels[1] - (cell_padding * (grid_size[1] + 1))) / grid_size[1]
         self.cell_size = (cell_width, cell_height)
 
-        self.background = pygame.Surface(self.size_in_pixels)
+        self.background = create_palette_surface(self.size_in_pixels)
         self.init_cell_views(self.cell_size, self.grid_size)
 
+        # {board_coord: hint} of the position database hints drawn now.
+        self.shown_hints = {}
+
         self.redraw_background()
-        
+
+    def set_palette(self, palette):
+        self.background.set_palette(palette)
+        for cell_view in self.cell_view_group:
+            cell_view.set_palette(palette)
+
     def redraw_background(self):
         # Draw board background
         self.draw_board_background(self.cell_size, self.grid_size)
@@ -201,20 +305,19 @@ class BoardView:
     
     def draw_board_background(self, cell_size, grid_size):
         # tablero
-        background_color = (100, 100, 100)
-        self.background.fill(background_color)
+        self.background.fill(PAL_BOARD_FRAME)
         
         drawn_height = cell_padding + (grid_size[1] * (cell_padding + cell_size[1]))
         tmp_rect = pygame.Rect(0, 0, cell_padding, drawn_height)
         for column_index in range(grid_size[0] + 1):
             tmp_rect.left = column_index * (cell_padding + cell_size[0])
-            self.background.fill(cell_padding_color, tmp_rect)
+            self.background.fill(PAL_LINES, tmp_rect)
     
         drawn_width = cell_padding + (grid_size[0] * (cell_padding + cell_size[0]))
         tmp_rect = pygame.Rect(0, 0, drawn_width, cell_padding)
         for row_index in range(grid_size[0] + 1):
             tmp_rect.top = row_index * (cell_padding + cell_size[1])
-            self.background.fill(cell_padding_color, tmp_rect)
+            self.background.fill(PAL_LINES, tmp_rect)
     
     def get_num_columns(self):
         return self.num_columns
@@ -241,25 +344,33 @@ class BoardView:
         return False
     
     def update_from_model(self, model):
-        #board_model = model.get_board_model()
-        for row_index in range(0, self.get_num_rows()):
-            for column_index in range(0, self.get_num_columns()):
-                cell_model = model.get_cell_model(column_index, row_index)
-
-                is_available = model.is_cell_available_for_move(cell_model.get_board_coord())
-                active_player_number = model.get_active_player_number()
-                active_piece_color_name = player_numbers_to_piece_names[active_player_number]
-
-                cell_view = self.get_cell_view_at_board_coord((column_index, row_index))
-                cell_view.update_from_cell_model(cell_model, is_available, active_piece_color_name)
-                #cell_view.update_from_model(model)
-                
-                # HACK
-                #if column_index == 1 and row_index == 1:
-                #    cell_view.show_as_available()
+        """Redraws the cells that changed since the last update: those in the
+        model's ChangeSet and those whose hint appeared or went away."""
+        board_model = model.get_board_model()
+        changes = model.pop_changes()
+        hints = self.controller.get_hints(model)
+
+        changed = changes.get_changed_mask()
+        for board_coord in self.shown_hints.keys() + hints.keys():
+            changed |= 1 << board_model.get_square(board_coord)
+        self.shown_hints = hints
+
+        active_piece_color_name = player_numbers_to_piece_names[model.get_active_player_number()]
+        for square in rules.iter_squares(changed):
+            board_coord = board_model.get_board_coord(square)
+            cell_model = board_model.get_cell_model(board_coord[0], board_coord[1])
+            cell_view = self.get_cell_view_at_board_coord(board_coord)
+            cell_view.update_from_cell_model(cell_model, changes.new_moves >> square & 1,
+                                             active_piece_color_name, hints.get(board_coord))
     
     def draw(self, surface):
+        self.draw_background(surface)
+        self.draw_cells(surface)
+
+    def draw_background(self, surface):
         surface.blit(self.background, self.top_left)
+
+    def draw_cells(self, surface):
         self.cell_view_group.draw(surface)
 
 
@@ -267,7 +378,18 @@ class PlayerView:
     def __init__(self, rect, player_number):
         self.rect = rect
         self.player_number = player_number
+        self.image = create_palette_surface(self.rect.size)
+        self.mini_piece_images = {}
+        for piece_name in ["White", "Black"]:
+            self.mini_piece_images[piece_name] = self.create_mini_piece_image(piece_name)
         self.update_image(1, False, 0)
+
+    def set_palette(self, palette):
+        # The mini piece images must share the view's palette so that blitting
+        # them copies indices instead of remapping colors.
+        self.image.set_palette(palette)
+        for image in self.mini_piece_images.values():
+            image.set_palette(palette)
         
     def update_from_model(self, model):
         player_model = model.get_player_model_from_number(self.player_number)
@@ -276,8 +398,7 @@ class PlayerView:
         self.update_image(player_model.get_player_number(), model.is_player_active(self.player_number), piece_count)
         
     def update_image(self, player_number, player_is_active, piece_count):
-        self.image = pygame.Surface(self.rect.size)
-        self.image.fill(background_color)  
+        self.image.fill(PAL_BACKGROUND)
         #self.draw_outline()
         self.draw_player_number(player_number)
         self.draw_piece_count(piece_count, player_numbers_to_piece_names[player_number])
@@ -285,14 +406,14 @@ class PlayerView:
         
     def draw_outline(self):
         tmp_rect = pygame.Rect((0, 0), self.rect.size)
-        pygame.draw.rect(self.image, player_view_outline_color, tmp_rect, 1)
+        pygame.draw.rect(self.image, PAL_INK, tmp_rect, 1)
         
     def draw_player_active(self, is_active):
         if is_active:
             tmp_rect = pygame.Rect((0, 0), self.rect.size)
             tmp_rect.height = 48
             tmp_rect.width -= 1
-            pygame.draw.rect(self.image, (0, 0, 0), tmp_rect, 2)
+            pygame.draw.rect(self.image, PAL_INK, tmp_rect, 2)
 #===============================================================================
 #            # Draw a line below the player number
 #            tmp_rect = pygame.Rect((0, 0), self.rect.size)
@@ -303,25 +424,24 @@ class PlayerView:
 #===============================================================================
         
     def draw_player_number(self, player_number):
-        #global player_indicator_color
         tmp_rect = pygame.Rect((0, 0), player_indicator_size)
         piece_color_name = player_numbers_to_piece_names[player_number]
         if piece_color_name == "White":
             # draw one box, centered at the top of the view
             tmp_rect.centerx = self.rect.width / 2
             tmp_rect.top = 8
-            self.image.fill(player_indicator_color, tmp_rect)
+            self.image.fill(PAL_INK, tmp_rect)
             #self.image.fill((255, 255, 255), tmp_rect.inflate(-4, -4))
         elif piece_color_name == "Black":
             # draw two boxes, centered at the top of the view
             tmp_rect.right = (self.rect.width / 2) - 4
             tmp_rect.top = 8
-            self.image.fill(player_indicator_color, tmp_rect)
+            self.image.fill(PAL_INK, tmp_rect)
             tmp_rect.left = (self.rect.width / 2) + 4
-            self.image.fill(player_indicator_color, tmp_rect)
+            self.image.fill(PAL_INK, tmp_rect)
             
     def draw_piece_count(self, piece_count, piece_name):
-        mini_piece_image = self.create_mini_piece_image(piece_name)
+        mini_piece_image = self.mini_piece_images[piece_name]
         
         leftmost = 4
         topmost = 60
@@ -340,16 +460,14 @@ class PlayerView:
     def create_mini_piece_image(self, piece_name):
         width = (self.rect.width - 20) / 5
 
-        image = pygame.Surface((width, width))
-        image.fill(background_color)
+        image = create_palette_surface((width, width))
+        image.fill(PAL_BACKGROUND)
 
         if piece_name == "Black":
-            pygame.draw.circle(image, BLACK, (width/2, width/2), width/2)
+            pygame.draw.circle(image, PAL_PLAYER2, (width/2, width/2), width/2)
         elif piece_name == "White":
-            if WHITE == (255, 255, 255):
-                pygame.draw.circle(image, (0, 0, 0), (width/2, width/2), width/2, 2)
-            else:
-                pygame.draw.circle(image, WHITE, (width/2, width/2), width/2)
+            pygame.draw.circle(image, PAL_PLAYER1_MINI, (width/2, width/2), width/2)
+            pygame.draw.circle(image, PAL_PLAYER1_EDGE, (width/2, width/2), width/2, 2)
             
         return image
         
@@ -362,33 +480,36 @@ class RestartButton:
         self.controller = controller
         self.rect = rect
         self.is_visible = is_visible
+        self.image = create_palette_surface(self.rect.size)
         self.update_image()
-        
+
+    def set_palette(self, palette):
+        self.image.set_palette(palette)
+
     def set_visible(self, is_visible):
         self.is_visible = is_visible
     
     def update_image(self):
-        self.image = pygame.Surface(self.rect.size)
-        self.image.fill(background_color)
-        self.image.set_colorkey(background_color)
+        self.image.fill(PAL_BACKGROUND)
+        self.image.set_colorkey(PAL_BACKGROUND)
 
         top_ellipse_rect = pygame.Rect((0, 0), self.rect.size)
         top_ellipse_rect.height = self.rect.height * 0.2
-        pygame.draw.ellipse(self.image, (0, 0, 0), top_ellipse_rect, 3)
+        pygame.draw.ellipse(self.image, PAL_INK, top_ellipse_rect, 3)
         
         bottom_ellipse_rect = pygame.Rect(top_ellipse_rect)
         bottom_ellipse_rect.width = self.rect.width * 0.8
         bottom_ellipse_rect.centerx = self.rect.width / 2
         bottom_ellipse_rect.bottom = self.rect.height
-        pygame.draw.arc(self.image, (0, 0, 0), bottom_ellipse_rect, math.pi, 2 * math.pi, 3)
+        pygame.draw.arc(self.image, PAL_INK, bottom_ellipse_rect, math.pi, 2 * math.pi, 3)
 
         pt1 = top_ellipse_rect.midleft
         pt2 = bottom_ellipse_rect.midleft
-        pygame.draw.line(self.image, (0, 0, 0), pt1, pt2, 2)
+        pygame.draw.line(self.image, PAL_INK, pt1, pt2, 2)
 
         pt1 = (top_ellipse_rect.right - 2, top_ellipse_rect.centery)
         pt2 = (bottom_ellipse_rect.right - 2, bottom_ellipse_rect.centery)
-        pygame.draw.line(self.image, (0, 0, 0), pt1, pt2, 2)
+        pygame.draw.line(self.image, PAL_INK, pt1, pt2, 2)
             
     def draw(self, surface):
         if self.is_visible:
@@ -403,8 +524,64 @@ class RestartButton:
         return False
 
 
+class SearchStatsView:
+    """A panel with the statistics of an engine search, iteration by
+    iteration, and the best moves it found; hidden unless turned on."""
+
+    def __init__(self, bottom_left):
+        self.bottom_left = bottom_left
+        self.visible = False
+        self.font = None
+        self.image = None
+
+    def set_visible(self, is_visible):
+        self.visible = is_visible
+
+    def update_from_search(self, iterations, lines):
+        """Renders engine.IterationStats and [(square, score, variation)]."""
+        if self.font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            self.font = pygame.font.Font(None, 22)
+
+        import engine
+
+        rows = engine.get_stats_rows(iterations)
+        for index, (square, score, variation) in enumerate(lines):
+            rows.append(("%d." % (index + 1), rules.format_square(square), "%d" % score,
+                         engine.format_variation(variation)))
+
+        # Cell by cell since the default font is not monospaced.
+        images = [[self.font.render(text, True, overlay_text_color) for text in row]
+                  for row in rows]
+        # The columns fit the statistics; the last text of a row, like a
+        # variation, may run on past them.
+        column_widths = [max([row[index].get_width() for row in images[:len(iterations) + 1]]) + 12
+                         for index in range(len(images[0]))]
+        width = max([sum(column_widths[:len(row) - 1]) + row[-1].get_width() for row in images])
+        line_height = self.font.get_linesize()
+        self.image = pygame.Surface((width + 16, line_height * len(images) + 16))
+        self.image.fill(overlay_background_color)
+        for row_index, row in enumerate(images):
+            left = 8
+            for column_index, image in enumerate(row):
+                self.image.blit(image, (left, 8 + row_index * line_height))
+                left += column_widths[column_index]
+        self.image.set_alpha(overlay_alpha)
+
+    def clear(self):
+        self.image = None
+
+    def draw(self, surface):
+        if self.visible and self.image is not None:
+            rect = self.image.get_rect(bottomleft=self.bottom_left)
+            surface.blit(self.image, rect)
+
+
 class ReversiView:
-    def __init__(self, controller, view_size, grid_size):
+    def __init__(self, controller, view_size, grid_size, theme):
+        self.theme = theme
+
         # Setup board view
         use = (170 + 40 + 40) * 2
         width = view_size[0] - use
@@ -424,6 +601,20 @@ class ReversiView:
         # Setup end-of-game restart button
         self.restart_button = RestartButton(controller, pygame.Rect(60, 600, 130, 130), False)
 
+        # The analysis panel sits over the bottom of the board.
+        self.stats_view = SearchStatsView((250, 50 + size))
+
+        self.update_from_theme()
+
+    def update_from_theme(self):
+        """Applies the theme's colors by swapping palettes; nothing is redrawn."""
+        palette = self.theme.get_palette()
+        self.board_view.set_palette(palette)
+        for player_view in self.player_views:
+            if player_view is not None:
+                player_view.set_palette(palette)
+        self.restart_button.set_palette(palette)
+
     def update_from_model(self, model):
         self.board_view.update_from_model(model)
 
@@ -435,7 +626,7 @@ class ReversiView:
         self.board_view.redraw_background()
 
     def draw(self, surface):
-        surface.fill(background_color)
+        surface.fill(self.theme.background_color)
 
         self.board_view.draw(surface)
 
@@ -444,6 +635,7 @@ class ReversiView:
                 player_view.draw(surface)
                 
         self.restart_button.draw(surface)
+        self.stats_view.draw(surface)
         
     def handle_event(self, event):
         if self.board_view.handle_event(event) == True:
@@ -460,9 +652,11 @@ class ReversiView:
 #===============================================================================
 
 class CellModel:
-    def __init__(self, board_coord):
+    """One square of the board, read through the BoardModel."""
+
+    def __init__(self, board_model, board_coord):
+        self.board_model = board_model
         self.board_coord = board_coord
-        self.piece_name = None
     
     def get_board_coord(self):
         return self.board_coord
@@ -474,17 +668,14 @@ class CellModel:
             return self.get_piece_name() == color_name
     
     def get_piece_name(self):
-        return self.piece_name
-    
-    def put_piece(self, piece_name):
-        self.piece_name = piece_name
-    
-    def clear_piece(self):
-        self.piece_name = None
+        return self.board_model.get_piece_name(self.board_coord)
 
 
 class BoardModel:
-    def __init__(self, grid_size):
+    """Presents the bitboards of a rules.Game as a grid of cells."""
+
+    def __init__(self, game, grid_size):
+        self.game = game
         self.init_cell_models(grid_size)
         
     def init_cell_models(self, grid_size):
@@ -492,7 +683,7 @@ class BoardModel:
         for column_index in range(0, grid_size[0]):
             column = []
             for row_index in range(0, grid_size[1]):
-                cell_model = CellModel((column_index, row_index))
+                cell_model = CellModel(self, (column_index, row_index))
                 column.append(cell_model)
 
             self.cell_models.append(column)
@@ -503,66 +694,46 @@ class BoardModel:
         else:
             return self.cell_models[column_index][row_index]
     
-    def put_piece(self, piece_color_name, board_coord, toggle_cells,):
-        cell_model = self.get_cell_model(board_coord[0], board_coord[1])
-        cell_model.put_piece(piece_color_name)
-        if toggle_cells:
-            cells_to_toggle = self.get_toggleable_cells_at_coord(piece_color_name, board_coord)
-            for cell_model in cells_to_toggle:
-                cell_model.put_piece(piece_color_name)
-            return len(cells_to_toggle)
-        else:
-            return 0
-        
-    def clear_piece(self, column_index, row_index):
-        cell_model = self.get_cell_model(column_index, row_index)
-        cell_model.clear_piece()
-    
+    def get_square(self, board_coord):
+        """Returns the index of the bit that stands for board_coord in a mask."""
+        return board_coord[0] * len(self.cell_models[0]) + board_coord[1]
+
+    def get_board_coord(self, square):
+        num_rows = len(self.cell_models[0])
+        return (square / num_rows, square % num_rows)
+
+    def get_piece_name(self, board_coord):
+        bit = 1 << self.get_square(board_coord)
+        if self.game.white & bit:
+            return "White"
+        elif self.game.black & bit:
+            return "Black"
+        return None
+
+    def get_mask(self, piece_name):
+        """Returns a bitmask of the cells holding piece_name pieces."""
+        player_number = player_numbers_to_piece_names.index(piece_name)
+        return self.game.get_player_masks(player_number)[0]
+
     def get_piece_count(self, piece_name):
-        count = 0
-        for column in self.cell_models:
-            for cell_model in column:
-                if cell_model.get_piece_name() == piece_name:
-                    count += 1
-        return count
-    
-    def is_cell_available_for_move(self, piece_color_name, board_coord):
-        cell_model = self.get_cell_model(board_coord[0], board_coord[1])
-        if cell_model.has_piece():
-            return False
-        else:
-            cells_to_toggle = self.get_toggleable_cells_at_coord(piece_color_name, board_coord)
-            return len(cells_to_toggle) > 0
-    
-    def get_toggleable_cells_at_coord(self, piece_color_name, board_coord):
-        cells = []
-        for step in [(0,-1), (1,-1), (1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1)]: # directions to move in
-            cells_to_add = self.get_toggleable_cells_in_direction(piece_color_name, board_coord, step)
-            cells.extend(cells_to_add)
-        return cells
-    
-    def get_toggleable_cells_in_direction(self, piece_color_name, starting_board_coord, step):
-        cells = []
-        cell_pos = [starting_board_coord[0], starting_board_coord[1]]
-        while True:
-            cell_pos[0] += step[0]
-            cell_pos[1] += step[1]
-            cell_model = self.get_cell_model(cell_pos[0], cell_pos[1])
-            if cell_model and cell_model.has_piece():
-                if cell_model.get_piece_name() is not piece_color_name:
-                    cells.append(cell_model)
-                else:
-                    return cells
-            else:
-                return []
+        return rules.count_bits(self.get_mask(piece_name))
+
+
+class ChangeSet:
+    """What changed on the board between two positions, as masks: squares
+    that got a piece, lost one (going back in the history) or changed
+    color, and the legal moves shown before and after.  Every legal move
+    counts as changed, since the dots show whose turn it is."""
+
+    def __init__(self, old_white, old_black, old_moves, white, black, new_moves):
+        self.placed = (white | black) & ~(old_white | old_black)
+        self.removed = (old_white | old_black) & ~(white | black)
+        self.flipped = (old_white & black) | (old_black & white)
+        self.old_moves = old_moves
+        self.new_moves = new_moves
 
-    def get_all_toggleable_cells(self, piece_color_name):
-        cells = []
-        for column in self.cell_models:
-            for cell_model in column:
-                if self.is_cell_available_for_move(piece_color_name, cell_model.get_board_coord()):
-                    cells.append(cell_model)
-        return cells                
+    def get_changed_mask(self):
+        return self.placed | self.removed | self.flipped | self.old_moves | self.new_moves
 
 
 class PlayerModel:
@@ -578,19 +749,32 @@ class PlayerModel:
 
 
 class ReversiModel:
-    def __init__(self, parent, grid_size):
-        self.parent = parent
+    """The game as the views and the controller see it.
+
+    The rules and the position live in a rules.Game; observer, if given, has
+    its player_changed(player_number) called whenever the turn changes.
+    Every position of the game is kept in a history.History, which is also
+    where the moves are read from; the Game only holds the position shown.
+    """
+
+    def __init__(self, grid_size, observer=None):
         self.grid_size = grid_size
 
-        self.current_player = 1
+        self.game = rules.Game(observer)
+        self.history = history.History()
+        # (white, black, legal moves) as of the last pop_changes().
+        self.reported = None
 
-        self.board_model = BoardModel(grid_size)
+        self.board_model = BoardModel(self.game, grid_size)
 
         self.player_models = []
         self.player_models.append(None)
         self.player_models.append(PlayerModel(1))
         self.player_models.append(PlayerModel(2))
         
+    def get_game(self):
+        return self.game
+
     def get_board_model(self):
         return self.board_model
     
@@ -608,25 +792,20 @@ class ReversiModel:
         return None
     
     def is_player_active(self, player_number):
-        return player_number == self.current_player
+        return player_number == self.game.player
     
     def set_current_player(self, player_number):
-        self.current_player = player_number
-        self.parent.set_current_player(self.current_player)
+        self.game.set_player(player_number)
+        self.history.set_player(player_number)
 
     def get_active_player_number(self):
-        return self.current_player
+        return self.game.player
         
     def get_inactive_player_number(self):
-        if self.current_player == 1:
-            return 2
-        else:
-            return 1
+        return rules.get_opponent(self.game.player)
         
     def can_player_move(self, player_number):
-        player_model = self.get_player_model_from_number(player_number)
-        available_cells_to_match = self.board_model.get_all_toggleable_cells(player_model.get_piece_color_name())
-        return len(available_cells_to_match) > 0
+        return self.game.can_move(player_number)
         
     def can_toggle_current_player(self):
         return self.can_player_move(self.get_inactive_player_number())
@@ -635,27 +814,78 @@ class ReversiModel:
         self.set_current_player(self.get_inactive_player_number())
 
     def setup_initial_pieces(self):
-        for column in range(0, self.grid_size[0]):
-            for row in range(0, self.grid_size[1]):
-                self.board_model.clear_piece(column, row)
-        
-        self.board_model.put_piece("Black", (3,3), False)
-        self.board_model.put_piece("White", (3,4), False)
-        self.board_model.put_piece("White", (4,3), False)
-        self.board_model.put_piece("Black", (4,4), False)
+        self.game.reset()
+        self.history.reset(self.game.white, self.game.black, self.game.player)
         
     def put_piece(self, board_coord):
-        current_player_model = self.get_player_model_from_number(self.current_player)
-        piece_color_name = current_player_model.get_piece_color_name()
-        return self.board_model.put_piece(piece_color_name, board_coord, True)
+        """Plays board_coord for the active player; returns the number flipped."""
+        square = self.board_model.get_square(board_coord)
+        flips = self.game.place(square)
+        self.history.record(self.game.white, self.game.black, self.game.player, square)
+        return rules.count_bits(flips)
+
+    def get_move_history(self):
+        """Returns the squares played up to the position shown, in order."""
+        return self.history.get_moves()
+
+    def get_ply(self):
+        """Returns the number of moves played up to the position shown."""
+        return self.history.get_cursor()
+
+    def get_num_plies(self):
+        """Returns the number of moves in the history, the position shown or not."""
+        return self.history.get_length() - 1
+
+    def get_player_at_ply(self, ply):
+        """Returns the player to move after ply moves."""
+        return self.history.get(ply)[2]
+
+    def jump_to_ply(self, ply):
+        """Shows the position after ply moves."""
+        white, black, player, move = self.history.seek(ply)
+        self.game.restore(white, black, player, ())
+
+    def get_masks(self):
+        """Returns the (white, black) bitmasks of the board."""
+        return self.game.get_masks()
+
+    def restore(self, white, black, current_player, move_history):
+        """Sets the position directly, without playing any moves.
+
+        The history is rebuilt from move_history if the moves lead to the
+        position, and otherwise starts at it.
+        """
+        self.game.restore(white, black, current_player, ())
+        replay = rules.Game()
+        self.history.reset(replay.white, replay.black, replay.player)
+        try:
+            for square in move_history:
+                replay.play(square)
+                self.history.record(replay.white, replay.black, replay.player, square)
+        except (ValueError, IndexError):
+            replay = None
+        if replay is None or replay.get_masks() != (white, black):
+            self.history.reset(white, black, current_player)
+        else:
+            self.history.set_player(current_player)
     
+    def pop_changes(self):
+        """Returns the ChangeSet from the position of the last call to this
+        one; the first call reports every square."""
+        white, black = self.game.get_masks()
+        moves = self.game.get_legal_moves()
+        if self.reported is None:
+            old_white, old_black, old_moves = 0, 0, rules.FULL
+        else:
+            old_white, old_black, old_moves = self.reported
+        self.reported = (white, black, moves)
+        return ChangeSet(old_white, old_black, old_moves, white, black, moves)
+
     def get_piece_count(self, piece_color_name):
-        #player_model = self.get_player_model_from_color_name(piece_color_name)
         return self.board_model.get_piece_count(piece_color_name)
     
     def is_cell_available_for_move(self, board_coord):
-        player_model = self.get_player_model_from_number(self.current_player)
-        return self.board_model.is_cell_available_for_move(player_model.get_piece_color_name(), board_coord)
+        return self.game.is_legal(self.board_model.get_square(board_coord))
 
 
 
@@ -663,11 +893,92 @@ class ReversiModel:
 # Controllers
 #===============================================================================
 
+# The commands a session log records, by key, with the method each calls.
+# The others carry objects a log cannot hold, and leave the game as it was.
+recorded_commands = {
+    'new_game': 'handle_restart_button_click',
+    'player1_color': 'set_player1_color',
+    'player2_color': 'set_player2_color',
+    'line_color': 'set_line_color',
+    'back_color': 'set_back_color',
+    'board_color': 'set_board_color',
+    'sound': 'change_sound',
+    'computer_level': 'set_computer_level',
+    'computer_move': 'play_computer_move',
+}
+
+
+class CommandQueue:
+    """Commands for the game loop, posted from GTK callbacks or other threads.
+
+    A command posted under the key of one that is still pending replaces it,
+    so a burst of updates of one kind costs a single call per frame.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.order = []
+
+    def post(self, key, fn, *args):
+        self.lock.acquire()
+        try:
+            if key not in self.pending:
+                self.order.append(key)
+            self.pending[key] = (fn, args)
+        finally:
+            self.lock.release()
+
+    def drain(self):
+        """Runs the pending commands, in the order their keys were first
+        posted; returns the (key, args) of each."""
+        self.lock.acquire()
+        try:
+            pending, order = self.pending, self.order
+            self.pending, self.order = {}, []
+        finally:
+            self.lock.release()
+
+        ran = []
+        for key in order:
+            fn, args = pending[key]
+            fn(*args)
+            ran.append((key, args))
+        return ran
+
+
 class ReversiController:
 
     def __init__(self, parent=None):
         self.parent = parent
         self.sound_enable = True
+        self.sounds = None
+        self.theme = Theme()
+        self.theme_invalid = False
+        self.commands = CommandQueue()
+        self.profiler = Profiler()
+        self.view = None
+        self.model = None
+        self.pending_state = None
+        self.collab = None
+        self.position_db = None
+        self.show_hints = False
+        self.show_analysis = False
+        self.analyzed_position = None
+        self.analysis_engine = None
+        self.analysis_thread = None
+        self.computer_player = 2
+        self.computer_level = None
+        self.computer_engine = None
+        self.computer_position = None
+        self.computer_thread = None
+        self.computer_searcher = None
+        self.computer_table_stale = False
+        self.restarting_from_remote = False
+        self.event_recorder = None
+        self.event_player = None
+        self.frame_index = 0
+        self.frame_rate = 10
         random.seed()
         self.clock = pygame.time.Clock()
      
@@ -680,18 +991,33 @@ class ReversiController:
             self.view.restart_button.set_visible(False)
             self.model.setup_initial_pieces()
             self.model.set_current_player(1)
+            self.forget_computer_search()
             self.view.update_from_model(self.model)
+            if self.collab is not None and not self.restarting_from_remote:
+                self.collab.game_restarted()
             #self.board_view.get_cell_view_at_board_coord((0, 0)).show_as_available()
             self.set_state("WaitingForMove")
         elif state_name == "WaitingForMove":
             # Do nothing yet, wait for a move.
             pass
         elif state_name == "EndGame":
-            self.play_sound("clapping")
+            self.play_sound("clapping", "victory")
             self.view.restart_button.set_visible(True)
             pass
         
     def handle_cell_click(self, board_coord):
+        if self.is_computer_turn():
+            return
+        if self.collab is not None:
+            if not self.collab.is_local_turn(self.model.get_active_player_number()):
+                # Wait for the other player's move to arrive.
+                return
+        if self.play_move(board_coord) and self.collab is not None:
+            seq = self.model.get_ply() - 1
+            self.collab.move_played(self.model.get_board_model().get_square(board_coord), seq)
+
+    def play_move(self, board_coord):
+        """Plays board_coord for the active player; returns False if illegal."""
         if self.get_state() == "WaitingForMove":
             if self.model.is_cell_available_for_move(board_coord):
                 num_cells_flipped = self.model.put_piece(board_coord)
@@ -709,14 +1035,219 @@ class ReversiController:
                 
                 if do_end_game:
                     self.set_state("EndGame")
+                return True
+        return False
+
+    def jump_to_ply(self, ply):
+        """Shows the position after ply moves, to review the game; a move
+        played from there replaces the later ones.  Returns False if there
+        is no such ply or a remote player is connected."""
+        if self.collab is not None or not 0 <= ply <= self.model.get_num_plies():
+            return False
+        self.model.jump_to_ply(ply)
+        self.forget_computer_search()
+        # Not set_state(), which would clap again for a finished game.
+        game_over = self.model.get_game().is_over()
+        if game_over:
+            self.state_name = "EndGame"
+        else:
+            self.state_name = "WaitingForMove"
+        self.view.restart_button.set_visible(game_over)
+        self.view.update_from_model(self.model)
+        return True
+
+    def undo_move(self):
+        """Goes back a move; against the computer, back to a position where
+        it is the human's turn, or the computer would play again at once."""
+        ply = self.model.get_ply() - 1
+        while ply > 0 and self.is_computer_player(self.model.get_player_at_ply(ply)):
+            ply -= 1
+        return self.jump_to_ply(ply)
+
+    def redo_move(self):
+        ply = self.model.get_ply() + 1
+        while (ply < self.model.get_num_plies() and
+               self.is_computer_player(self.model.get_player_at_ply(ply))):
+            ply += 1
+        return self.jump_to_ply(ply)
+
+    def set_computer_level(self, level):
+        """Plays player 2 with engine.difficulty_levels[level], or lets two
+        people play if level is None."""
+        import engine
+
+        self.computer_level = level
+        if level is None:
+            self.computer_engine = None
+        else:
+            self.computer_engine = engine.create_level_engine(level)
+        self.forget_computer_search()
+
+    def forget_computer_search(self):
+        """Lets the computer search again after a new game, an undo or a
+        restored game, even a position it has answered before, and from an
+        empty table, so a level answers a position the same way each time."""
+        self.computer_position = None
+        self.computer_table_stale = True
+
+    def is_computer_player(self, player):
+        return (self.computer_engine is not None and self.collab is None and
+                player == self.computer_player)
+
+    def is_computer_turn(self):
+        return (self.model is not None and self.get_state() == "WaitingForMove" and
+                self.is_computer_player(self.model.get_active_player_number()))
+
+    def update_computer(self):
+        """Starts the computer's search when it is its turn.  The search
+        runs on its own thread and posts the move back to the game loop.
+
+        A replayed session takes the computer's moves from its log instead,
+        at the frames they were played.
+        """
+        if not self.is_computer_turn() or self.event_player is not None:
+            return
+        if self.computer_thread is not None and self.computer_thread.isAlive():
+            return
+        white, black = self.model.get_masks()
+        position = (white, black, self.model.get_active_player_number())
+        if position == self.computer_position:
+            return
+        self.computer_position = position
+        # The table is cleared on the search's thread, which has the engine
+        # to itself until it is done.
+        clear_table = self.computer_table_stale
+        self.computer_table_stale = False
+        # The level may change while it searches.
+        self.computer_searcher = self.computer_engine
+        self.computer_thread = threading.Thread(
+            target=self.choose_computer_move,
+            args=(self.computer_searcher, clear_table) + position)
+        self.computer_thread.setDaemon(True)
+        self.computer_thread.start()
+
+    def choose_computer_move(self, searcher, clear_table, white, black, player):
+        if clear_table:
+            searcher.clear_table()
+        square = searcher.choose_move(white, black, player)
+        self.post_command("computer_move", self.play_computer_move, (white, black, player), square)
+
+    def play_computer_move(self, position, square):
+        # A new game, an undo or another level may have come in meanwhile.
+        white, black = self.model.get_masks()
+        if (square is None or not self.is_computer_turn() or
+                position != (white, black, self.model.get_active_player_number())):
+            return
+        self.computer_position = None
+        self.play_move(self.model.get_board_model().get_board_coord(square))
+
+    def set_collab_session(self, session):
+        """Plays against a remote player through session, or locally if None."""
+        if self.collab is not None:
+            self.collab.close()
+        self.collab = session
+
+    def play_remote_move(self, square):
+        return self.play_move(self.model.get_board_model().get_board_coord(square))
+
+    def restart_from_remote(self):
+        self.restarting_from_remote = True
+        try:
+            self.set_state("StartGame")
+        finally:
+            self.restarting_from_remote = False
+
+    def get_position(self):
+        """Returns (white mask, black mask, player to move, number of moves)."""
+        white, black = self.model.get_masks()
+        return (white, black, self.model.get_active_player_number(), self.model.get_ply())
                     
-    def play_sound(self, sound_name):
-        if self.sound_enable:
-            if not self.sounds.has_key(sound_name):
-                print "ReversiController.play_sound(\"%s\") - WARNING, sound does not exist!" % str(sound_name)
+    def open_position_db(self, path):
+        """Uses the position database at path (see positiondb.py) for hints."""
+        # Imported here: sqlite3 and multiprocessing slow down every start,
+        # and most games have no database.
+        import positiondb
+
+        if self.position_db is not None:
+            self.position_db.close()
+        self.position_db = positiondb.PositionDB(path)
+
+    def toggle_hints(self):
+        if self.position_db is None:
+            return
+        self.show_hints = not self.show_hints
+        if self.model is not None:
+            self.view.update_from_model(self.model)
+
+    def get_hints(self, model):
+        """Returns {board_coord: (share of games, mover's score)} for the moves
+        the position database knows here, or {} if hints are off."""
+        if not self.show_hints or self.position_db is None:
+            return {}
+        white, black = model.get_masks()
+        moves = self.position_db.get_moves(white, black, model.get_active_player_number())
+        total = sum([move.games for move in moves])
+        board_model = model.get_board_model()
+        hints = {}
+        for move in moves:
+            board_coord = board_model.get_board_coord(move.square)
+            hints[board_coord] = (float(move.games) / total, move.get_score())
+        return hints
+
+    def toggle_analysis(self):
+        """Shows or hides the panel analysing the position on screen."""
+        self.show_analysis = not self.show_analysis
+        self.analyzed_position = None
+        self.view.stats_view.clear()
+        self.view.stats_view.set_visible(self.show_analysis)
+
+    def update_analysis(self):
+        """Starts analysing the position on screen, if the panel is shown and
+        no other analysis is running.  The search runs on its own thread and
+        posts its result back to the game loop."""
+        if not self.show_analysis or self.model is None:
+            return
+        if self.analysis_thread is not None and self.analysis_thread.isAlive():
+            return
+        white, black = self.model.get_masks()
+        position = (white, black, self.model.get_active_player_number())
+        if position == self.analyzed_position:
+            return
+        self.analyzed_position = position
+        import engine
+
+        self.analysis_engine = engine.Engine(analysis_depth, time_limit=analysis_time_limit)
+        self.analysis_thread = threading.Thread(target=self.analyze_position,
+                                                args=(self.analysis_engine,) + position)
+        self.analysis_thread.setDaemon(True)
+        self.analysis_thread.start()
+
+    def analyze_position(self, analyzer, white, black, player):
+        lines = analyzer.analyze(white, black, player, analysis_lines)
+        self.post_command("analysis", self.show_analysis_result, (white, black, player),
+                          analyzer.iterations, lines)
+
+    def show_analysis_result(self, position, iterations, lines):
+        # The position may have changed while the search ran.
+        if self.show_analysis and position == self.analyzed_position:
+            if lines:
+                self.view.stats_view.update_from_search(iterations, lines)
             else:
-                sound = self.sounds[sound_name]
-                sound.play()
+                self.view.stats_view.clear()
+
+    def stop_searches(self):
+        """Cancels the analysis and the computer's search and waits for
+        their threads, so none is left searching while Python shuts down."""
+        for searcher, thread in ((self.analysis_engine, self.analysis_thread),
+                                 (self.computer_searcher, self.computer_thread)):
+            if thread is not None and thread.isAlive():
+                searcher.cancel()
+                thread.join()
+
+    def play_sound(self, sound_name, channel_group_name=None):
+        if self.sound_enable and self.sounds is not None:
+            if not self.sounds.play(sound_name, channel_group_name):
+                print "ReversiController.play_sound(\"%s\") - WARNING, sound does not exist!" % str(sound_name)
     
     def play_put_down_piece_sound(self, num_cells_flipped):
         #possible_sound_names = ['putdownflip2', 'putdownflip3', 'putdownflip4', 'putdownflip5', 'putdownflip']
@@ -736,7 +1267,7 @@ class ReversiController:
 #            sound_name = "putdownflip"
 #===============================================================================
         
-        self.play_sound(sound_name)
+        self.play_sound(sound_name, "placement")
         
         #if num_cells_flipped >= 6:
         #    self.play_sound("clapping")
@@ -750,30 +1281,47 @@ class ReversiController:
         pass
 
     def set_player1_color(self, color):
-        global WHITE
-        WHITE = color
-        self.view.update_from_model(self.model)
+        self.theme.player1_color = color
+        self.theme_invalid = True
 
     def set_player2_color(self, color):
-        global BLACK
-        BLACK = color
-        self.view.update_from_model(self.model)
+        self.theme.player2_color = color
+        self.theme_invalid = True
 
     def set_line_color(self, color):
-        global cell_padding_color
-        cell_padding_color = color
-        self.view.redraw_back()
+        self.theme.line_color = color
+        self.theme_invalid = True
 
     def set_back_color(self, color):
-        global background_color
-        background_color = color
-        self.view.redraw_back()
-        self.view.update_from_model(self.model)
+        self.theme.background_color = color
+        self.theme_invalid = True
 
     def set_board_color(self, color):
-        global background_board_color
-        background_board_color = color
-        self.view.update_from_model(self.model)
+        self.theme.board_color = color
+        self.theme_invalid = True
+
+    def post_command(self, key, fn, *args):
+        """Runs fn(*args) from the game loop, replacing any pending command
+        posted under the same key.  Safe to call from any thread."""
+        self.commands.post(key, fn, *args)
+
+    def process_commands(self):
+        if self.event_player is not None:
+            # The toolbar of a replayed session is in the log.
+            for key, args in self.event_player.get_commands(self.frame_index):
+                self.post_command(key, getattr(self, recorded_commands[key]), *args)
+        ran = self.commands.drain()
+        if self.event_recorder is not None:
+            recorded = [(key, args) for key, args in ran if key in recorded_commands]
+            if recorded:
+                self.event_recorder.record_commands(self.frame_index, recorded)
+        # However many colors changed, the palettes are only swapped once.
+        if self.theme_invalid and self.view is not None:
+            self.theme_invalid = False
+            self.view.update_from_theme()
+
+    def player_changed(self, player):
+        self.set_current_player(player)
 
     def set_current_player(self, player):
         if self.parent is not None:
@@ -781,75 +1329,241 @@ class ReversiController:
 
     def change_sound(self, sound):
         self.sound_enable = sound
+
+    def get_instance_dir(self):
+        """Returns the directory where the activity may write its own files."""
+        if self.parent is not None and hasattr(self.parent, "get_activity_root"):
+            return os.path.join(self.parent.get_activity_root(), "instance")
+        return os.getcwd()
+
+    def get_cache_dir(self):
+        """Returns a directory that persists between launches, or None."""
+        if self.parent is not None and hasattr(self.parent, "get_activity_root"):
+            return os.path.join(self.parent.get_activity_root(), "data", "sound-cache")
+        return None
+
+    def instrument(self):
+        self.profiler.instrument(self, "handle_cell_click", "ReversiController.handle_cell_click")
+        self.profiler.instrument(self.model, "put_piece", "ReversiModel.put_piece")
+        self.profiler.instrument(self.view, "update_from_model", "ReversiView.update_from_model")
+        self.profiler.instrument(self.view, "draw", "ReversiView.draw")
+
+    def dump_profile(self):
+        path = self.profiler.dump(self.get_instance_dir())
+        print "ReversiController.dump_profile() - wrote %s" % path
+        
+    def init_game(self, view_size):
+        # Create board view
+        self.view = ReversiView(self, view_size, (num_columns, num_rows), self.theme)
+        
+        # Create board model
+        self.model = ReversiModel((num_columns, num_rows), self)
+        
+        # Setup start state
+        self.set_state("StartGame")
+
+        # A game read from the Journal before the view existed.
+        if self.pending_state is not None:
+            self.restore_state(self.pending_state)
+            self.pending_state = None
+
+    def save_state(self):
+        """Returns the game, theme colors and computer level packed for the Journal."""
+        if self.model is None:
+            return self.pending_state
+        white, black = self.model.get_masks()
+        saved = savegame.SavedGame(white, black, self.model.get_active_player_number(),
+                                   self.model.get_move_history(), self.theme.get_colors(),
+                                   self.get_state() == "EndGame", self.computer_level)
+        return savegame.pack(saved)
+
+    def restore_state(self, data, restore_theme=True, restore_level=True):
+        """Restores a game from save_state(); raises ValueError if data is bad."""
+        import engine
+
+        saved = savegame.unpack(data)
+        if saved.level is not None and not 0 <= saved.level < len(engine.difficulty_levels):
+            raise ValueError("no difficulty level %d" % saved.level)
+        if restore_theme:
+            self.theme.set_colors(saved.colors)
+        if restore_level:
+            self.set_computer_level(saved.level)
+        if self.model is None:
+            self.pending_state = data
+            return
+
+        self.model.restore(saved.white, saved.black, saved.player, saved.moves)
+        self.forget_computer_search()
+        self.view.update_from_theme()
+        self.view.update_from_model(self.model)
+
+        # Not set_state(), which would clap again for a finished game.
+        if saved.game_over:
+            self.state_name = "EndGame"
+        else:
+            self.state_name = "WaitingForMove"
+        self.view.restart_button.set_visible(saved.game_over)
+
+    def get_theme(self):
+        return self.theme
+
+    def record_events(self, path):
+        """Records every event the game handles to path, for replay_events."""
+        from sugargame.eventlog import EventRecorder
+
+        self.event_recorder = EventRecorder(path)
+        # The level the session starts at; changes are logged as they come.
+        self.event_recorder.record_commands(self.frame_index,
+                                            [('computer_level', (self.computer_level,))])
+
+    def replay_events(self, path, realtime=False):
+        """Replaces user input with the events recorded in path.
+
+        Unless realtime is set, frames are not throttled, so the replay runs
+        as fast as the machine can draw.
+        """
+        from sugargame.eventlog import EventPlayer
+
+        self.event_player = EventPlayer(path, realtime)
+        if not realtime:
+            self.frame_rate = None
+
+    def get_events(self):
+        if self.event_player is not None:
+            # Real input is ignored, but the queue still has to be pumped.
+            pygame.event.pump()
+            if self.event_player.is_finished(self.frame_index):
+                events = [pygame.event.Event(pygame.QUIT)]
+            else:
+                events = self.event_player.get_events(self.frame_index)
+        else:
+            events = pygame.event.get()
+
+        if self.event_recorder is not None:
+            self.event_recorder.record(self.frame_index, events)
+        self.frame_index += 1
+        return events
+
+    def init_sounds(self):
+        self.use_sounds = False
+        sound_info = None
+        if pygame.mixer:
+            sound_info = init_mixer()
+            if sound_info:
+                self.use_sounds = True
+                print "sound_info = %s" % str(sound_info)
         
+        # Sounds are decoded on first use, or in the background, so they
+        # never delay showing the board.
+        if self.use_sounds:
+            self.sounds = SoundBank('data', self.get_cache_dir())
+            self.sounds.reserve_channels(sound_channel_groups)
+            self.sounds.preload_in_background(played_sound_names)
+
     def run(self):
         global screen_size
+        startup_timer.mark("ReversiController.run")
+
+        # gtk is only needed to keep the Sugar toolbar responsive.
+        try:
+            import gtk
+        except ImportError:
+            gtk = None
+
         pygame.display.init()
         self.screen = pygame.display.get_surface()
         if not(self.screen):
             info = pygame.display.Info()
-            screen_size = (info.current_w, info.current_h - 75)
+            if info.current_w > 0 and info.current_h > 0:
+                screen_size = (info.current_w, info.current_h - 75)
             self.screen = pygame.display.set_mode(screen_size) #, pygame.FULLSCREEN)
             pygame.display.set_caption(_('Reversi'))
         screen_size = self.screen.get_size()
+        startup_timer.mark("display initialized")
 
-        # Init mixer
-        self.use_sounds = True
-        sound_info = None
-        if pygame.mixer:
-            pygame.mixer.init()
-            #pygame.mixer.init(22050,-16,1,1024)
-            sound_info = pygame.mixer.get_init()
-            if sound_info:
-                self.use_sounds = True
-                print "sound_info = %s" % str(sound_info)
-        
-        # Load sounds
-        if self.use_sounds:
-            self.sounds = {}
-            self.sounds["clapping"] = load_sound("clapping.ogg")
-            self.sounds["putdownflip"] = load_sound("putdownflip.ogg")
-            self.sounds["putdownflip2"] = load_sound("putdownflip2.ogg")
-            self.sounds["putdownflip3"] = load_sound("putdownflip3.ogg")
-            self.sounds["putdownflip4"] = load_sound("putdownflip4.ogg")
-            self.sounds["putdownflip5"] = load_sound("putdownflip5.ogg")
-            self.sounds["putdownflip5a"] = load_sound("putdownflip5a.ogg")
-        
-        # Create board view
-        self.view = ReversiView(self, screen_size, (num_columns, num_rows))
-        
-        # Create board model
-        self.model = ReversiModel(self, (num_columns, num_rows))
-        
-        # Setup start state
-        self.set_state("StartGame")
+        self.init_game(screen_size)
+        self.instrument()
+        startup_timer.mark("game initialized")
 
-        while True:
-            # Process events
-            while gtk.events_pending():
-                gtk.main_iteration()
+        first_frame = True
+        try:
+            while True:
+                # Process events
+                if gtk is not None:
+                    while gtk.events_pending():
+                        gtk.main_iteration()
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    return
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_q and event.mod & pygame.KMOD_CTRL:
+                self.process_commands()
+                self.update_computer()
+                self.update_analysis()
+
+                if self.collab is not None:
+                    self.collab.poll()
+
+                for event in self.get_events():
+                    if event.type == pygame.QUIT:
                         return
-                    elif event.key == pygame.K_r: # and event.mod & pygame.KMOD_CTRL:
-                        self.set_state("StartGame")
-                    elif self.get_state() == "EndGame":
-                        self.set_state("StartGame")
+                    elif event.type == pygame.KEYDOWN:
+                        if event.key == pygame.K_q and event.mod & pygame.KMOD_CTRL:
+                            return
+                        elif event.key == pygame.K_p and event.mod & pygame.KMOD_CTRL:
+                            self.profiler.toggle_overlay()
+                            continue
+                        elif event.key == pygame.K_d and event.mod & pygame.KMOD_CTRL:
+                            self.dump_profile()
+                            continue
+                        elif event.key == pygame.K_h:
+                            self.toggle_hints()
+                            continue
+                        elif event.key == pygame.K_a:
+                            self.toggle_analysis()
+                            continue
+                        elif event.key == pygame.K_LEFT or (event.key == pygame.K_z and
+                                                            event.mod & pygame.KMOD_CTRL):
+                            self.undo_move()
+                            continue
+                        elif event.key == pygame.K_RIGHT:
+                            self.redo_move()
+                            continue
+                        elif event.key == pygame.K_HOME:
+                            self.jump_to_ply(0)
+                            continue
+                        elif event.key == pygame.K_END:
+                            self.jump_to_ply(self.model.get_num_plies())
+                            continue
+                        elif event.key == pygame.K_r: # and event.mod & pygame.KMOD_CTRL:
+                            self.set_state("StartGame")
+                        elif self.get_state() == "EndGame":
+                            self.set_state("StartGame")
+                            continue
+
+                    if self.view.handle_event(event):
                         continue
-
-                if self.view.handle_event(event):
-                    continue
             
-            # Draw
-            self.view.draw(self.screen)
-            pygame.display.flip()
+                # Draw
+                self.view.draw(self.screen)
+                self.profiler.draw_overlay(self.screen)
+                self.profiler.call("pygame.display.flip", pygame.display.flip)
+
+                # Opening the audio device is slow on some laptops, so it waits
+                # until the board is on screen.
+                if first_frame:
+                    first_frame = False
+                    startup_timer.mark("first display.flip")
+                    self.init_sounds()
+                    startup_timer.mark("mixer initialized")
+                    startup_timer.print_report()
+                    if self.parent is not None and hasattr(self.parent, "first_frame_shown"):
+                        self.parent.first_frame_shown()
             
-            # Update clock
-            self.clock.tick(10)
+                # Update clock
+                if self.frame_rate:
+                    self.clock.tick(self.frame_rate)
+        finally:
+            self.stop_searches()
+            if self.event_recorder is not None:
+                self.event_recorder.close()
+                self.event_recorder = None
 
 
 
@@ -857,11 +1571,50 @@ class ReversiController:
 # main()
 #===============================================================================
 
-def main():
+def main(argv=None):
+    from optparse import OptionParser
+
+    import engine
+
+    parser = OptionParser()
+    parser.add_option("--record", metavar="FILE",
+                      help="record the events of this session to FILE")
+    parser.add_option("--replay", metavar="FILE",
+                      help="play the events recorded in FILE instead of user input")
+    parser.add_option("--state", metavar="FILE",
+                      help="start from the game saved in FILE, e.g. for a replay")
+    parser.add_option("--realtime", action="store_true", default=False,
+                      help="replay at the recorded pace instead of as fast as possible")
+    parser.add_option("--positions-db", metavar="FILE",
+                      help="show what was played in FILE's games; H toggles the hints")
+    parser.add_option("--level", type="int", default=None,
+                      help="play Black with the computer at this difficulty, from 0 to %d" %
+                           (len(engine.difficulty_levels) - 1))
+    parser.add_option("--headless", action="store_true", default=False,
+                      help="draw offscreen and play no sound")
+    options, args = parser.parse_args(argv)
+
+    if options.headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
    
     # Create primary controller and launch it.
     primary_controller = ReversiController()
+    if options.level is not None:
+        primary_controller.set_computer_level(options.level)
+    if options.positions_db:
+        primary_controller.open_position_db(options.positions_db)
+        primary_controller.show_hints = True
+    if options.state:
+        primary_controller.restore_state(open(options.state, "rb").read())
+    if options.record:
+        primary_controller.record_events(options.record)
+    if options.replay:
+        primary_controller.replay_events(options.replay, options.realtime)
     primary_controller.run()
 
+    if options.replay:
+        primary_controller.profiler.print_report()
+
 if __name__=="__main__":
-    main()
+    main(sys.argv[1:])
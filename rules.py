@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+# rules.py - The rules of Reversi on bitboards.
+#
+# Nothing here imports pygame, gtk or Sugar, so analysis and self-play
+# workers can import it without a display.
+#
+# A board is a pair of 64 bit masks, one per color.  Bit n is the square
+# column_index * 8 + row_index, as in savegame.  Player 1 plays White and
+# player 2 plays Black; player 1 moves first.
+#
+# get_flips() works line by line.  Each of the four lines through a square,
+# its column, its row and its two diagonals, is gathered into a byte with
+# a multiplication, and two tables indexed by the square's place on the
+# line give the flipped pieces: _outflank, from the opponent's byte, the
+# squares that would anchor a run, and _flipped, from those of them the
+# player holds, the run itself.  The tables take 2 KB each and are built
+# when the module is first imported.
+#
+
+import array
+
+FULL = 0xffffffffffffffff
+
+# Bits whose row_index is 0 or 7; a shift that changes the row must not carry
+# a piece from one column's edge into the next column.
+ROW_0 = 0x0101010101010101
+ROW_7 = 0x8080808080808080
+NOT_ROW_0 = FULL & ~ROW_0
+NOT_ROW_7 = FULL & ~ROW_7
+
+# (shift, mask) for each of the eight directions.  A positive shift moves
+# towards higher squares; the mask clears the squares a wrapped piece lands on.
+directions = [
+    (1, NOT_ROW_0),     # row + 1
+    (-1, NOT_ROW_7),    # row - 1
+    (8, FULL),          # column + 1
+    (-8, FULL),         # column - 1
+    (9, NOT_ROW_0),     # column + 1, row + 1
+    (7, NOT_ROW_7),     # column + 1, row - 1
+    (-7, NOT_ROW_0),    # column - 1, row + 1
+    (-9, NOT_ROW_7),    # column - 1, row - 1
+]
+
+# Black on (3,3) and (4,4), White on (3,4) and (4,3).
+INITIAL_WHITE = (1 << 28) | (1 << 35)
+INITIAL_BLACK = (1 << 27) | (1 << 36)
+
+# Multiplying by _GATHER_ROW moves the bits of ROW_0 into the top byte, in
+# column order; multiplying by _GATHER_DIAGONAL adds up all eight bytes,
+# which gathers any mask with at most one bit per row_index.
+_GATHER_ROW = 0x0102040810204080
+_GATHER_DIAGONAL = 0x0101010101010101
+
+
+def shift(mask, amount, edge_mask):
+    if amount > 0:
+        return (mask << amount) & edge_mask & FULL
+    return (mask >> -amount) & edge_mask
+
+
+def count_bits(mask):
+    return bin(mask).count("1")
+
+
+def iter_squares(mask):
+    """Yields the squares set in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def format_square(square):
+    """Writes square as in Othello books: a letter for the row_index and a
+    number for the column_index, so square 0 is a1 and square 63 is h8."""
+    if square is None:
+        return "pass"
+    return "%s%d" % (chr(ord("a") + square % 8), square / 8 + 1)
+
+
+def parse_coordinate(text):
+    """Returns the square written as format_square() does, a letter and a
+    number; raises ValueError for anything else."""
+    text = text.lower()
+    if len(text) != 2 or not "a" <= text[0] <= "h" or not "1" <= text[1] <= "8":
+        raise ValueError("invalid move %s" % text)
+    return (int(text[1]) - 1) * 8 + ord(text[0]) - ord("a")
+
+
+def parse_square(text):
+    """Returns the square of text, or None for a pass; raises ValueError.
+
+    A plain square number is accepted too.
+    """
+    text = text.lower()
+    if text == "pass":
+        return None
+    if not text.isdigit():
+        return parse_coordinate(text)
+    square = int(text)
+    if not 0 <= square < 64:
+        raise ValueError("invalid move %s" % text)
+    return square
+
+
+def get_opponent(player):
+    return 3 - player
+
+
+def get_legal_moves(own, opponent):
+    """Returns the mask of squares where the owner of own may play."""
+    empty = FULL & ~(own | opponent)
+    moves = 0
+    # shift() inlined and the loop unrolled: this is the innermost loop of
+    # every search.  At most six opponent pieces fit between a move and its
+    # anchor; masking the opponent with edge_mask once keeps runs from
+    # wrapping, and empty keeps the result within 64 bits.
+    for amount, edge_mask in directions:
+        inner = opponent & edge_mask
+        if amount > 0:
+            run = (own << amount) & inner
+            run |= (run << amount) & inner
+            run |= (run << amount) & inner
+            run |= (run << amount) & inner
+            run |= (run << amount) & inner
+            run |= (run << amount) & inner
+            moves |= (run << amount) & edge_mask & empty
+        else:
+            amount = -amount
+            run = (own >> amount) & inner
+            run |= (run >> amount) & inner
+            run |= (run >> amount) & inner
+            run |= (run >> amount) & inner
+            run |= (run >> amount) & inner
+            run |= (run >> amount) & inner
+            moves |= (run >> amount) & edge_mask & empty
+    return moves
+
+
+def _get_outflank(place, opponent):
+    """Returns the squares just past the opponent's runs on either side of
+    place, on a line packed into a byte."""
+    outflank = 0
+    for step in (-1, 1):
+        cursor = place + step
+        while 0 <= cursor < 8 and opponent & (1 << cursor):
+            cursor += step
+        if cursor != place + step and 0 <= cursor < 8:
+            outflank |= 1 << cursor
+    return outflank
+
+
+def _get_flipped(place, anchors):
+    """Returns the squares between place and each of anchors on a line."""
+    flipped = 0
+    for anchor in range(8):
+        if anchors & (1 << anchor):
+            low, high = sorted((place, anchor))
+            flipped |= ((1 << high) - 1) & ~((1 << (low + 1)) - 1)
+    return flipped
+
+
+def _make_tables():
+    outflank = array.array("B")
+    flipped = array.array("B")
+    for place in range(8):
+        others = 0xff & ~(1 << place)
+        outflank.extend([_get_outflank(place, pattern & others) for pattern in range(256)])
+        flipped.extend([_get_flipped(place, anchors) for anchors in range(256)])
+    # A row's byte spread back over ROW_0.
+    spread_row = [sum([1 << 8 * column for column in range(8) if pattern & (1 << column)])
+                  for pattern in range(256)]
+    # For each square: its column's shift, its row_index, the offsets of its
+    # places on the lines into the tables, and its two diagonals, along
+    # which row_index - column_index and row_index + column_index stay put.
+    lines = []
+    for square in range(64):
+        column_index, row_index = divmod(square, 8)
+        diagonal = 0
+        anti_diagonal = 0
+        for other in range(64):
+            if other % 8 - other / 8 == row_index - column_index:
+                diagonal |= 1 << other
+            if other % 8 + other / 8 == row_index + column_index:
+                anti_diagonal |= 1 << other
+        lines.append((8 * column_index, row_index, 256 * row_index, 256 * column_index,
+                      diagonal, anti_diagonal))
+    return outflank, flipped, spread_row, lines
+
+_outflank, _flipped, _spread_row, _lines = _make_tables()
+
+
+def get_flips(own, opponent, square):
+    """Returns the mask of opponent pieces that playing square would flip."""
+    outflank = _outflank
+    flipped = _flipped
+    column_shift, row_index, row_offset, column_offset, diagonal, anti_diagonal = _lines[square]
+
+    # The column is a byte of the mask, in row order.
+    line = row_offset + (opponent >> column_shift & 0xff)
+    line = row_offset + (outflank[line] & own >> column_shift)
+    flips = flipped[line] << column_shift
+
+    # The row has a bit in each byte, gathered in column order.
+    line = column_offset + ((opponent >> row_index & ROW_0) * _GATHER_ROW >> 56 & 0xff)
+    line = column_offset + (outflank[line] & (own >> row_index & ROW_0) * _GATHER_ROW >> 56)
+    flips |= _spread_row[flipped[line]] << row_index
+
+    # A diagonal has one bit per row_index, gathered in row order; multiplying
+    # the byte again copies it into every column and the mask keeps the line.
+    line = row_offset + ((opponent & diagonal) * _GATHER_DIAGONAL >> 56 & 0xff)
+    line = row_offset + (outflank[line] & (own & diagonal) * _GATHER_DIAGONAL >> 56)
+    flips |= flipped[line] * _GATHER_DIAGONAL & diagonal
+
+    line = row_offset + ((opponent & anti_diagonal) * _GATHER_DIAGONAL >> 56 & 0xff)
+    line = row_offset + (outflank[line] & (own & anti_diagonal) * _GATHER_DIAGONAL >> 56)
+    flips |= flipped[line] * _GATHER_DIAGONAL & anti_diagonal
+    return flips
+
+
+def walk_flips(own, opponent, square):
+    """get_flips() by walking the eight rays from square a step at a time;
+    the tables are checked and timed against it."""
+    flips = 0
+    for amount, edge_mask in directions:
+        run = 0
+        cursor = shift(1 << square, amount, edge_mask)
+        while cursor & opponent:
+            run |= cursor
+            cursor = shift(cursor, amount, edge_mask)
+        if cursor & own:
+            flips |= run
+    return flips
+
+
+class Game:
+    """A game in progress: the position, the player to move and the moves.
+
+    observer, if given, has its player_changed(player) called whenever the
+    player to move is set.
+    """
+
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.reset()
+
+    def reset(self):
+        self.white = INITIAL_WHITE
+        self.black = INITIAL_BLACK
+        self.player = 1
+        self.moves = []
+
+    def restore(self, white, black, player, moves):
+        """Sets the position directly, without playing any moves."""
+        self.white = white
+        self.black = black
+        self.moves = list(moves)
+        self.set_player(player)
+
+    def set_player(self, player):
+        self.player = player
+        if self.observer is not None:
+            self.observer.player_changed(player)
+
+    def get_masks(self):
+        """Returns (white, black)."""
+        return (self.white, self.black)
+
+    def get_player_masks(self, player):
+        """Returns (player's mask, opponent's mask)."""
+        if player == 1:
+            return (self.white, self.black)
+        return (self.black, self.white)
+
+    def get_count(self, player):
+        return count_bits(self.get_player_masks(player)[0])
+
+    def get_legal_moves(self, player=None):
+        if player is None:
+            player = self.player
+        own, opponent = self.get_player_masks(player)
+        return get_legal_moves(own, opponent)
+
+    def is_legal(self, square):
+        own, opponent = self.get_player_masks(self.player)
+        if (own | opponent) & (1 << square):
+            return False
+        return get_flips(own, opponent, square) != 0
+
+    def can_move(self, player):
+        return self.get_legal_moves(player) != 0
+
+    def is_over(self):
+        return not self.can_move(1) and not self.can_move(2)
+
+    def place(self, square):
+        """Plays square for the player to move, without passing the turn on.
+
+        Returns the mask of flipped pieces; raises ValueError if the move is
+        not legal.
+        """
+        own, opponent = self.get_player_masks(self.player)
+        bit = 1 << square
+        flips = 0
+        if not (own | opponent) & bit:
+            flips = get_flips(own, opponent, square)
+        if not flips:
+            raise ValueError("square %d is not a legal move" % square)
+
+        own |= bit | flips
+        opponent &= ~flips
+        if self.player == 1:
+            self.white, self.black = own, opponent
+        else:
+            self.black, self.white = own, opponent
+        self.moves.append(square)
+        return flips
+
+    def pass_turn(self):
+        """Hands the move to the opponent if they can play.
+
+        Returns False if neither player can move, i.e. the game is over.
+        """
+        opponent = get_opponent(self.player)
+        if self.can_move(opponent):
+            self.set_player(opponent)
+            return True
+        return self.can_move(self.player)
+
+    def play(self, square):
+        """Places square and passes the turn on; returns the flipped mask."""
+        flips = self.place(square)
+        self.pass_turn()
+        return flips
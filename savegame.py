@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# savegame.py - Compact serialization of a game for the Sugar Journal.
+#
+# A saved game is 38 bytes plus one byte per move:
+#
+#   "RV", uint8 version, uint8 flags, uint8 player to move,
+#   uint64 white mask, uint64 black mask,
+#   uint8 computer level (255 when two people play),
+#   5 RGB theme colors (background, board, lines, player 1, player 2),
+#   uint8 move count, then one byte per move.
+#
+# Bit (and move) n is the square column_index * 8 + row_index.  Version 1,
+# from before the computer played, has no level byte and still loads.
+#
+
+import struct
+
+MAGIC = "RV"
+VERSION = 2
+
+FLAG_GAME_OVER = 1
+
+num_colors = 5
+
+NO_LEVEL = 255
+
+_header = struct.Struct("<2sBBBQQ")
+_level = struct.Struct("<B")
+_colors = struct.Struct("<%dB" % (num_colors * 3))
+_move_count = struct.Struct("<B")
+
+
+class SavedGame:
+    def __init__(self, white, black, player, moves, colors, game_over, level=None):
+        self.white = white
+        self.black = black
+        self.player = player
+        self.moves = moves
+        self.colors = colors
+        self.game_over = game_over
+        # The computer's difficulty level, or None.
+        self.level = level
+
+
+def pack(saved):
+    """Returns saved, a SavedGame, as a string of bytes."""
+    flags = 0
+    if saved.game_over:
+        flags |= FLAG_GAME_OVER
+    rgb = []
+    for color in saved.colors:
+        rgb.extend(color[:3])
+    level = saved.level
+    if level is None:
+        level = NO_LEVEL
+    return (_header.pack(MAGIC, VERSION, flags, saved.player, saved.white, saved.black) +
+            _level.pack(level) +
+            _colors.pack(*rgb) +
+            _move_count.pack(len(saved.moves)) +
+            "".join([chr(move) for move in saved.moves]))
+
+
+def unpack(data):
+    """Returns the SavedGame in data; raises ValueError if data is not one."""
+    if len(data) < _header.size + _colors.size + _move_count.size:
+        raise ValueError("saved game is truncated")
+    magic, version, flags, player, white, black = _header.unpack_from(data, 0)
+    if magic != MAGIC or not 1 <= version <= VERSION:
+        raise ValueError("not a version %d saved game" % VERSION)
+    if white & black or player not in (1, 2):
+        raise ValueError("saved game is corrupt")
+
+    offset = _header.size
+    level = None
+    if version >= 2:
+        if len(data) < offset + _level.size + _colors.size + _move_count.size:
+            raise ValueError("saved game is truncated")
+        level = _level.unpack_from(data, offset)[0]
+        if level == NO_LEVEL:
+            level = None
+        offset += _level.size
+    rgb = _colors.unpack_from(data, offset)
+    colors = [tuple(rgb[i:i + 3]) for i in range(0, len(rgb), 3)]
+    offset += _colors.size
+
+    count = _move_count.unpack_from(data, offset)[0]
+    offset += _move_count.size
+    moves = [ord(byte) for byte in data[offset:offset + count]]
+    if len(moves) != count or [move for move in moves if move >= 64]:
+        raise ValueError("saved game is corrupt")
+
+    return SavedGame(white, black, player, moves, colors, bool(flags & FLAG_GAME_OVER), level)
@@ -0,0 +1,322 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# server.py - Hosts many Reversi games in one process.
+#
+# Clients connect to a local socket and send one command per line; replies
+# are lines too.  Each game is a rules.Game: two 64 bit masks, the player to
+# move and the list of moves, so a server holds thousands of games easily.
+#
+#   NEW [<ai player>]       start a game, optionally against the computer
+#                           playing <ai player> (1 or 2)
+#                             -> GAME <id> <player to move>
+#   MOVE <id> <square>      play square for the player to move
+#                             -> MOVED <id> <square> <player to move>
+#   STATE <id>              -> STATE <id> <white hex> <black hex> <player> <moves>
+#   END <id>                -> ENDED <id>
+#
+# When the game is over, MOVED is followed by OVER <id> <white> <black>, the
+# final disc counts.  Moves of the computer arrive as MOVED lines of their
+# own, once a worker has chosen them; should the search fail, the computer
+# plays a random legal move instead.  Errors are reported as ERR <message>.
+# Games are dropped when the connection that started them closes.
+#
+#   python server.py --socket /tmp/reversi.sock --workers 4
+#
+
+import asynchat
+import asyncore
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import Queue
+
+from optparse import OptionParser
+
+import engine
+import rules
+
+
+class SessionManager:
+    """The games being played, by id."""
+
+    def __init__(self):
+        self.games = {}
+        self.ai_players = {}
+        self.next_id = 1
+
+    def new_game(self, ai_player=None):
+        game_id = self.next_id
+        self.next_id += 1
+        self.games[game_id] = rules.Game()
+        if ai_player is not None:
+            self.ai_players[game_id] = ai_player
+        return game_id
+
+    def get_game(self, game_id):
+        game = self.games.get(game_id)
+        if game is None:
+            raise ValueError("no game %d" % game_id)
+        return game
+
+    def play(self, game_id, square):
+        """Plays square in game_id; returns False once the game is over."""
+        game = self.get_game(game_id)
+        if not 0 <= square < 64:
+            raise ValueError("no square %d" % square)
+        game.place(square)
+        return game.pass_turn()
+
+    def is_ai_to_move(self, game_id):
+        game = self.games.get(game_id)
+        return (game is not None and self.ai_players.get(game_id) == game.player and
+                game.can_move(game.player))
+
+    def end_game(self, game_id):
+        self.games.pop(game_id, None)
+        self.ai_players.pop(game_id, None)
+
+    def get_count(self):
+        return len(self.games)
+
+
+def choose_move(white, black, player, depth):
+    """Returns (engine.choose_move(), None), or (None, message) if the search
+    raised, so that a failure reaches the server rather than the pool's
+    result handler, which would drop it."""
+    try:
+        return engine.choose_move(white, black, player, depth), None
+    except Exception, e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+
+class AIPool:
+    """Chooses computer moves on a pool of worker processes.
+
+    Results are queued and announced by writing to a pipe, so the server's
+    loop sleeps in poll() until there is something to do.  With no workers
+    the moves are chosen in the server's own process.
+    """
+
+    def __init__(self, workers, depth):
+        self.depth = depth
+        if workers > 0:
+            self.pool = multiprocessing.Pool(workers)
+        else:
+            self.pool = None
+        self.results = Queue.Queue()
+        self.wake_fd, self.notify_fd = os.pipe()
+
+    def submit(self, game_id, seq, white, black, player):
+        """Chooses player's move; seq is the number of moves played so far."""
+        args = (white, black, player, self.depth)
+        if self.pool is None:
+            self.finish(game_id, seq, choose_move(*args))
+        else:
+            # The callback runs on the pool's result thread.
+            callback = lambda result: self.finish(game_id, seq, result)
+            self.pool.apply_async(choose_move, args, callback=callback)
+
+    def finish(self, game_id, seq, result):
+        square, error = result
+        self.results.put((game_id, seq, square, error))
+        os.write(self.notify_fd, "x")
+
+    def get_results(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Queue.Empty:
+                return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class WakeDispatcher(asyncore.file_dispatcher):
+    def __init__(self, server):
+        asyncore.file_dispatcher.__init__(self, server.ai_pool.wake_fd, server.map)
+        self.server = server
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        self.server.handle_ai_results()
+
+
+class GameConnection(asynchat.async_chat):
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock, server.map)
+        self.set_terminator("\n")
+        self.server = server
+        self.buffer = []
+        self.game_ids = set()
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line = "".join(self.buffer)
+        self.buffer = []
+        try:
+            self.handle_line(line)
+        except ValueError, e:
+            self.send_line("ERR %s" % e)
+
+    def send_line(self, line):
+        self.push(line + "\n")
+
+    def get_own_game(self, game_id):
+        if game_id not in self.game_ids:
+            raise ValueError("no game %d" % game_id)
+        return self.server.manager.get_game(game_id)
+
+    def handle_line(self, line):
+        parts = line.split()
+        if not parts:
+            return
+        command, args = parts[0].upper(), [int(arg) for arg in parts[1:]]
+        manager = self.server.manager
+
+        if command == "NEW" and len(args) <= 1:
+            ai_player = args and args[0] or None
+            if ai_player not in (None, 1, 2):
+                raise ValueError("no player %d" % ai_player)
+            game_id = manager.new_game(ai_player)
+            self.game_ids.add(game_id)
+            self.server.owners[game_id] = self
+            self.send_line("GAME %d %d" % (game_id, manager.get_game(game_id).player))
+            self.server.schedule_ai(game_id)
+        elif command == "MOVE" and len(args) == 2:
+            game_id, square = args
+            game = self.get_own_game(game_id)
+            if manager.ai_players.get(game_id) == game.player:
+                raise ValueError("game %d is waiting for the computer" % game_id)
+            self.server.play(game_id, square)
+        elif command == "STATE" and len(args) == 1:
+            game = self.get_own_game(args[0])
+            self.send_line("STATE %d %x %x %d %s" % (
+                args[0], game.white, game.black, game.player,
+                ",".join([str(move) for move in game.moves]) or "-"))
+        elif command == "END" and len(args) == 1:
+            self.get_own_game(args[0])
+            self.server.end_game(args[0])
+            self.send_line("ENDED %d" % args[0])
+        else:
+            raise ValueError("bad command %r" % line)
+
+    def handle_close(self):
+        for game_id in list(self.game_ids):
+            self.server.end_game(game_id)
+        self.close()
+
+
+class GameServer(asyncore.dispatcher):
+    """Accepts connections on address, a Unix socket path or a (host, port)."""
+
+    def __init__(self, address, workers=0, ai_depth=engine.default_depth):
+        # Workers are forked first, so they do not inherit the listening socket.
+        self.ai_pool = AIPool(workers, ai_depth)
+
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+        self.manager = SessionManager()
+        self.owners = {}
+        self.wake = WakeDispatcher(self)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            GameConnection(pair[0], self)
+
+    def play(self, game_id, square):
+        """Plays square in game_id and tells the owner; raises ValueError if illegal."""
+        in_progress = self.manager.play(game_id, square)
+        owner = self.owners[game_id]
+        game = self.manager.get_game(game_id)
+        owner.send_line("MOVED %d %d %d" % (game_id, square, game.player))
+        if not in_progress:
+            owner.send_line("OVER %d %d %d" % (game_id, game.get_count(1), game.get_count(2)))
+        else:
+            self.schedule_ai(game_id)
+
+    def schedule_ai(self, game_id):
+        if self.manager.is_ai_to_move(game_id):
+            game = self.manager.get_game(game_id)
+            self.ai_pool.submit(game_id, len(game.moves), game.white, game.black, game.player)
+
+    def handle_ai_results(self):
+        for game_id, seq, square, error in self.ai_pool.get_results():
+            game = self.manager.games.get(game_id)
+            # The game may have ended while the worker was thinking.
+            if game is None or len(game.moves) != seq:
+                continue
+            if error is not None:
+                # The game would wait for the computer forever otherwise.
+                sys.stderr.write("server.py - search failed in game %d: %s\n" %
+                                 (game_id, error))
+                moves = list(rules.iter_squares(game.get_legal_moves()))
+                if not moves:
+                    continue
+                square = random.choice(moves)
+            elif square is None:
+                continue
+            self.play(game_id, square)
+
+    def end_game(self, game_id):
+        owner = self.owners.pop(game_id, None)
+        if owner is not None:
+            owner.game_ids.discard(game_id)
+        self.manager.end_game(game_id)
+
+    def serve_forever(self):
+        try:
+            asyncore.loop(timeout=30.0, use_poll=True, map=self.map)
+        finally:
+            self.ai_pool.close()
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--socket", default=None,
+                      help="listen on this Unix socket")
+    parser.add_option("--port", type="int", default=7733,
+                      help="listen on this port of 127.0.0.1 when no --socket is given")
+    parser.add_option("--workers", type="int", default=multiprocessing.cpu_count(),
+                      help="processes choosing computer moves; 0 chooses them inline")
+    parser.add_option("--ai-depth", type="int", default=engine.default_depth)
+    options, args = parser.parse_args(argv)
+
+    if options.socket:
+        address = options.socket
+    else:
+        address = ("127.0.0.1", options.port)
+    server = GameServer(address, options.workers, options.ai_depth)
+    print "server.py - listening on %s" % (address,)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
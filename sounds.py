@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+# sounds.py - Lazy, cached loading of the game's sound effects.
+#
+# Decoding the Vorbis files in data/ is the slowest part of startup on an XO.
+# A SoundBank only decodes a sound when it is first needed (or from a
+# background thread once the board is on screen), and keeps the decoded PCM
+# in a cache directory so later launches can map it straight back in.
+#
+# The mixer is set up with a small buffer for low click-to-sound latency, and
+# sounds are played on reserved channel groups so that rapid moves replace
+# each other predictably instead of piling up.  To tune the buffer size for a
+# device, run:
+#
+#   python sounds.py --latency 256,512,1024,2048
+#
+
+import mmap
+import os
+import sys
+import threading
+import timeit
+
+from array import array
+
+import pygame
+
+
+# (frequency, size, channels, buffer).  The sounds in data/ are mono, and a
+# 512 sample buffer at 22050 Hz is about 23 ms.  Override per device with
+# REVERSI_MIXER="frequency,size,channels,buffer".
+default_mixer_settings = (22050, -16, 1, 512)
+
+# What a ChannelGroup does when all of its channels are busy.
+STEAL = "steal"     # cut off the sound that started first
+QUEUE = "queue"     # play after the sound that started first; replaces
+                    # anything already queued there
+
+
+def get_mixer_settings():
+    settings = os.environ.get("REVERSI_MIXER")
+    if not settings:
+        return default_mixer_settings
+    try:
+        values = tuple([int(value) for value in settings.split(",")])
+    except ValueError:
+        values = ()
+    if len(values) != 4:
+        print "get_mixer_settings() - ignoring bad REVERSI_MIXER=%r" % settings
+        return default_mixer_settings
+    return values
+
+
+def init_mixer(settings=None):
+    """(Re)starts the mixer; returns pygame.mixer.get_init() or None."""
+    if settings is None:
+        settings = get_mixer_settings()
+    # pygame.init() may already have started the mixer with its defaults.
+    if pygame.mixer.get_init():
+        pygame.mixer.quit()
+    try:
+        pygame.mixer.init(*settings)
+    except pygame.error, e:
+        print "init_mixer(%s) - %s" % (str(settings), e)
+        return None
+    return pygame.mixer.get_init()
+
+
+class ChannelGroup:
+    """A fixed set of reserved mixer channels shared by one kind of sound."""
+
+    def __init__(self, channels, policy):
+        self.channels = channels
+        self.policy = policy
+        # Channels in the order their current sounds started, oldest first.
+        self.started = list(channels)
+
+    def play(self, sound):
+        channel = None
+        for candidate in self.started:
+            if not candidate.get_busy():
+                channel = candidate
+                channel.play(sound)
+                break
+
+        if channel is None:
+            channel = self.started[0]
+            if self.policy == QUEUE:
+                channel.queue(sound)
+            else:
+                channel.play(sound)
+
+        self.started.remove(channel)
+        self.started.append(channel)
+        return channel
+
+
+class SoundBank:
+    def __init__(self, data_dir, cache_dir=None, extension=".ogg"):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.sounds = {}
+        self.mapped_files = []
+        self.lock = threading.Lock()
+        self.preload_thread = None
+        self.channel_groups = {}
+
+    def get_source_path(self, name):
+        return os.path.abspath(os.path.join(self.data_dir, name + self.extension))
+
+    def get_cache_path(self, name, source_path):
+        """Returns where the decoded PCM for name is cached.
+
+        Decoded samples are only valid for the mixer format they were decoded
+        to and for the exact source file, so both are part of the file name.
+        """
+        if self.cache_dir is None:
+            return None
+        frequency, size, channels = pygame.mixer.get_init()
+        stat = os.stat(source_path)
+        file_name = "%s-%d-%d-%d-%d-%d.pcm" % (name, frequency, size, channels,
+                                               stat.st_size, int(stat.st_mtime))
+        return os.path.join(self.cache_dir, file_name)
+
+    def has_sound(self, name):
+        return name in self.sounds or os.path.exists(self.get_source_path(name))
+
+    def get(self, name):
+        """Returns the sound called name, loading it now if necessary.
+
+        Returns None if the mixer is not running or the sound does not exist.
+        """
+        sound = self.sounds.get(name)
+        if sound is not None:
+            return sound
+        if not pygame.mixer.get_init() or not self.has_sound(name):
+            return None
+
+        self.lock.acquire()
+        try:
+            # A background preload may have finished while we waited.
+            if name not in self.sounds:
+                self.sounds[name] = self.load(name)
+            return self.sounds[name]
+        finally:
+            self.lock.release()
+
+    def load(self, name):
+        source_path = self.get_source_path(name)
+        cache_path = self.get_cache_path(name, source_path)
+
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                return self.load_cached(cache_path)
+            except (IOError, OSError, ValueError, pygame.error), e:
+                print "SoundBank.load(\"%s\") - ignoring bad cache file: %s" % (name, e)
+
+        sound = pygame.mixer.Sound(source_path)
+        if cache_path is not None:
+            try:
+                self.write_cache(sound, cache_path)
+            except (IOError, OSError), e:
+                print "SoundBank.load(\"%s\") - could not cache: %s" % (name, e)
+        return sound
+
+    def load_cached(self, cache_path):
+        cache_file = open(cache_path, "rb")
+        try:
+            mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            cache_file.close()
+        # Keep the mapping alive for as long as the sound may use it.
+        self.mapped_files.append(mapped)
+        return pygame.mixer.Sound(buffer=mapped)
+
+    def write_cache(self, sound, cache_path):
+        if hasattr(sound, "get_raw"):
+            raw = sound.get_raw()
+        else:
+            raw = sound.get_buffer().raw
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Write then rename, so a crash never leaves a truncated cache file.
+        temp_path = cache_path + ".tmp"
+        out = open(temp_path, "wb")
+        try:
+            out.write(raw)
+        finally:
+            out.close()
+        os.rename(temp_path, cache_path)
+
+    def reserve_channels(self, groups):
+        """Reserves mixer channels for groups of (name, count, policy).
+
+        Reserved channels are never picked by Sound.play(), so sounds played
+        through a group can only ever compete with each other.
+        """
+        total = 0
+        for name, count, policy in groups:
+            total += count
+        if pygame.mixer.get_num_channels() < total:
+            pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+
+        first = 0
+        self.channel_groups = {}
+        for name, count, policy in groups:
+            channels = [pygame.mixer.Channel(i) for i in range(first, first + count)]
+            self.channel_groups[name] = ChannelGroup(channels, policy)
+            first += count
+
+    def play(self, name, group_name=None):
+        """Plays the sound called name; returns False if it does not exist."""
+        sound = self.get(name)
+        if sound is None:
+            return False
+        group = self.channel_groups.get(group_name)
+        if group is None:
+            sound.play()
+        else:
+            group.play(sound)
+        return True
+
+    def preload(self, names):
+        for name in names:
+            self.get(name)
+
+    def preload_in_background(self, names):
+        """Loads names on a background thread, unless one is already running."""
+        if self.preload_thread is not None and self.preload_thread.isAlive():
+            return
+        self.preload_thread = threading.Thread(target=self.preload, args=(list(names),))
+        self.preload_thread.setDaemon(True)
+        self.preload_thread.start()
+
+
+#===============================================================================
+# Latency measurement
+#===============================================================================
+
+# Sample type, silence and peak values for each mixer sample size.
+sample_formats = {
+    8: ("B", 0x80, 0xff),
+    -8: ("b", 0, 0x7f),
+    16: ("H", 0x8000, 0xffff),
+    -16: ("h", 0, 0x7fff),
+}
+
+
+def create_click_sound(length_ms):
+    """Creates a short click followed by silence, in the mixer's format."""
+    frequency, size, channels = pygame.mixer.get_init()
+    typecode, silence, peak = sample_formats[size]
+    num_values = (frequency * length_ms / 1000) * channels
+    samples = array(typecode, [silence] * num_values)
+    for i in range(min(32 * channels, num_values)):
+        samples[i] = peak
+    return pygame.mixer.Sound(buffer=samples.tostring())
+
+
+def measure_latency(settings, repeats=20, length_ms=50):
+    """Measures how late the mixer finishes a sound compared to its length.
+
+    The end of a sound is reported from the mixer callback, which runs once
+    per buffer, so the overshoot shows how much delay the buffer size adds on
+    this device.  Returns a sorted list of overshoots in milliseconds.
+    """
+    if init_mixer(settings) is None:
+        return []
+
+    sound = create_click_sound(length_ms)
+    length = sound.get_length()
+    channel = pygame.mixer.Channel(0)
+    channel.set_endevent(pygame.USEREVENT)
+    timer = timeit.default_timer
+
+    overshoots = []
+    for i in range(repeats):
+        pygame.event.clear()
+        start = timer()
+        channel.play(sound)
+        while not pygame.event.peek(pygame.USEREVENT):
+            pygame.time.wait(1)
+            if timer() - start > length + 2.0:
+                break
+        overshoots.append((timer() - start - length) * 1000.0)
+    channel.set_endevent()
+    overshoots.sort()
+    return overshoots
+
+
+def main(argv):
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog --latency BUFFER[,BUFFER...]")
+    parser.add_option("--latency", default="256,512,1024,2048",
+                      help="comma separated buffer sizes to measure")
+    parser.add_option("--repeats", type="int", default=20)
+    options, args = parser.parse_args(argv)
+
+    # Events need the video subsystem, but no window is ever shown.
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.display.init()
+
+    frequency, size, channels = get_mixer_settings()[:3]
+    print "%8s %10s %10s %10s %10s" % ("buffer", "buffer ms", "p50 ms", "p90 ms", "max ms")
+    for buffer_size in [int(value) for value in options.latency.split(",")]:
+        overshoots = measure_latency((frequency, size, channels, buffer_size), options.repeats)
+        if not overshoots:
+            print "%8d %10s" % (buffer_size, "failed")
+            continue
+        print "%8d %10.1f %10.1f %10.1f %10.1f" % (
+            buffer_size, buffer_size * 1000.0 / frequency,
+            overshoots[len(overshoots) / 2],
+            overshoots[int(len(overshoots) * 0.9)],
+            overshoots[-1])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -10,8 +10,12 @@ class PygameCanvas(gtk.EventBox):
     
     """
     mainwindow is the activity intself.
+
+    modules is the list of pygame modules (besides pygame.display) to
+    initialize before the main loop starts, e.g. [pygame.mixer].  The default
+    of None calls pygame.init(), which starts every module.
     """
-    def __init__(self, mainwindow, pointer_hint = True):
+    def __init__(self, mainwindow, pointer_hint = True, modules = None):
         gtk.EventBox.__init__(self)
 
         global CANVAS
@@ -22,6 +26,7 @@ class PygameCanvas(gtk.EventBox):
         self.translator = event.Translator(mainwindow, self)
         
         self._mainwindow = mainwindow
+        self._modules = modules
 
         self.set_flags(gtk.CAN_FOCUS)
         
@@ -48,7 +53,12 @@ class PygameCanvas(gtk.EventBox):
         os.environ['SDL_WINDOWID'] = str(self._socket.get_id())
         if pygame.display.get_surface() is not None:
             pygame.display.quit()
-        pygame.init()
+        if self._modules is None:
+            pygame.init()
+        else:
+            pygame.display.init()
+            for module in self._modules:
+                module.init()
         
         # Restore the default cursor.
         self._socket.window.set_cursor(None)
@@ -3,10 +3,20 @@ import gobject
 import pygame
 import pygame.event
 
+from keyrepeat import KeyRepeater
+
 class _MockEvent(object):
     def __init__(self, keyval):
         self.keyval = keyval
 
+def _build_key_names():
+    """Maps the names of pygame's K_* constants, minus the prefix, to keycodes."""
+    names = {}
+    for attr in dir(pygame):
+        if attr.startswith('K_'):
+            names[attr[2:]] = getattr(pygame, attr)
+    return names
+
 class Translator(object):
     key_trans = {
         'Alt_L': pygame.K_LALT,
@@ -28,6 +38,8 @@ class Translator(object):
 
     }
     
+    key_names = _build_key_names()
+
     mod_map = {
         pygame.K_LALT: pygame.KMOD_LALT,
         pygame.K_RALT: pygame.KMOD_RALT,
@@ -78,11 +90,29 @@ class Translator(object):
         self.__keystate = [0] * 323
         self.__button_state = [0,0,0]
         self.__mouse_pos = (0,0)
-        self.__repeat = (None, None)
-        self.__held = set()
-        self.__held_time_left = {}
-        self.__held_last_time = {}
-        self.__tick_id = None
+        self.__repeater = KeyRepeater(self._repeat_key)
+        self.__key_cache = {}
+        self.__event_types = None
+        self.__coalesce_motion = True
+        self.__pending = []
+        self.__flush_id = None
+
+    def set_event_filter(self, event_types):
+        """Only translate events whose type is in event_types.
+
+        Pass None to translate everything.  QUIT is always delivered.
+        """
+        if event_types is None:
+            self.__event_types = None
+        else:
+            self.__event_types = frozenset(event_types) | frozenset([pygame.QUIT])
+
+    def set_motion_coalescing(self, enabled):
+        """Merge consecutive MOUSEMOTION events into one per flush."""
+        self.__coalesce_motion = enabled
+
+    def _wants(self, type):
+        return self.__event_types is None or type in self.__event_types
 
     def hook_pygame(self):
         pygame.key.get_pressed = self._get_pressed
@@ -91,17 +121,18 @@ class Translator(object):
         pygame.mouse.get_pos = self._get_mouse_pos
 
     def update_display(self):
-        pygame.event.post(pygame.event.Event(pygame.VIDEOEXPOSE))
+        self._post(pygame.event.Event(pygame.VIDEOEXPOSE))
         
     def _expose_cb(self, widget, event):
         if pygame.display.get_init():
-            pygame.event.post(pygame.event.Event(pygame.VIDEOEXPOSE))
+            self._post(pygame.event.Event(pygame.VIDEOEXPOSE))
         return True
 
     def _resize_cb(self, widget, event):
-        evt = pygame.event.Event(pygame.VIDEORESIZE, 
-                                 size=(event.width,event.height), width=event.width, height=event.height)
-        pygame.event.post(evt)
+        if self._wants(pygame.VIDEORESIZE):
+            evt = pygame.event.Event(pygame.VIDEORESIZE, 
+                                     size=(event.width,event.height), width=event.width, height=event.height)
+            self._post(evt)
         return False # continue processing
 
     def _screen_changed_cb(self, widget, screen):
@@ -110,7 +141,8 @@ class Translator(object):
 
     def _quit_cb(self, data=None):
         self.__stopped = True
-        pygame.event.post(pygame.event.Event(pygame.QUIT))
+        self._post(pygame.event.Event(pygame.QUIT))
+        self.flush()
 
     def _visibility_cb(self, widget, event):
         if pygame.display.get_init():
@@ -118,25 +150,14 @@ class Translator(object):
         return False
 
     def _keydown_cb(self, widget, event):
-        key = event.keyval
-        if key in self.__held:
+        if not self.__repeater.press(event.keyval):
+            # GTK's own autorepeat; repeats are generated by the KeyRepeater.
             return True
-        else:
-            if self.__repeat[0] is not None:
-                self.__held_last_time[key] = pygame.time.get_ticks()
-                self.__held_time_left[key] = self.__repeat[0]
-            self.__held.add(key)
             
         return self._keyevent(widget, event, pygame.KEYDOWN)
         
     def _keyup_cb(self, widget, event):
-        key = event.keyval
-        if self.__repeat[0] is not None:
-            if key in self.__held:
-                # This is possibly false if set_repeat() is called with a key held
-                del self.__held_time_left[key]
-                del self.__held_last_time[key]
-        self.__held.discard(key)
+        self.__repeater.release(event.keyval)
 
         return self._keyevent(widget, event, pygame.KEYUP)
         
@@ -146,36 +167,49 @@ class Translator(object):
             mod |= self.__keystate[key_val] and mod_val
         return mod
         
+    def _lookup_key(self, keyval):
+        """Returns (name, keycode, unicode) for a GTK keyval.
+
+        The answer is cached, so each key is only resolved once.
+        """
+        entry = self.__key_cache.get(keyval)
+        if entry is None:
+            key = gtk.gdk.keyval_name(keyval)
+            keycode = None
+            if key is not None:
+                keycode = self.key_trans.get(key)
+                if keycode is None:
+                    keycode = self.key_names.get(key.upper())
+                if keycode is None:
+                    keycode = self.key_names.get(key.lower())
+            ukey = unichr(gtk.gdk.keyval_to_unicode(keyval))
+            if ukey == '\000':
+                ukey = ''
+            entry = (key, keycode, ukey)
+            self.__key_cache[keyval] = entry
+        return entry
+
     def _keyevent(self, widget, event, type):
-        key = gtk.gdk.keyval_name(event.keyval)
+        key, keycode, ukey = self._lookup_key(event.keyval)
         if key is None:
             # No idea what this key is.
             return False 
         
-        keycode = None
-        if key in self.key_trans:
-            keycode = self.key_trans[key]
-        elif hasattr(pygame, 'K_'+key.upper()):
-            keycode = getattr(pygame, 'K_'+key.upper())
-        elif hasattr(pygame, 'K_'+key.lower()):
-            keycode = getattr(pygame, 'K_'+key.lower())
-        elif key == 'XF86Start':
-            # view source request, specially handled...
-            self._mainwindow.view_source()
+        if keycode is None:
+            if key == 'XF86Start':
+                # view source request, specially handled...
+                self._mainwindow.view_source()
+            else:
+                print 'Key %s unrecognized' % key
         else:
-            print 'Key %s unrecognized' % key
-            
-        if keycode is not None:
             if type == pygame.KEYDOWN:
                 mod = self._keymods()
             self.__keystate[keycode] = type == pygame.KEYDOWN
             if type == pygame.KEYUP:
                 mod = self._keymods()
-            ukey = unichr(gtk.gdk.keyval_to_unicode(event.keyval))
-            if ukey == '\000':
-                ukey = ''
-            evt = pygame.event.Event(type, key=keycode, unicode=ukey, mod=mod)
-            self._post(evt)
+            if self._wants(type):
+                evt = pygame.event.Event(type, key=keycode, unicode=ukey, mod=mod)
+                self._post(evt)
             
         return True
 
@@ -194,8 +228,9 @@ class Translator(object):
         return self._mouseevent(widget, event, pygame.MOUSEBUTTONUP)
         
     def _mouseevent(self, widget, event, type):
-        evt = pygame.event.Event(type, button=event.button, pos=(event.x, event.y))
-        self._post(evt)
+        if self._wants(type):
+            evt = pygame.event.Event(type, button=event.button, pos=(event.x, event.y))
+            self._post(evt)
         return True
         
     def _mousemove_cb(self, widget, event):
@@ -218,40 +253,62 @@ class Translator(object):
             state & gtk.gdk.BUTTON3_MASK and 1 or 0,
         ]
         
-        evt = pygame.event.Event(pygame.MOUSEMOTION,
-                                 pos=self.__mouse_pos, rel=rel, buttons=self.__button_state)
-        self._post(evt)
+        if self._wants(pygame.MOUSEMOTION):
+            evt = pygame.event.Event(pygame.MOUSEMOTION,
+                                     pos=self.__mouse_pos, rel=rel, buttons=self.__button_state)
+            self._post(evt)
         return True
         
-    def _tick_cb(self):
-        cur_time = pygame.time.get_ticks()
-        for key in self.__held:
-            delta = cur_time - self.__held_last_time[key] 
-            self.__held_last_time[key] = cur_time
-            
-            self.__held_time_left[key] -= delta
-            if self.__held_time_left[key] <= 0:
-                self.__held_time_left[key] = self.__repeat[1]
-                self._keyevent(None, _MockEvent(key), pygame.KEYDOWN)
-                
-        return True
+    def _repeat_key(self, keyval):
+        self._keyevent(None, _MockEvent(keyval), pygame.KEYDOWN)
         
     def _set_repeat(self, delay=None, interval=None):
-        if delay is not None and self.__repeat[0] is None:
-            self.__tick_id = gobject.timeout_add(10, self._tick_cb)
-        elif delay is None and self.__repeat[0] is not None:
-            gobject.source_remove(self.__tick_id)
-        self.__repeat = (delay, interval)
+        self.__repeater.set_repeat(delay, interval)
         
     def _get_mouse_pos(self):
         return self.__mouse_pos
 
     def _post(self, evt):
-        try:
-            pygame.event.post(evt)
-        except pygame.error, e:
-            if str(e) == 'Event queue full':
-                print "Event queue full!"
-                pass
-            else:
-                raise e
+        """Queues evt; queued events are posted together by flush()."""
+        if not self._wants(evt.type):
+            return
+
+        pending = self.__pending
+        if evt.type == pygame.MOUSEMOTION and self.__coalesce_motion and \
+           pending and pending[-1].type == pygame.MOUSEMOTION:
+            # Only the latest position matters; keep the total movement.
+            last = pending[-1]
+            rel = (last.rel[0] + evt.rel[0], last.rel[1] + evt.rel[1])
+            pending[-1] = pygame.event.Event(pygame.MOUSEMOTION,
+                                             pos=evt.pos, rel=rel, buttons=evt.buttons)
+        else:
+            pending.append(evt)
+
+        if self.__flush_id is None:
+            self.__flush_id = gobject.idle_add(self._flush_cb,
+                                               priority=gobject.PRIORITY_HIGH_IDLE)
+
+    def _flush_cb(self):
+        self.__flush_id = None
+        self.flush()
+        return False
+
+    def flush(self):
+        """Posts every queued event to the pygame event queue."""
+        pending = self.__pending
+        self.__pending = []
+        for index, evt in enumerate(pending):
+            try:
+                pygame.event.post(evt)
+            except pygame.error, e:
+                if str(e) == 'Event queue full':
+                    print "Event queue full!"
+                    # Retry the rest later, but stale motion is not worth it.
+                    rest = [queued for queued in pending[index:]
+                            if queued.type != pygame.MOUSEMOTION]
+                    self.__pending = rest + self.__pending
+                    if self.__pending and self.__flush_id is None:
+                        self.__flush_id = gobject.timeout_add(20, self._flush_cb)
+                    return
+                else:
+                    raise e
@@ -0,0 +1,215 @@
+"""Compact recording and replay of the pygame events a game received.
+
+Events are stored per frame of the game's main loop, so replaying a log into
+the same game from the same starting state reproduces the session exactly,
+whatever the speed of the machine.  Each frame that had events also stores
+its time, so a replay can optionally run at the original pace.
+
+Input that does not come through pygame, such as toolbar buttons, can be
+recorded as commands: a key and a tuple of arguments, stored as the repr()
+of plain values (numbers, strings, booleans, None and tuples of them) and
+read back with ast.literal_eval().
+
+File format (little-endian): the header "SGEV" plus a version byte and three
+reserved bytes, then one block per frame that had events:
+
+    uint32 frame, uint32 ms since the first frame, uint8 event count,
+    then for each event a uint8 code and a code-specific payload.
+
+A command is code 9 and a payload of a uint16 length and that many bytes of
+repr((key, args)).  Version 1 logs, without commands, are still read.
+
+The last block has no events and marks the frame the recording stopped at.
+"""
+
+import ast
+import struct
+import time
+
+import pygame
+
+MAGIC = "SGEV"
+VERSION = 2
+
+_header = struct.Struct("<4sB3x")
+_frame = struct.Struct("<IIB")
+_code = struct.Struct("<B")
+_command_length = struct.Struct("<H")
+
+COMMAND_CODE = 9
+
+# code: (pygame type, payload format, event attributes)
+_event_formats = {
+    1: (pygame.QUIT, "", ()),
+    2: (pygame.KEYDOWN, "<IHH", ("key", "mod", "unicode")),
+    3: (pygame.KEYUP, "<IHH", ("key", "mod", "unicode")),
+    4: (pygame.MOUSEBUTTONDOWN, "<Bhh", ("button", "pos")),
+    5: (pygame.MOUSEBUTTONUP, "<Bhh", ("button", "pos")),
+    6: (pygame.MOUSEMOTION, "<hhhhB", ("pos", "rel", "buttons")),
+    7: (pygame.VIDEORESIZE, "<HH", ("size",)),
+    8: (pygame.VIDEOEXPOSE, "", ()),
+}
+
+_codes = {}
+_payloads = {}
+for _code_value, (_type, _format, _names) in _event_formats.items():
+    _codes[_type] = _code_value
+    _payloads[_code_value] = struct.Struct(_format)
+
+
+def _encode(event):
+    """Returns the bytes for event, or None if it is not a recordable type."""
+    code = _codes.get(event.type)
+    if code is None:
+        return None
+    payload = _payloads[code]
+    if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+        ukey = getattr(event, "unicode", u"")
+        values = (event.key, event.mod, ukey and ord(ukey[0]) or 0)
+    elif event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+        values = (event.button, event.pos[0], event.pos[1])
+    elif event.type == pygame.MOUSEMOTION:
+        buttons = 0
+        for index, pressed in enumerate(event.buttons):
+            if pressed:
+                buttons |= 1 << index
+        values = (event.pos[0], event.pos[1], event.rel[0], event.rel[1], buttons)
+    elif event.type == pygame.VIDEORESIZE:
+        values = event.size
+    else:
+        values = ()
+    return _code.pack(code) + payload.pack(*values)
+
+
+def _encode_command(key, args):
+    text = repr((key, tuple(args)))
+    return _code.pack(COMMAND_CODE) + _command_length.pack(len(text)) + text
+
+
+def _decode(data, offset):
+    """Returns (event, new offset) for the event encoded at offset; a command
+    decodes to a (key, args) tuple instead of an event."""
+    code = _code.unpack_from(data, offset)[0]
+    offset += _code.size
+    if code == COMMAND_CODE:
+        length = _command_length.unpack_from(data, offset)[0]
+        offset += _command_length.size
+        key, args = ast.literal_eval(data[offset:offset + length])
+        return (key, args), offset + length
+    event_type = _event_formats[code][0]
+    payload = _payloads[code]
+    values = payload.unpack_from(data, offset)
+    offset += payload.size
+
+    if event_type in (pygame.KEYDOWN, pygame.KEYUP):
+        ukey = values[2] and unichr(values[2]) or u""
+        event = pygame.event.Event(event_type, key=values[0], mod=values[1], unicode=ukey)
+    elif event_type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+        event = pygame.event.Event(event_type, button=values[0], pos=(values[1], values[2]))
+    elif event_type == pygame.MOUSEMOTION:
+        buttons = [(values[4] >> index) & 1 for index in range(3)]
+        event = pygame.event.Event(event_type, pos=(values[0], values[1]),
+                                   rel=(values[2], values[3]), buttons=buttons)
+    elif event_type == pygame.VIDEORESIZE:
+        event = pygame.event.Event(event_type, size=values, w=values[0], h=values[1])
+    else:
+        event = pygame.event.Event(event_type)
+    return event, offset
+
+
+class EventRecorder(object):
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._file.write(_header.pack(MAGIC, VERSION))
+        self._start = None
+        self._last_frame = 0
+
+    def record(self, frame, events):
+        """Records the events the game handled in frame."""
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        self._last_frame = frame
+
+        encoded = []
+        for event in events:
+            data = _encode(event)
+            if data is not None:
+                encoded.append(data)
+        self._write_blocks(frame, now, encoded)
+
+    def record_commands(self, frame, commands):
+        """Records commands, (key, args) pairs, the game ran in frame."""
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        self._last_frame = max(self._last_frame, frame)
+        self._write_blocks(frame, now, [_encode_command(key, args) for key, args in commands])
+
+    def _write_blocks(self, frame, now, encoded):
+        # Frames can have more events than the count byte holds.
+        while encoded:
+            chunk, encoded = encoded[:255], encoded[255:]
+            self._write_frame(frame, now, chunk)
+
+    def _write_frame(self, frame, now, encoded):
+        ms = int((now - self._start) * 1000)
+        self._file.write(_frame.pack(frame, ms, len(encoded)) + "".join(encoded))
+        # Flushed right away so that a crash still leaves a usable log.
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        self._write_frame(self._last_frame, now, [])
+        self._file.close()
+        self._file = None
+
+
+class EventPlayer(object):
+    def __init__(self, path, realtime=False):
+        """Replays the log at path; realtime keeps the original pace."""
+        data = open(path, "rb").read()
+        magic, version = _header.unpack_from(data, 0)
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            raise ValueError("%s is not a version %d event log" % (path, VERSION))
+
+        self.realtime = realtime
+        self.frames = {}
+        self.commands = {}
+        self.frame_times = {}
+        self.last_frame = 0
+        offset = _header.size
+        while offset < len(data):
+            frame, ms, count = _frame.unpack_from(data, offset)
+            offset += _frame.size
+            events = self.frames.setdefault(frame, [])
+            for i in range(count):
+                event, offset = _decode(data, offset)
+                if isinstance(event, tuple):
+                    self.commands.setdefault(frame, []).append(event)
+                else:
+                    events.append(event)
+            self.frame_times.setdefault(frame, ms)
+            self.last_frame = max(self.last_frame, frame)
+        self._start = None
+
+    def is_finished(self, frame):
+        return frame > self.last_frame
+
+    def get_events(self, frame):
+        """Returns the events recorded for frame, waiting for them if realtime."""
+        if self._start is None:
+            self._start = time.time()
+        if self.realtime and frame in self.frame_times:
+            delay = self._start + self.frame_times[frame] / 1000.0 - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return self.frames.get(frame, [])
+
+    def get_commands(self, frame):
+        """Returns the (key, args) commands recorded for frame, in order."""
+        return self.commands.get(frame, [])
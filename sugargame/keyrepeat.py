@@ -0,0 +1,100 @@
+"""Key repeat for the event Translator, driven by one-shot timers.
+
+A timer is only scheduled while a key is held, for the earliest repeat
+deadline of all held keys, so an idle activity never wakes up for key
+repeat.
+"""
+
+# Repeats never come faster than this, in ms.  It matches the resolution of
+# the polling timer this replaces, and keeps an interval of 0 from spinning.
+MIN_PERIOD = 10
+
+
+class KeyRepeater(object):
+    def __init__(self, fire, get_ticks=None, timeout_add=None, source_remove=None):
+        """fire(keyval) is called for every repeat of a held key."""
+        if get_ticks is None:
+            import pygame.time
+            get_ticks = pygame.time.get_ticks
+        if timeout_add is None or source_remove is None:
+            import gobject
+            timeout_add = gobject.timeout_add
+            source_remove = gobject.source_remove
+
+        self._fire = fire
+        self._get_ticks = get_ticks
+        self._timeout_add = timeout_add
+        self._source_remove = source_remove
+
+        self.delay = None
+        self.interval = None
+        self._held = set()
+        self._deadlines = {}
+        self._timer_id = None
+        self._timer_deadline = None
+
+    def set_repeat(self, delay=None, interval=None):
+        """Same arguments as pygame.key.set_repeat; no delay disables repeat.
+
+        Keys that are already held when repeat is enabled do not repeat.
+        """
+        if delay is None:
+            self.delay = self.interval = None
+            self._deadlines.clear()
+        else:
+            if interval is None:
+                interval = 0
+            self.delay = max(delay, MIN_PERIOD)
+            self.interval = max(interval, MIN_PERIOD)
+        self._reschedule()
+
+    def press(self, keyval):
+        """Returns False if keyval was already held, i.e. a GTK autorepeat."""
+        if keyval in self._held:
+            return False
+        self._held.add(keyval)
+        if self.delay is not None:
+            self._deadlines[keyval] = self._get_ticks() + self.delay
+            self._reschedule()
+        return True
+
+    def release(self, keyval):
+        self._held.discard(keyval)
+        if self._deadlines.pop(keyval, None) is not None:
+            self._reschedule()
+
+    def is_scheduled(self):
+        return self._timer_id is not None
+
+    def _reschedule(self):
+        if self._deadlines:
+            deadline = min(self._deadlines.values())
+        else:
+            deadline = None
+
+        if deadline == self._timer_deadline:
+            return
+        if self._timer_id is not None:
+            self._source_remove(self._timer_id)
+            self._timer_id = None
+        self._timer_deadline = deadline
+        if deadline is not None:
+            delay = max(deadline - self._get_ticks(), 0)
+            self._timer_id = self._timeout_add(delay, self._timeout_cb)
+
+    def _timeout_cb(self):
+        self._timer_id = None
+        self._timer_deadline = None
+
+        now = self._get_ticks()
+        due = [(deadline, keyval) for keyval, deadline in self._deadlines.items()
+               if deadline <= now]
+        due.sort()
+        for deadline, keyval in due:
+            # fire() may release keys or change the repeat settings.
+            if keyval in self._deadlines:
+                self._deadlines[keyval] = now + self.interval
+                self._fire(keyval)
+
+        self._reschedule()
+        return False
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# symmetry.py - The eight symmetries of the board.
+#
+# A transform is a number from 0 to 7 made of three flags, applied in order:
+# TRANSPOSE swaps column_index and row_index, FLIP_COLUMNS reverses the
+# column_index and FLIP_ROWS reverses the row_index.
+#
+# Transposing takes three delta swaps on the whole mask.  The flips work on
+# the mask packed into 8 bytes, one per column: reversing the string flips
+# the columns and translating each byte through a table flips the rows.
+# Python's long arithmetic costs far more than those string operations.
+#
+# canonicalize() picks the transform giving the smallest packed (own,
+# opponent) pair, so every position has one key for all its symmetric
+# copies; the transform it returns maps moves into the canonical frame, and
+# unmap_square() maps them back.  The own mask's variants nearly always
+# decide on their own, so the opponent's are only all made when own is
+# symmetric.
+#
+
+import struct
+
+import rules
+
+TRANSPOSE = 1
+FLIP_COLUMNS = 2
+FLIP_ROWS = 4
+
+transforms = range(8)
+
+_mask = struct.Struct("<Q")
+_pack = _mask.pack
+_unpack = _mask.unpack
+
+# Each byte with its bits in reverse order.
+_reversed_bytes = "".join([chr(int(bin(byte)[2:].zfill(8)[::-1], 2)) for byte in range(256)])
+
+
+def transpose(mask):
+    """Swaps column_index and row_index: bit c * 8 + r moves to r * 8 + c."""
+    t = 0x0f0f0f0f00000000 & (mask ^ (mask << 28))
+    mask ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (mask ^ (mask << 14))
+    mask ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (mask ^ (mask << 7))
+    mask ^= t ^ (t >> 7)
+    return mask
+
+
+def flip_columns(mask):
+    """Reverses the order of the columns, i.e. of the bytes."""
+    return _unpack(_pack(mask)[::-1])[0]
+
+
+def flip_rows(mask):
+    """Reverses the row_index within each column, i.e. the bits of each byte."""
+    return _unpack(_pack(mask).translate(_reversed_bytes))[0]
+
+
+def apply(transform, mask):
+    if transform & TRANSPOSE:
+        mask = transpose(mask)
+    if transform & FLIP_COLUMNS:
+        mask = flip_columns(mask)
+    if transform & FLIP_ROWS:
+        mask = flip_rows(mask)
+    return mask
+
+
+def get_packed_variants(mask):
+    """Returns apply(transform, mask) packed into 8 bytes, for every transform."""
+    packed = _pack(mask)
+    transposed = _pack(transpose(mask))
+    packed_columns = packed[::-1]
+    transposed_columns = transposed[::-1]
+    return [packed, transposed, packed_columns, transposed_columns,
+            packed.translate(_reversed_bytes), transposed.translate(_reversed_bytes),
+            packed_columns.translate(_reversed_bytes),
+            transposed_columns.translate(_reversed_bytes)]
+
+
+def get_variants(mask):
+    """Returns apply(transform, mask) for every transform, in order."""
+    return [_unpack(packed)[0] for packed in get_packed_variants(mask)]
+
+
+def canonicalize(own, opponent):
+    """Returns (own, opponent, transform) for the canonical copy of a position."""
+    variants = get_packed_variants(own)
+    best = min(variants)
+    if variants.count(best) == 1:
+        # The usual case: own alone decides, and only the one transform of
+        # opponent is needed, done on the packed mask as apply() would.
+        transform = variants.index(best)
+        if transform & TRANSPOSE:
+            opponent = transpose(opponent)
+        packed = _pack(opponent)
+        if transform & FLIP_COLUMNS:
+            packed = packed[::-1]
+        if transform & FLIP_ROWS:
+            packed = packed.translate(_reversed_bytes)
+        return _unpack(best)[0], _unpack(packed)[0], transform
+    # own is symmetric; the opponent's variants break the tie, the first
+    # transform winning as in min() over the (own, opponent) pairs.
+    opponent_variants = get_packed_variants(opponent)
+    tied = [transform for transform in transforms if variants[transform] == best]
+    best_opponent = min([opponent_variants[transform] for transform in tied])
+    for transform in tied:
+        if opponent_variants[transform] == best_opponent:
+            return _unpack(best)[0], _unpack(best_opponent)[0], transform
+
+
+# square_maps[transform][square] is where transform moves square.
+square_maps = [[apply(transform, 1 << square).bit_length() - 1 for square in range(64)]
+               for transform in transforms]
+
+_inverses = []
+for _transform in transforms:
+    for _candidate in transforms:
+        if [square_maps[_candidate][square_maps[_transform][s]] for s in range(64)] == range(64):
+            _inverses.append(_candidate)
+            break
+
+
+def get_inverse(transform):
+    return _inverses[transform]
+
+
+def map_square(transform, square):
+    if square is None:
+        return None
+    return square_maps[transform][square]
+
+
+def unmap_square(transform, square):
+    """Maps a square of the canonical frame back to the original position."""
+    if square is None:
+        return None
+    return square_maps[_inverses[transform]][square]
+
+
+# The transforms that leave the starting position as it is; a game and its
+# copies under these are the same game.
+game_transforms = [transform for transform in transforms
+                   if apply(transform, rules.INITIAL_WHITE) == rules.INITIAL_WHITE and
+                   apply(transform, rules.INITIAL_BLACK) == rules.INITIAL_BLACK]
+
+
+def canonicalize_game(moves):
+    """Returns the smallest of the copies of the move list under game_transforms."""
+    best = None
+    for transform in game_transforms:
+        square_map = square_maps[transform]
+        copy = tuple([square_map[move] for move in moves])
+        if best is None or copy < best:
+            best = copy
+    return best
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# test_collab.py - A collab session outlives its connection.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import collab
+import rules
+
+
+class Game:
+    """The parts of ReversiController a CollabSession uses."""
+
+    def __init__(self):
+        self.game = rules.Game()
+        self.collab = None
+
+    def set_collab_session(self, session):
+        if self.collab is not None:
+            self.collab.close()
+        self.collab = session
+
+    def get_position(self):
+        return (self.game.white, self.game.black, self.game.player, len(self.game.moves))
+
+    def play_remote_move(self, square):
+        if not self.game.is_legal(square):
+            return False
+        self.game.play(square)
+        return True
+
+
+class DisconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+        self.game = Game()
+        session = collab.CollabSession(collab.SocketTransport(self.local), self.game,
+                                       collab.SHARER_PLAYER)
+        self.game.set_collab_session(session)
+
+    def tearDown(self):
+        self.remote.close()
+
+    def test_peer_hangs_up(self):
+        session = self.game.collab
+        self.remote.close()
+        session.poll()
+        self.assertTrue(session.disconnected)
+        self.assertEqual(self.game.collab, None)
+
+    def test_send_after_peer_hangs_up(self):
+        session = self.game.collab
+        self.remote.close()
+        # EPIPE, or ECONNRESET, from the send, not a crash.
+        session.move_played(19, 0)
+        session.game_restarted()
+        self.assertTrue(session.disconnected)
+        self.assertEqual(self.game.collab, None)
+
+    def test_moves_before_hang_up(self):
+        session = self.game.collab
+        self.remote.sendall("M 0 19\n")
+        self.remote.close()
+        session.poll()
+        self.assertEqual(self.game.game.moves, [19])
+        self.assertEqual(self.game.collab, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# test_commands.py - The command queue runs one command per key a frame.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import reversi
+
+
+class CommandQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = reversi.CommandQueue()
+        self.calls = []
+
+    def record(self, *args):
+        self.calls.append(args)
+
+    def test_latest_post_wins(self):
+        for value in range(10):
+            self.queue.post("color", self.record, value)
+        self.assertEqual(self.queue.drain(), [("color", (9,))])
+        self.assertEqual(self.calls, [(9,)])
+
+    def test_order_of_first_post(self):
+        self.queue.post("sound", self.record, "sound", False)
+        self.queue.post("color", self.record, "color", 1)
+        self.queue.post("sound", self.record, "sound", True)
+        self.queue.post("new_game", self.record, "new_game")
+        self.assertEqual([key for key, args in self.queue.drain()],
+                         ["sound", "color", "new_game"])
+        self.assertEqual(self.calls, [("sound", True), ("color", 1), ("new_game",)])
+
+    def test_drain_empties(self):
+        self.queue.post("color", self.record, 1)
+        self.queue.drain()
+        self.assertEqual(self.queue.drain(), [])
+        self.assertEqual(self.calls, [(1,)])
+
+    def test_post_while_draining(self):
+        # A command posted by a command waits for the next frame.
+        self.queue.post("first", lambda: self.queue.post("second", self.record, 2))
+        self.assertEqual([key for key, args in self.queue.drain()], ["first"])
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.queue.drain(), [("second", (2,))])
+        self.assertEqual(self.calls, [(2,)])
+
+    def test_posts_from_threads(self):
+        def post(thread_index):
+            for value in range(200):
+                self.queue.post("key%d" % (value % 5), self.record, thread_index, value)
+
+        threads = [threading.Thread(target=post, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ran = self.queue.drain()
+        self.assertEqual(sorted([key for key, args in ran]),
+                         ["key0", "key1", "key2", "key3", "key4"])
+        for key, args in ran:
+            self.assertEqual(args[1] % 5, int(key[3:]))
+            # Each thread's last post of a key is one of its last five.
+            self.assertTrue(args[1] >= 195)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# test_history.py - Undo and redo through a History.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import history
+import rules
+
+
+def play_random_game(seed, opening=()):
+    """Returns the (white, black, player, move) of every ply of a random
+    game starting with the moves of opening."""
+    rng = random.Random(seed)
+    game = rules.Game()
+    positions = [(game.white, game.black, game.player, history.NO_MOVE)]
+    for square in opening:
+        game.play(square)
+        positions.append((game.white, game.black, game.player, square))
+    while not game.is_over():
+        square = rng.choice(list(rules.iter_squares(game.get_legal_moves())))
+        game.play(square)
+        positions.append((game.white, game.black, game.player, square))
+    return positions
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.positions = play_random_game(1)
+        self.history = history.History()
+        white, black, player, move = self.positions[0]
+        self.history.reset(white, black, player)
+        for white, black, player, move in self.positions[1:]:
+            self.history.record(white, black, player, move)
+
+    def test_record(self):
+        self.assertEqual(self.history.get_length(), len(self.positions))
+        self.assertEqual(self.history.get_cursor(), len(self.positions) - 1)
+        for ply, position in enumerate(self.positions):
+            self.assertEqual(self.history.get(ply), position)
+        self.assertEqual(self.history.get_moves(),
+                         [position[3] for position in self.positions[1:]])
+
+    def test_undo_and_redo(self):
+        for ply in reversed(range(len(self.positions))):
+            self.assertEqual(self.history.seek(ply), self.positions[ply])
+            self.assertEqual(self.history.get_cursor(), ply)
+            self.assertEqual(self.history.get_moves(),
+                             [position[3] for position in self.positions[1:ply + 1]])
+        for ply in range(len(self.positions)):
+            self.assertEqual(self.history.seek(ply), self.positions[ply])
+        # Seeking keeps every ply.
+        self.assertEqual(self.history.get_length(), len(self.positions))
+
+    def test_record_after_undo(self):
+        ply = 10
+        opening = [position[3] for position in self.positions[1:ply + 1]]
+        other = play_random_game(2, opening)
+        self.assertNotEqual(other, self.positions)
+        self.history.seek(ply)
+        for white, black, player, move in other[ply + 1:]:
+            self.history.record(white, black, player, move)
+        self.assertEqual(self.history.get_length(), len(other))
+        for ply, position in enumerate(other):
+            self.assertEqual(self.history.get(ply), position)
+
+    def test_set_player(self):
+        self.history.seek(3)
+        self.history.set_player(rules.get_opponent(self.positions[3][2]))
+        self.assertEqual(self.history.get(3)[2], rules.get_opponent(self.positions[3][2]))
+        self.assertEqual(self.history.get(4), self.positions[4])
+
+    def test_bad_ply(self):
+        self.assertRaises(IndexError, self.history.get, len(self.positions))
+        self.assertRaises(IndexError, self.history.seek, -1)
+        self.history.seek(2)
+        # The plies after the cursor are gone once a move is recorded.
+        white, black, player, move = self.positions[3]
+        self.history.record(white, black, player, move)
+        self.assertRaises(IndexError, self.history.get, 4)
+
+    def test_full(self):
+        small = history.History(2)
+        small.reset(rules.INITIAL_WHITE, rules.INITIAL_BLACK, 1)
+        white, black, player, move = self.positions[1]
+        small.record(white, black, player, move)
+        self.assertRaises(IndexError, small.record, white, black, player, move)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# test_keyrepeat.py - Held keys repeat on one-shot timers.
+#
+#   python -m unittest discover tests
+#
+# GTK key events are fed to a Translator whose KeyRepeater runs on a
+# simulated clock, and the pygame events it posts are checked.
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame
+
+try:
+    import gtk
+except ImportError:
+    gtk = None
+
+if gtk is not None:
+    from sugargame import event
+    from sugargame.keyrepeat import KeyRepeater
+
+
+class Loop:
+    """Stands in for the GTK main loop and pygame's clock."""
+
+    def __init__(self):
+        self.now = 0
+        self.timers = {}
+        self.next_id = 1
+        self.wakeups = 0
+
+    def get_ticks(self):
+        return self.now
+
+    def timeout_add(self, ms, callback):
+        timer_id = self.next_id
+        self.next_id += 1
+        self.timers[timer_id] = (self.now + ms, callback)
+        return timer_id
+
+    def source_remove(self, timer_id):
+        del self.timers[timer_id]
+
+    def run_until(self, when):
+        while self.timers:
+            timer_id = min(self.timers, key=lambda i: self.timers[i][0])
+            deadline, callback = self.timers[timer_id]
+            if deadline > when:
+                break
+            del self.timers[timer_id]
+            self.now = deadline
+            self.wakeups += 1
+            if callback():
+                self.timers[timer_id] = (self.now, callback)
+        self.now = when
+
+
+class Widget:
+    """The parts of a gtk widget a Translator uses."""
+
+    def add_events(self, mask):
+        pass
+
+    def set_events(self, mask):
+        pass
+
+    def set_flags(self, flags):
+        pass
+
+    def connect(self, signal, callback):
+        pass
+
+
+class KeyEvent:
+    def __init__(self, keyval):
+        self.keyval = keyval
+
+
+@unittest.skipIf(gtk is None, "needs PyGTK")
+class KeyRepeatTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = Loop()
+        self.posted = []
+        translator = event.Translator(Widget(), Widget())
+        # The repeater on the simulated clock, in place of gobject's timers.
+        translator._Translator__repeater = KeyRepeater(
+            translator._repeat_key, self.loop.get_ticks, self.loop.timeout_add,
+            self.loop.source_remove)
+        translator._post = self.post
+        self.translator = translator
+        self.a = gtk.gdk.keyval_from_name("a")
+        self.b = gtk.gdk.keyval_from_name("b")
+
+    def post(self, evt):
+        self.posted.append((self.loop.now, evt.type, evt.key))
+
+    def press(self, when, keyval):
+        self.loop.run_until(when)
+        self.translator._keydown_cb(None, KeyEvent(keyval))
+
+    def release(self, when, keyval):
+        self.loop.run_until(when)
+        self.translator._keyup_cb(None, KeyEvent(keyval))
+
+    def finish(self):
+        self.loop.run_until(self.loop.now + 10000)
+
+    def test_single_key(self):
+        self.translator._set_repeat(500, 100)
+        self.press(0, self.a)
+        self.release(950, self.a)
+        self.finish()
+        down = pygame.KEYDOWN
+        self.assertEqual(self.posted, [
+            (0, down, pygame.K_a), (500, down, pygame.K_a), (600, down, pygame.K_a),
+            (700, down, pygame.K_a), (800, down, pygame.K_a), (900, down, pygame.K_a),
+            (950, pygame.KEYUP, pygame.K_a)])
+        self.assertEqual(self.loop.wakeups, 5)
+
+    def test_gtk_autorepeat_is_ignored(self):
+        self.translator._set_repeat(500, 100)
+        self.press(0, self.a)
+        self.press(300, self.a)
+        self.press(550, self.a)
+        self.release(650, self.a)
+        self.finish()
+        down = pygame.KEYDOWN
+        self.assertEqual(self.posted, [
+            (0, down, pygame.K_a), (500, down, pygame.K_a), (600, down, pygame.K_a),
+            (650, pygame.KEYUP, pygame.K_a)])
+
+    def test_two_keys(self):
+        self.translator._set_repeat(500, 100)
+        self.press(0, self.a)
+        self.press(250, self.b)
+        self.release(720, self.a)
+        self.release(900, self.b)
+        self.finish()
+        down = pygame.KEYDOWN
+        self.assertEqual(self.posted, [
+            (0, down, pygame.K_a), (250, down, pygame.K_b), (500, down, pygame.K_a),
+            (600, down, pygame.K_a), (700, down, pygame.K_a),
+            (720, pygame.KEYUP, pygame.K_a), (750, down, pygame.K_b),
+            (850, down, pygame.K_b), (900, pygame.KEYUP, pygame.K_b)])
+        self.assertEqual(self.loop.wakeups, 5)
+
+    def test_released_before_delay(self):
+        self.translator._set_repeat(500, 100)
+        self.press(0, self.a)
+        self.release(499, self.a)
+        self.finish()
+        self.assertEqual(self.posted, [(0, pygame.KEYDOWN, pygame.K_a),
+                                       (499, pygame.KEYUP, pygame.K_a)])
+        self.assertEqual(self.loop.wakeups, 0)
+
+    def test_idle_with_repeat_enabled(self):
+        self.translator._set_repeat(500, 100)
+        self.finish()
+        self.assertEqual(self.posted, [])
+        self.assertEqual(self.loop.wakeups, 0)
+
+    def test_repeat_disabled_while_held(self):
+        self.translator._set_repeat(500, 100)
+        self.press(0, self.a)
+        self.loop.run_until(650)
+        self.translator._set_repeat()
+        self.release(900, self.a)
+        self.finish()
+        down = pygame.KEYDOWN
+        self.assertEqual(self.posted, [
+            (0, down, pygame.K_a), (500, down, pygame.K_a), (600, down, pygame.K_a),
+            (900, pygame.KEYUP, pygame.K_a)])
+
+    def test_zero_interval_is_clamped(self):
+        self.translator._set_repeat(100, 0)
+        self.press(0, self.a)
+        self.release(135, self.a)
+        self.finish()
+        self.assertEqual([when for when, type, key in self.posted],
+                         [0, 100, 110, 120, 130, 135])
+
+
+if __name__ == "__main__":
+    unittest.main()
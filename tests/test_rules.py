@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# test_rules.py - The line tables flip what walking the rays flips.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rules
+
+
+def get_random_positions(seed, count):
+    """Returns (own, opponent) for count positions of random games, the
+    player to move first."""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = rules.Game()
+        while not game.is_over() and len(positions) < count:
+            positions.append(game.get_player_masks(game.player))
+            game.play(rng.choice(list(rules.iter_squares(game.get_legal_moves()))))
+    return positions
+
+
+class FlipsTest(unittest.TestCase):
+    def test_legal_moves(self):
+        for own, opponent in get_random_positions(1, 500):
+            for square in rules.iter_squares(rules.get_legal_moves(own, opponent)):
+                flips = rules.get_flips(own, opponent, square)
+                self.assertEqual(flips, rules.walk_flips(own, opponent, square))
+                self.assertNotEqual(flips, 0)
+
+    def test_every_empty_square(self):
+        # Squares that flip nothing are exactly the ones that are not moves.
+        for own, opponent in get_random_positions(2, 200):
+            moves = rules.get_legal_moves(own, opponent)
+            empty = rules.FULL & ~(own | opponent)
+            for square in rules.iter_squares(empty):
+                flips = rules.get_flips(own, opponent, square)
+                self.assertEqual(flips, rules.walk_flips(own, opponent, square))
+                self.assertEqual(flips != 0, bool(moves & (1 << square)))
+
+    def test_edges(self):
+        # Runs along the edges, and runs that would wrap round the board.
+        edges = [square for square in range(64) if square % 8 in (0, 7) or square / 8 in (0, 7)]
+        for own, opponent in get_random_positions(3, 100):
+            for square in edges:
+                bit = 1 << square
+                self.assertEqual(rules.get_flips(own & ~bit, opponent & ~bit, square),
+                                 rules.walk_flips(own & ~bit, opponent & ~bit, square))
+        own = 1 << 7
+        opponent = (1 << 1) | (1 << 2) | (1 << 3) | (1 << 4) | (1 << 5) | (1 << 6)
+        self.assertEqual(rules.get_flips(own, opponent, 0), opponent)
+        # Row 7 of column 0 and row 0 of column 1 are not neighbours.
+        self.assertEqual(rules.get_flips(1 << 9, 1 << 8, 7), 0)
+
+    def test_full_board(self):
+        # Every line through the square is full of the opponent.
+        for square in range(64):
+            opponent = rules.FULL & ~(1 << square)
+            self.assertEqual(rules.get_flips(0, opponent, square), 0)
+            self.assertEqual(rules.walk_flips(0, opponent, square), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
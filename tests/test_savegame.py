@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# test_savegame.py - A saved game reads back as it was written.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import archive
+import rules
+import savegame
+
+colors = [(255, 255, 255), (0, 128, 0), (0, 0, 0), (250, 250, 250), (10, 10, 10)]
+
+
+def get_saved_game(moves, level=None):
+    game = archive.replay_game(moves)
+    return savegame.SavedGame(game.white, game.black, game.player, moves, colors,
+                              game.is_over(), level)
+
+
+class RoundTripTest(unittest.TestCase):
+    def check_round_trip(self, saved):
+        loaded = savegame.unpack(savegame.pack(saved))
+        self.assertEqual(loaded.white, saved.white)
+        self.assertEqual(loaded.black, saved.black)
+        self.assertEqual(loaded.player, saved.player)
+        self.assertEqual(loaded.moves, saved.moves)
+        self.assertEqual(loaded.colors, saved.colors)
+        self.assertEqual(loaded.game_over, saved.game_over)
+        self.assertEqual(loaded.level, saved.level)
+
+    def test_new_game(self):
+        self.check_round_trip(get_saved_game([]))
+
+    def test_game_in_progress(self):
+        self.check_round_trip(get_saved_game(archive.parse_game("f5d6c3d3c4"), 2))
+
+    def test_finished_game(self):
+        rng = random.Random(1)
+        game = rules.Game()
+        while not game.is_over():
+            game.play(rng.choice(list(rules.iter_squares(game.get_legal_moves()))))
+        saved = get_saved_game(game.moves, 4)
+        self.assertTrue(saved.game_over)
+        self.check_round_trip(saved)
+
+    def test_size(self):
+        data = savegame.pack(get_saved_game(archive.parse_game("f5d6"), 3))
+        self.assertEqual(len(data), 38 + 2)
+
+    def test_version_1(self):
+        # Written before the computer played: no level byte.
+        rgb = []
+        for color in colors:
+            rgb.extend(color)
+        saved = get_saved_game(archive.parse_game("f5d6"))
+        data = (struct.pack("<2sBBBQQ", "RV", 1, 0, saved.player, saved.white, saved.black) +
+                struct.pack("<15B", *rgb) + struct.pack("<B", 2) + "".join(map(chr, saved.moves)))
+        loaded = savegame.unpack(data)
+        self.assertEqual(loaded.moves, saved.moves)
+        self.assertEqual(loaded.colors, colors)
+        self.assertEqual(loaded.level, None)
+
+
+class BadDataTest(unittest.TestCase):
+    def setUp(self):
+        self.data = savegame.pack(get_saved_game(archive.parse_game("f5d6c3"), 1))
+
+    def test_truncated(self):
+        for size in range(len(self.data)):
+            self.assertRaises(ValueError, savegame.unpack, self.data[:size])
+
+    def test_not_a_saved_game(self):
+        self.assertRaises(ValueError, savegame.unpack, "XX" + self.data[2:])
+
+    def test_newer_version(self):
+        data = self.data[:2] + chr(savegame.VERSION + 1) + self.data[3:]
+        self.assertRaises(ValueError, savegame.unpack, data)
+
+    def test_bad_move(self):
+        self.assertRaises(ValueError, savegame.unpack, self.data[:-1] + chr(64))
+
+
+if __name__ == "__main__":
+    unittest.main()
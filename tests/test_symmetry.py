@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# test_symmetry.py - Every symmetric copy of a position has one key.
+#
+#   python -m unittest discover tests
+#
+
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rules
+import symmetry
+
+
+def get_random_positions(seed, count):
+    """Returns (own, opponent) for count positions of random games."""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = rules.Game()
+        while not game.is_over() and len(positions) < count:
+            positions.append(game.get_player_masks(game.player))
+            game.play(rng.choice(list(rules.iter_squares(game.get_legal_moves()))))
+    return positions
+
+
+class CanonicalizeTest(unittest.TestCase):
+    def setUp(self):
+        self.positions = get_random_positions(1, 300)
+        # Symmetric own masks, where the opponent's have to break the tie.
+        self.positions.append((rules.INITIAL_WHITE, rules.INITIAL_BLACK))
+        self.positions.append((rules.INITIAL_WHITE | 1 | 1 << 63, rules.INITIAL_BLACK | 1 << 7))
+        self.positions.append((0, 0))
+
+    def test_same_key_for_every_copy(self):
+        for own, opponent in self.positions:
+            key = symmetry.canonicalize(own, opponent)[:2]
+            for transform in symmetry.transforms:
+                copy = (symmetry.apply(transform, own), symmetry.apply(transform, opponent))
+                self.assertEqual(symmetry.canonicalize(*copy)[:2], key)
+
+    def test_transform_gives_key(self):
+        for own, opponent in self.positions:
+            canonical_own, canonical_opponent, transform = symmetry.canonicalize(own, opponent)
+            self.assertEqual(symmetry.apply(transform, own), canonical_own)
+            self.assertEqual(symmetry.apply(transform, opponent), canonical_opponent)
+
+    def test_smallest_copy(self):
+        # The key is the smallest (own, opponent) pair of masks packed into
+        # bytes, the first transform winning a tie.
+        for own, opponent in self.positions:
+            pairs = [(struct.pack("<Q", symmetry.apply(transform, own)),
+                      struct.pack("<Q", symmetry.apply(transform, opponent)), transform)
+                     for transform in symmetry.transforms]
+            packed_own, packed_opponent, transform = min(pairs)
+            self.assertEqual(symmetry.canonicalize(own, opponent),
+                             (struct.unpack("<Q", packed_own)[0],
+                              struct.unpack("<Q", packed_opponent)[0], transform))
+
+    def test_squares_map_back(self):
+        for own, opponent in self.positions:
+            transform = symmetry.canonicalize(own, opponent)[2]
+            for square in range(64):
+                mapped = symmetry.map_square(transform, square)
+                self.assertEqual(symmetry.apply(transform, 1 << square), 1 << mapped)
+                self.assertEqual(symmetry.unmap_square(transform, mapped), square)
+            self.assertEqual(symmetry.unmap_square(transform, None), None)
+
+    def test_moves_map_into_canonical_frame(self):
+        for own, opponent in self.positions:
+            canonical_own, canonical_opponent, transform = symmetry.canonicalize(own, opponent)
+            moves = rules.get_legal_moves(own, opponent)
+            self.assertEqual(rules.get_legal_moves(canonical_own, canonical_opponent),
+                             symmetry.apply(transform, moves))
+
+    def test_variants(self):
+        for own, opponent in self.positions[:50]:
+            self.assertEqual(symmetry.get_variants(own),
+                             [symmetry.apply(transform, own) for transform in symmetry.transforms])
+
+
+class GameTest(unittest.TestCase):
+    def test_canonicalize_game(self):
+        rng = random.Random(2)
+        game = rules.Game()
+        for ply in range(10):
+            game.play(rng.choice(list(rules.iter_squares(game.get_legal_moves()))))
+        key = symmetry.canonicalize_game(game.moves)
+        for transform in symmetry.game_transforms:
+            copy = [symmetry.map_square(transform, move) for move in game.moves]
+            self.assertEqual(symmetry.canonicalize_game(copy), key)
+        self.assertTrue(key <= tuple(game.moves))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,342 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# tournament.py - Matches between engine configurations, with Elo estimates.
+#
+# Every pairing plays the same set of balanced openings, each once with
+# either color, so neither engine profits from a lucky opening.  Games run
+# on a process pool.  Scores are reported as Elo differences with a 95%
+# confidence interval.
+#
+#   python tournament.py depth=2 depth=3 --openings 20
+#   python tournament.py new:depth=3,mobility=6 old:depth=3 --sprt 0,20
+#   python tournament.py depth=4 depth=2 depth=3 time=0.2 --gauntlet
+#
+# A configuration is an optional "name:" and then comma separated settings:
+# depth=N, time=SECONDS, eval=WEIGHTS_FILE (see train.py) and any of the
+# weights in engine.weight_names.  playouts=N, and optionally batch=N, makes
+# the Monte Carlo player of mcts.py instead.
+#
+# With two configurations, --sprt ELO0,ELO1 runs a sequential probability
+# ratio test: rounds of games continue only until it accepts that the first
+# engine is ELO1 stronger than the second (H1) or at most ELO0 (H0).
+#
+# An alpha-beta engine without a time limit plays the same moves every time,
+# so two of them replay the same games in every round.  Their pairings play
+# one round whatever --rounds says, and --sprt, which would count the
+# repeats as new evidence, needs a time limit or playouts on one side.
+#
+
+import itertools
+import math
+import multiprocessing
+import sys
+
+from optparse import OptionParser
+
+import archive
+import engine
+import rules
+import symmetry
+
+default_opening_plies = 4
+balanced_depth = 4
+# Openings scoring further from even than this at balanced_depth are skipped.
+max_opening_score = 8
+
+
+class EngineConfig:
+    def __init__(self, name, depth=engine.default_depth, time_limit=None,
+                 weights=engine.default_weights, evaluator_path=None, playouts=None,
+                 batch_size=None):
+        self.name = name
+        self.depth = depth
+        self.time_limit = time_limit
+        self.weights = weights
+        self.evaluator_path = evaluator_path
+        self.playouts = playouts
+        self.batch_size = batch_size
+
+    def create_engine(self):
+        if self.playouts is not None:
+            import mcts
+            return mcts.MCTSEngine(self.playouts, self.batch_size or mcts.default_batch_size,
+                                   time_limit=self.time_limit)
+        evaluator = None
+        if self.evaluator_path is not None:
+            evaluator = engine.read_pattern_weights(self.evaluator_path)
+        return engine.Engine(self.depth, None, self.weights, self.time_limit, evaluator)
+
+    def is_deterministic(self):
+        """Returns True if the engine always plays the same move in a
+        position: the Monte Carlo player draws random playouts, and a time
+        limit stops a search wherever the clock says."""
+        return self.playouts is None and self.time_limit is None
+
+
+def parse_config(text):
+    """Returns the EngineConfig for text, e.g. "fast:depth=2,mobility=6"."""
+    if ":" in text:
+        name, settings = text.split(":", 1)
+    else:
+        name, settings = text, text
+    depth = engine.default_depth
+    time_limit = None
+    evaluator_path = None
+    playouts = None
+    batch_size = None
+    changes = {}
+    for setting in settings.split(","):
+        if not setting:
+            continue
+        if "=" not in setting:
+            raise ValueError("setting %r is not name=value" % setting)
+        key, value = setting.split("=", 1)
+        if key == "depth":
+            depth = int(value)
+        elif key == "time":
+            time_limit = float(value)
+        elif key == "eval":
+            evaluator_path = value
+        elif key == "playouts":
+            playouts = int(value)
+        elif key == "batch":
+            batch_size = int(value)
+        else:
+            changes[key] = int(value)
+    return EngineConfig(name, depth, time_limit, engine.make_weights(changes), evaluator_path,
+                        playouts, batch_size)
+
+
+def get_balanced_openings(plies, count):
+    """Returns up to count move lists of plies moves whose positions score
+    closest to even, one for each set of symmetric copies."""
+    positions = {}
+
+    def visit(game):
+        if len(game.moves) == plies:
+            own, opponent = game.get_player_masks(game.player)
+            key = symmetry.canonicalize(own, opponent)[:2]
+            positions.setdefault(key, list(game.moves))
+            return
+        for square in rules.iter_squares(game.get_legal_moves()):
+            child = rules.Game()
+            child.restore(game.white, game.black, game.player, game.moves)
+            child.play(square)
+            visit(child)
+
+    visit(rules.Game())
+
+    judge = engine.Engine(balanced_depth)
+    scored = []
+    for moves in positions.values():
+        game = archive.replay_game(moves)
+        scores = judge.score_moves(game.white, game.black, game.player)
+        if scores and abs(scores[0][1]) <= max_opening_score:
+            scored.append((abs(scores[0][1]), moves))
+    scored.sort()
+    return [moves for score, moves in scored[:count]]
+
+
+def play_game(task):
+    """Plays one game; returns (task, first engine's score, disc differential).
+
+    A plain function of a tuple so a process pool can run it.
+    """
+    first, second, opening, first_is_white = task
+    players = {1: first.create_engine(), 2: second.create_engine()}
+    if not first_is_white:
+        players = {1: players[2], 2: players[1]}
+
+    game = archive.replay_game(opening)
+    while not game.is_over():
+        square = players[game.player].choose_move(game.white, game.black, game.player)
+        if square is None:
+            game.set_player(rules.get_opponent(game.player))
+        else:
+            game.play(square)
+
+    differential = game.get_count(1) - game.get_count(2)
+    if not first_is_white:
+        differential = -differential
+    return task, (cmp(differential, 0) + 1) / 2.0, differential
+
+
+def score_to_elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def elo_to_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+class MatchResult:
+    """The games between two configurations, from the first one's side."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.disc_sum = 0
+
+    def add(self, score, differential):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.disc_sum += differential
+
+    def get_games(self):
+        return self.wins + self.draws + self.losses
+
+    def get_score_stats(self):
+        """Returns (mean score, variance of the mean) per game."""
+        games = float(self.get_games())
+        score = (self.wins + 0.5 * self.draws) / games
+        square_mean = (self.wins + 0.25 * self.draws) / games
+        return score, (square_mean - score * score) / games
+
+    def get_elo(self):
+        """Returns (Elo difference, low, high) with a 95% confidence interval."""
+        score, variance = self.get_score_stats()
+        margin = 1.96 * math.sqrt(variance)
+        return (score_to_elo(score), score_to_elo(score - margin),
+                score_to_elo(score + margin))
+
+    def get_llr(self, elo0, elo1):
+        """The log likelihood ratio of H1 (elo1) against H0 (elo0), in the
+        normal approximation; 0 until both players have scored."""
+        score, variance = self.get_score_stats()
+        if variance <= 0:
+            return 0.0
+        score0 = elo_to_score(elo0)
+        score1 = elo_to_score(elo1)
+        return (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def get_sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def get_pairings(configs, gauntlet):
+    if gauntlet:
+        return [(configs[0], config) for config in configs[1:]]
+    return list(itertools.combinations(configs, 2))
+
+
+def is_repeatable(first, second):
+    """Returns True if first and second play the same games every round."""
+    return first.is_deterministic() and second.is_deterministic()
+
+
+def get_tasks(pairings, openings, rounds):
+    for round_index in range(rounds):
+        for first, second in pairings:
+            if round_index and is_repeatable(first, second):
+                continue
+            for opening in openings:
+                yield (first, second, opening, True)
+                yield (first, second, opening, False)
+
+
+def write_report(out, results):
+    out.write("%-24s %6s %5s %5s %5s %8s %18s %7s\n" %
+              ("pairing", "games", "wins", "draws", "loss", "elo", "95% interval", "discs"))
+    for result in results:
+        games = result.get_games()
+        if not games:
+            continue
+        elo, low, high = result.get_elo()
+        out.write("%-24s %6d %5d %5d %5d %+8.1f %18s %+7.2f\n" % (
+            "%s - %s" % (result.first.name, result.second.name), games,
+            result.wins, result.draws, result.losses, elo,
+            "%+.1f..%+.1f" % (low, high), float(result.disc_sum) / games))
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog CONFIG CONFIG... [options]")
+    parser.add_option("--openings", type="int", default=20,
+                      help="number of balanced openings each pairing plays")
+    parser.add_option("--opening-plies", type="int", default=default_opening_plies)
+    parser.add_option("--openings-file", default=None,
+                      help="take the openings from this archive instead")
+    parser.add_option("--rounds", type="int", default=1,
+                      help="times each pairing plays the openings, once if both engines are "
+                           "deterministic; the most rounds with --sprt")
+    parser.add_option("--gauntlet", action="store_true", default=False,
+                      help="play the first configuration against each other one")
+    parser.add_option("--sprt", default=None, metavar="ELO0,ELO1",
+                      help="stop once the first of two configurations is shown to be "
+                           "ELO1 stronger, or at most ELO0")
+    parser.add_option("--alpha", type="float", default=0.05)
+    parser.add_option("--beta", type="float", default=0.05)
+    parser.add_option("--jobs", type="int", default=multiprocessing.cpu_count())
+    options, args = parser.parse_args(argv)
+
+    if len(args) < 2:
+        parser.print_usage()
+        return 2
+    try:
+        configs = [parse_config(arg) for arg in args]
+    except ValueError, e:
+        parser.error(str(e))
+    sprt = None
+    if options.sprt:
+        if len(configs) != 2:
+            parser.error("--sprt needs exactly two configurations")
+        if is_repeatable(*configs):
+            parser.error("--sprt needs time= or playouts= on one side; two depth limited "
+                         "engines play the same games every round, so use more --openings")
+        sprt = [float(elo) for elo in options.sprt.split(",")]
+        if options.rounds == 1:
+            options.rounds = 100
+
+    if options.openings_file:
+        openings = list(archive.read_games(options.openings_file))
+    else:
+        openings = get_balanced_openings(options.opening_plies, options.openings)
+    pairings = get_pairings(configs, options.gauntlet)
+    results = {}
+    for first, second in pairings:
+        results[(first.name, second.name)] = MatchResult(first, second)
+    sys.stdout.write("%d pairings, %d openings, %d games per round\n" %
+                     (len(pairings), len(openings), len(pairings) * len(openings) * 2))
+    if options.rounds > 1:
+        repeatable = len([pairing for pairing in pairings if is_repeatable(*pairing)])
+        if repeatable:
+            sys.stdout.write("%d of them deterministic, playing one round only\n" % repeatable)
+    sys.stdout.write("\n")
+
+    pool = multiprocessing.Pool(options.jobs)
+    verdict = None
+    try:
+        tasks = get_tasks(pairings, openings, options.rounds)
+        for task, score, differential in pool.imap_unordered(play_game, tasks):
+            result = results[(task[0].name, task[1].name)]
+            result.add(score, differential)
+            if sprt is not None:
+                lower, upper = get_sprt_bounds(options.alpha, options.beta)
+                llr = result.get_llr(sprt[0], sprt[1])
+                if llr >= upper:
+                    verdict = "H1 accepted: %s is at least %+g Elo" % (result.first.name, sprt[1])
+                elif llr <= lower:
+                    verdict = "H0 accepted: %s is at most %+g Elo" % (result.first.name, sprt[0])
+                if verdict is not None:
+                    verdict += " (LLR %.2f after %d games)" % (llr, result.get_games())
+                    break
+    finally:
+        pool.terminate()
+
+    write_report(sys.stdout, [results[(first.name, second.name)] for first, second in pairings])
+    if sprt is not None:
+        sys.stdout.write("\n%s\n" % (verdict or "SPRT inconclusive"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,408 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# train.py - Fits the weights of engine.PatternEvaluator to games.
+#
+# Three steps, each a command:
+#
+#   python train.py selfplay games.txt --games 10000 --depth 2
+#   python train.py extract features/ games.txt [more.txt ...]
+#   python train.py fit features/ weights.bin --phases 8 --loss squares
+#
+# selfplay adds engine games to an archive (see archive.py), with random
+# moves in the opening so the games differ.  extract replays archives and
+# appends, for every position, the 16 line indices (see
+# engine.pattern_families), the number of empty squares, the mobility
+# difference and the final disc differential, all from the side to move,
+# to flat files in a directory.  fit reads those files through memory maps,
+# a chunk at a time, so the positions need not fit in memory, and fits the
+# weights of each phase by gradient descent: least squares on the disc
+# differential, or logistic regression on the result.  The weights file it
+# writes is read by engine.read_pattern_weights():
+#
+#   python tournament.py pattern:depth=3,eval=weights.bin depth=3
+#
+# extract and fit need NumPy; selfplay does not.
+#
+
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import timeit
+
+from optparse import OptionParser
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import archive
+import engine
+import rules
+
+timer = timeit.default_timer
+
+default_chunk_size = 500000
+default_phases = 8
+default_regularization = 10.0
+
+# The flat files of a feature directory: name, NumPy type, values per position.
+feature_files = (
+    ("lines", "<u2", 16),
+    ("empties", "u1", 1),
+    ("mobility", "i1", 1),
+    ("differential", "i1", 1),
+)
+
+# Where the squares of each line lie in a board of 64 squares: columns are
+# read along row_index, rows along column_index.
+_line_squares = ([[column * 8 + row for row in range(8)] for column in range(8)] +
+                 [[column * 8 + row for column in range(8)] for row in range(8)])
+
+
+def play_selfplay_game(task):
+    """Plays one game between engines of depth, the first random_plies moves
+    at random; returns its moves.  A plain function of a tuple so a process
+    pool can run it."""
+    seed, depth, random_plies = task
+    rng = random.Random(seed)
+    players = engine.Engine(depth), engine.Engine(depth)
+    game = rules.Game()
+    while not game.is_over():
+        moves = game.get_legal_moves()
+        if not moves:
+            game.set_player(rules.get_opponent(game.player))
+            continue
+        if len(game.moves) < random_plies:
+            square = rng.choice(list(rules.iter_squares(moves)))
+        else:
+            square = players[game.player - 1].choose_move(game.white, game.black, game.player)
+        game.play(square)
+    return game.moves
+
+
+def get_game_positions(moves):
+    """Yields (own, opponent, mobility difference, disc differential) for
+    every position of the game where the player to move has a move, from
+    their point of view."""
+    game = rules.Game()
+    plies = []
+    for square in moves:
+        own, opponent = game.get_player_masks(game.player)
+        mobility = (rules.count_bits(rules.get_legal_moves(own, opponent)) -
+                    rules.count_bits(rules.get_legal_moves(opponent, own)))
+        plies.append((own, opponent, mobility, game.player))
+        game.play(square)
+
+    white, black = game.get_count(1), game.get_count(2)
+    for own, opponent, mobility, player in plies:
+        if player == 1:
+            yield own, opponent, mobility, white - black
+        else:
+            yield own, opponent, mobility, black - white
+
+
+def get_line_indices(own, opponent):
+    """Returns the line indices of arrays of own and opponent masks, an
+    array of 16 uint16 per position, as engine.PatternEvaluator computes
+    them one position at a time."""
+    shifts = numpy.arange(64, dtype=numpy.uint64)
+    one = numpy.uint64(1)
+    board = ((own[:, None] >> shifts) & one).astype(numpy.int32)
+    board += 2 * ((opponent[:, None] >> shifts) & one).astype(numpy.int32)
+    powers = 3 ** numpy.arange(8, dtype=numpy.int32)
+    lines = numpy.empty((len(own), 16), numpy.uint16)
+    for line, squares in enumerate(_line_squares):
+        lines[:, line] = board[:, squares].dot(powers)
+    return lines
+
+
+class FeatureWriter:
+    """Appends positions to the files of a feature directory."""
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.files = [open(os.path.join(directory, name), "ab")
+                      for name, dtype, width in feature_files]
+        self.num_positions = 0
+
+    def write(self, positions):
+        """Appends a list of (own, opponent, mobility, differential)."""
+        if not positions:
+            return
+        own, opponent, mobility, differential = zip(*positions)
+        own = numpy.array(own, numpy.uint64)
+        opponent = numpy.array(opponent, numpy.uint64)
+        columns = [get_line_indices(own, opponent),
+                   _count_empties(own | opponent),
+                   numpy.array(mobility, numpy.int8),
+                   numpy.array(differential, numpy.int8)]
+        for out, values, (name, dtype, width) in zip(self.files, columns, feature_files):
+            values.astype(dtype).tofile(out)
+        self.num_positions += len(positions)
+
+    def close(self):
+        for out in self.files:
+            out.close()
+
+
+def _count_empties(occupied):
+    shifts = numpy.arange(64, dtype=numpy.uint64)
+    discs = ((occupied[:, None] >> shifts) & numpy.uint64(1)).sum(axis=1)
+    return (64 - discs).astype(numpy.uint8)
+
+
+def read_features(directory):
+    """Returns {name: read only memory map} for the files of a feature directory."""
+    sizes = {}
+    features = {}
+    for name, dtype, width in feature_files:
+        path = os.path.join(directory, name)
+        itemsize = numpy.dtype(dtype).itemsize * width
+        sizes[name] = os.path.getsize(path) // itemsize
+    num_positions = min(sizes.values())
+    if max(sizes.values()) != num_positions:
+        raise ValueError("the files in %s hold different numbers of positions" % directory)
+    for name, dtype, width in feature_files:
+        if num_positions == 0:
+            features[name] = numpy.zeros((0, width) if width > 1 else 0, dtype)
+            continue
+        shape = (num_positions, width) if width > 1 else (num_positions,)
+        features[name] = numpy.memmap(os.path.join(directory, name), dtype, "r", shape=shape)
+    return features
+
+
+class Fit:
+    """Fits the weights of num_phases phases by gradient descent.
+
+    Each position has 19 features: its 16 lines, each of which picks one
+    weight of its family's table, and the mobility difference, the parity
+    (1 if the side to move gets the last move, else -1) and a constant 1,
+    which multiply their weights.  The weights of every phase lie in one
+    vector, so one pass over the positions fits all phases.  Each step is
+    divided by how much each weight is used, which keeps the step even
+    between common and rare patterns.  regularization pulls every weight
+    towards 0 as if it had been seen that many more times with an error of
+    0, which keeps rare patterns from fitting their few positions exactly.
+    """
+
+    def __init__(self, features, num_phases=default_phases, loss="squares", rate=None,
+                 chunk_size=default_chunk_size, holdout=0.0,
+                 regularization=default_regularization):
+        if loss not in ("squares", "logistic"):
+            raise ValueError("no loss %s" % loss)
+        self.features = features
+        self.num_phases = num_phases
+        self.loss = loss
+        if rate is None:
+            # The logistic gradient is at most a quarter of the error's.
+            rate = 0.05 if loss == "squares" else 0.2
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.regularization = regularization
+        self.weights = numpy.zeros(num_phases * engine.pattern_phase_size)
+        num_positions = len(features["empties"])
+        self.num_training = num_positions - int(num_positions * holdout)
+        self.num_positions = num_positions
+
+        family = numpy.zeros(16, numpy.int64)
+        for index, lines in enumerate(engine.pattern_families):
+            family[list(lines)] = index * engine.pattern_size
+        self.line_offsets = family
+        self.phase_of_empties = numpy.array([engine.get_phase(min(empties, 60), num_phases)
+                                             for empties in range(65)], numpy.int64)
+        self.scale = self.get_scale()
+
+    def iter_chunks(self, start, stop):
+        """Yields (columns, values, target) for chunks of the positions from
+        start to stop: the index of each position's 19 weights, their
+        multipliers and what the fit aims at."""
+        features = self.features
+        extra = len(engine.pattern_families) * engine.pattern_size
+        for begin in range(start, stop, self.chunk_size):
+            end = min(begin + self.chunk_size, stop)
+            empties = numpy.asarray(features["empties"][begin:end], numpy.int64)
+            base = self.phase_of_empties[empties] * engine.pattern_phase_size
+            columns = numpy.empty((end - begin, 19), numpy.int64)
+            columns[:, :16] = numpy.asarray(features["lines"][begin:end], numpy.int64)
+            columns[:, :16] += self.line_offsets
+            columns[:, 16:] = extra + numpy.arange(3)
+            columns += base[:, None]
+
+            values = numpy.ones((end - begin, 19))
+            values[:, 16] = features["mobility"][begin:end]
+            values[:, 17] = numpy.where(empties & 1, 1.0, -1.0)
+
+            differential = numpy.asarray(features["differential"][begin:end], numpy.float64)
+            if self.loss == "squares":
+                target = differential
+            else:
+                target = (numpy.sign(differential) + 1) / 2
+            yield columns, values, target
+
+    def get_scale(self):
+        """Returns how much each weight is used, the sum of its squared
+        multipliers over the training positions, at least 1."""
+        scale = numpy.zeros(len(self.weights))
+        for columns, values, target in self.iter_chunks(0, self.num_training):
+            scale += numpy.bincount(columns.ravel(), (values * values).ravel(), len(scale))
+        return numpy.maximum(scale, 1) + self.regularization
+
+    def predict(self, columns, values):
+        score = (self.weights[columns] * values).sum(axis=1)
+        if self.loss == "logistic":
+            score = 1 / (1 + numpy.exp(-score))
+        return score
+
+    def get_loss(self, start, stop):
+        """Returns the mean loss from start to stop: the squared error in
+        discs, or the log loss."""
+        total = 0.0
+        for columns, values, target in self.iter_chunks(start, stop):
+            total += self.get_chunk_loss(self.predict(columns, values), target)
+        return total / max(stop - start, 1)
+
+    def get_chunk_loss(self, prediction, target):
+        if self.loss == "squares":
+            return ((prediction - target) ** 2).sum()
+        prediction = numpy.clip(prediction, 1e-12, 1 - 1e-12)
+        return -(target * numpy.log(prediction) + (1 - target) * numpy.log(1 - prediction)).sum()
+
+    def step(self):
+        """Takes one gradient step over the training positions; returns the
+        mean training loss before it."""
+        gradient = numpy.zeros(len(self.weights))
+        total = 0.0
+        for columns, values, target in self.iter_chunks(0, self.num_training):
+            prediction = self.predict(columns, values)
+            total += self.get_chunk_loss(prediction, target)
+            error = prediction - target
+            gradient += numpy.bincount(columns.ravel(), (values * error[:, None]).ravel(),
+                                       len(gradient))
+        gradient += self.regularization * self.weights
+        self.weights -= self.rate * gradient / self.scale
+        return total / max(self.num_training, 1)
+
+    def get_holdout_loss(self):
+        if self.num_training == self.num_positions:
+            return None
+        return self.get_loss(self.num_training, self.num_positions)
+
+    def write(self, path):
+        out = open(path, "wb")
+        out.write(engine._pattern_header.pack(engine.PATTERN_MAGIC, engine.PATTERN_VERSION,
+                                              self.num_phases))
+        self.weights.astype("<f4").tofile(out)
+        out.close()
+
+
+def selfplay(options, args):
+    if len(args) != 1:
+        return False
+    tasks = [(options.seed + index, options.depth, options.random_plies)
+             for index in range(options.games)]
+    pool = multiprocessing.Pool(options.jobs)
+    out = open(args[0], "a")
+    start = timer()
+    try:
+        for index, moves in enumerate(pool.imap_unordered(play_selfplay_game, tasks)):
+            out.write(archive.format_game(moves) + "\n")
+            sys.stderr.write("\r%d games" % (index + 1))
+    finally:
+        pool.terminate()
+        out.close()
+    print "\rtrain.py - played %d games in %.1f s" % (options.games, timer() - start)
+    return True
+
+
+def extract(options, args):
+    if len(args) < 2:
+        return False
+
+    def positions():
+        for path in args[1:]:
+            # get_game_positions() replays every game, which checks its moves.
+            for moves in archive.read_games(path, False):
+                for position in get_game_positions(moves):
+                    yield position
+
+    writer = FeatureWriter(args[0])
+    start = timer()
+    positions = positions()
+    while True:
+        chunk = list(itertools.islice(positions, options.chunk_size))
+        if not chunk:
+            break
+        writer.write(chunk)
+        sys.stderr.write("\r%d positions" % writer.num_positions)
+    writer.close()
+    print "\rtrain.py - extracted %d positions in %.1f s" % (writer.num_positions,
+                                                           timer() - start)
+    return True
+
+
+def fit(options, args):
+    if len(args) != 2:
+        return False
+    model = Fit(read_features(args[0]), options.phases, options.loss, options.rate,
+                options.chunk_size, options.holdout, options.regularization)
+    print "train.py - fitting %d positions, %d held out" % (
+        model.num_training, model.num_positions - model.num_training)
+    best = None
+    for epoch in range(options.epochs):
+        start = timer()
+        loss = model.step()
+        holdout = model.get_holdout_loss()
+        line = "epoch %3d  loss %10.4f" % (epoch + 1, loss)
+        if holdout is not None:
+            line += "  held out %10.4f" % holdout
+        print "%s  (%.1f s)" % (line, timer() - start)
+        # Keep the weights that did best on the held out positions.
+        if holdout is None or best is None or holdout < best:
+            best = holdout
+            model.write(args[1])
+    return True
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog selfplay ARCHIVE [options]\n"
+                                "       %prog extract DIRECTORY ARCHIVE... [options]\n"
+                                "       %prog fit DIRECTORY WEIGHTS [options]")
+    parser.add_option("--games", type="int", default=1000, help="selfplay: games to play")
+    parser.add_option("--depth", type="int", default=2, help="selfplay: search depth")
+    parser.add_option("--random-plies", type="int", default=8,
+                      help="selfplay: opening moves played at random")
+    parser.add_option("--seed", type="int", default=1)
+    parser.add_option("--jobs", type="int", default=multiprocessing.cpu_count())
+    parser.add_option("--chunk-size", type="int", default=default_chunk_size,
+                      help="positions handled at a time")
+    parser.add_option("--phases", type="int", default=default_phases)
+    parser.add_option("--loss", choices=["squares", "logistic"], default="squares")
+    parser.add_option("--rate", type="float", default=None, help="fit: step size")
+    parser.add_option("--epochs", type="int", default=50)
+    parser.add_option("--regularization", type="float", default=default_regularization,
+                      help="fit: how strongly weights are pulled towards 0")
+    parser.add_option("--holdout", type="float", default=0.1,
+                      help="fit: share of the positions, the last ones, kept out of "
+                           "the fit to measure it")
+    options, args = parser.parse_args(argv)
+
+    commands = {"selfplay": selfplay, "extract": extract, "fit": fit}
+    if not args or args[0] not in commands:
+        parser.print_usage()
+        return 2
+    if args[0] != "selfplay" and numpy is None:
+        sys.stderr.write("train.py %s needs NumPy\n" % args[0])
+        return 1
+    if not commands[args[0]](options, args[1:]):
+        parser.print_usage()
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))